@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+from typing import TYPE_CHECKING
+import time
+from concurrent.futures import ThreadPoolExecutor
+from RAGPipeline.TextsRAGPipline import TextsRAGPipeline
+from RAGPipeline.retriever.BaseRetriever import BaseRetriever
+from datasets import Dataset
+import utils.colored_print as cprint
+from utils.logger import Logger, log_time_breakdown
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+# model wrappers are only needed for type hints, importing them would pull in vllm, ragas, ...
+if TYPE_CHECKING:
+    from RAGPipeline.responser.TextsResponser import AsyncVLLMResponser
+    from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
+    from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
+    from evaluator.RagasEvaluator import RagasEvaluator
+
+
+class AsyncTextsRAGPipeline(TextsRAGPipeline):
+    """
+    asyncio-native variant of the text query path. Every question is its own task on one event
+    loop: embedding and reranking run in thread pool executors, retrieval goes through the DB
+    client's async API when it has one (`async_query_search`), and generation streams tokens from
+    a vLLM AsyncLLMEngine. Up to `max_inflight` requests are in flight at the same time.
+
+    Besides the usual spans (batch id is the request id, every request is its own batch), the
+    time-to-first-token and inter-token latency of every request are reported.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        responser: AsyncVLLMResponser,
+        embedder: SentenceTransformerEncoder,
+        reranker: CrossEncoderReranker = None,
+        evaluator: RagasEvaluator = None,
+        executor_workers=4,
+    ) -> None:
+        super().__init__(retriever, responser, embedder, reranker, evaluator)
+        self.executor_workers = executor_workers
+        self.__embed_executor = None
+        self.__rerank_executor = None
+        self.__retrieve_executor = None
+        return
+
+    async def __run_in(self, executor, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    async def run_request(self, req_id, question, submit_ns=None) -> dict:
+        """
+        Run one question through embed, retrieve, rerank, prompt and streaming generation. Returns
+        a record with the request timestamps, the token timestamps, the context and the response.
+        """
+        start_ns = time.monotonic_ns()
+        record = {
+            "req_id": req_id,
+            "question": question,
+            "submit_ns": start_ns if submit_ns is None else submit_ns,
+            "start_ns": start_ns,
+        }
+
+        with self.tracer.span("embed", req_id, [req_id]):
+            # a single question, a progress bar per request would flood the output
+            vectors = await self.__run_in(
+                self.__embed_executor,
+                functools.partial(self.embedder.embedding, show_progress_bar=False),
+                [question],
+            )
+
+        with self.tracer.span("retrieve", req_id, [req_id]) as span:
+            context = await self.retriever.asearch_db(vectors[0], self.__retrieve_executor)
+            span["top_k"] = self.retriever.top_k
+            span["n_candidates"] = len(context)
+
+        if self.reranker is not None:
+            with self.tracer.span("rerank", req_id, [req_id]) as span:
+                span["n_candidates"] = len(context)
+                reranked = await self.__run_in(
+                    self.__rerank_executor, self.reranker.batch_rerank, [question], [context]
+                )
+                context = reranked[0]
+                span["top_k"] = self.reranker.top_n
+
+        with self.tracer.span("prompt", req_id, [req_id]) as span:
+            prompt = self.generate_prompt([question], [context])[0]
+            span["n_candidates"] = len(context)
+
+        with self.tracer.span("generate", req_id, [req_id]) as span:
+            generate_start_ns = time.monotonic_ns()
+            response, token_timestamps = await self.responser.aquery_llm(prompt)
+            span["output_tokens"] = len(token_timestamps)
+
+        record |= {
+            "generate_start_ns": generate_start_ns,
+            "token_ns": token_timestamps,
+            "done_ns": time.monotonic_ns(),
+            "context": context,
+            "response": response,
+        }
+        return record
+
+    async def run_requests(self, questions, max_inflight=1024) -> list[dict]:
+        """
+        Launch every question as its own task, at most `max_inflight` running at once. A failed
+        request gets a record with its `error` instead, the others are still measured.
+        """
+        inflight = asyncio.Semaphore(max_inflight)
+
+        async def bounded_request(req_id, question):
+            submit_ns = time.monotonic_ns()
+            async with inflight:
+                try:
+                    return await self.run_request(req_id, question, submit_ns)
+                except Exception as e:
+                    return {
+                        "req_id": req_id,
+                        "question": question,
+                        "submit_ns": submit_ns,
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+
+        return await asyncio.gather(
+            *[bounded_request(req_id, question) for req_id, question in enumerate(questions)]
+        )
+
+    def __start_executors(self):
+        self.__embed_executor = ThreadPoolExecutor(self.executor_workers, "async_embed")
+        self.__rerank_executor = ThreadPoolExecutor(self.executor_workers, "async_rerank")
+        self.__retrieve_executor = ThreadPoolExecutor(self.executor_workers, "async_retrieve")
+
+    def __stop_executors(self):
+        for executor in [self.__embed_executor, self.__rerank_executor, self.__retrieve_executor]:
+            executor.shutdown(wait=True)
+        self.__embed_executor = None
+        self.__rerank_executor = None
+        self.__retrieve_executor = None
+
+    def report_request_stats(self, records, wall_time) -> dict:
+        """
+        Per-request TTFT and inter-token latency (ITL), one row per request in
+        async_pipeline_requests.txt, the distributions in async_pipeline_stats.txt
+        """
+        e2e_latency = [record["done_ns"] - record["submit_ns"] for record in records]
+        queue_latency = [record["start_ns"] - record["submit_ns"] for record in records]
+        ttft = [
+            record["token_ns"][0] - record["submit_ns"] for record in records if record["token_ns"]
+        ]
+        # the gaps between consecutive tokens of every request, pooled over all requests
+        itl = [
+            later - earlier
+            for record in records
+            for earlier, later in zip(record["token_ns"][:-1], record["token_ns"][1:])
+        ]
+        output_tokens = sum(len(record["token_ns"]) for record in records)
+        summary = {
+            "requests": len(records),
+            "throughput": len(records) / (wall_time / 1e9),
+            "token_throughput": output_tokens / (wall_time / 1e9),
+            "e2e": summarize_latency(e2e_latency),
+            "queue": summarize_latency(queue_latency),
+            "ttft": summarize_latency(ttft),
+            "itl": summarize_latency(itl),
+        }
+        print(
+            f"Async run: {summary['requests']} requests in {wall_time / 1e9:.3f} s, "
+            f"throughput {summary['throughput']:.3f} req/s, "
+            f"{summary['token_throughput']:.3f} tokens/s\n"
+            f"  end-to-end latency: {format_latency_summary(summary['e2e'])}\n"
+            f"  queueing latency:   {format_latency_summary(summary['queue'])}\n"
+            f"  time to 1st token:  {format_latency_summary(summary['ttft'])}\n"
+            f"  inter-token:        {format_latency_summary(summary['itl'])}"
+        )
+
+        output_dir = Logger().log_dirpath
+        with open(os.path.join(output_dir, "async_pipeline_requests.txt"), "w") as fout:
+            for record in records:
+                token_ns = record["token_ns"]
+                first_token_ns = token_ns[0] if token_ns else record["done_ns"]
+                mean_itl = (
+                    (token_ns[-1] - token_ns[0]) / (len(token_ns) - 1) if len(token_ns) > 1 else 0
+                )
+                fout.write(
+                    f"{record['req_id']}\t"
+                    f"{record['submit_ns']}\t"
+                    f"{record['start_ns']}\t"
+                    f"{record['generate_start_ns']}\t"
+                    f"{first_token_ns}\t"
+                    f"{record['done_ns']}\t"
+                    f"{len(token_ns)}\t"
+                    f"{first_token_ns - record['submit_ns']}\t"
+                    f"{mean_itl:.0f}\n"
+                )
+        with open(os.path.join(output_dir, "async_pipeline_stats.txt"), "w") as fout:
+            fout.write(
+                f"throughput\t{summary['throughput']:.6f}\t{summary['token_throughput']:.6f}\n"
+            )
+            for key in ["e2e", "queue", "ttft", "itl"]:
+                fout.write(
+                    f"{key}\t"
+                    + "\t".join(
+                        f"{value}" if name == "count" else f"{value:.0f}"
+                        for name, value in summary[key].items()
+                    )
+                    + "\n"
+                )
+        return summary
+
+    def process(self, request, max_inflight=1024) -> None:
+        if request.req_type == "query":
+            # fetch all questions up front so that dataset loading is not part of the timed region
+            questions, gt_answer = request.get_questions(request.req_count, start_idx=0)
+            cprint.iprintf(
+                f"*** Processing {len(questions)} questions asynchronously, "
+                f"at most {max_inflight} in flight"
+            )
+            log_time_breakdown("start")
+            self.load_models()
+            self.__start_executors()
+
+            log_time_breakdown("async")
+            pipeline_start_time = time.monotonic_ns()
+            # on the responser's loop, where its engine runs
+            records = self.responser.run(self.run_requests(questions, max_inflight))
+            pipeline_end_time = time.monotonic_ns()
+            self.__stop_executors()
+
+            failed = [record for record in records if "error" in record]
+            records = [record for record in records if "error" not in record]
+            if len(failed) > 0:
+                cprint.wprintf(
+                    f"*** {len(failed)} async requests failed, first: {failed[0]['error']}"
+                )
+                output_path = os.path.join(Logger().log_dirpath, "async_pipeline_errors.txt")
+                with open(output_path, "w") as fout:
+                    for record in failed:
+                        fout.write(f"{record['req_id']}\t{record['error']}\n")
+            if len(records) == 0:
+                self.free_models()
+                raise RuntimeError(f"No async request completed ({len(failed)} failed)")
+
+            # only the answered questions are evaluated
+            evaluate_dataset = Dataset.from_dict(
+                {
+                    "user_input": [record["question"] for record in records],
+                    "response": [record["response"] for record in records],
+                    "retrieved_contexts": [record["context"] for record in records],
+                    "reference": [gt_answer[record["req_id"]] for record in records],
+                }
+            )
+            # finished
+            log_time_breakdown("free_models")
+            self.free_models()
+            log_time_breakdown("done")
+            if self.evaluator is not None:
+                print("***Evaluating answers")
+                self.evaluator.evaluate_dataset(evaluate_dataset)
+
+            self.tracer.dump("async_pipeline")
+            self.report_request_stats(records, pipeline_end_time - pipeline_start_time)
+        return
@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import pickle
+import time
+
+import utils.colored_print as cprint
+from utils.logger import log_time_breakdown
+
+
+class IngestManifest:
+    """
+    JSON manifest of a sharded ingest. It holds the parameters the ingest was started with and the
+    progress of every shard, and is rewritten atomically (temp file + rename) on every update, so
+    a crash leaves either the previous or the new version on disk.
+
+    A shard is `embedded` once its chunks and embeddings are saved next to the manifest,
+    `inserting` with `acked_batches` insert batches acknowledged by the vector DB, then `done`.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        if os.path.isfile(path):
+            with open(path, "r") as fin:
+                self.data = json.load(fin)
+            if self.data["params"] != params:
+                raise ValueError(
+                    f"Ingest manifest {path} was created with different parameters "
+                    f"{self.data['params']}, expect {params}. Remove it or use another "
+                    f"checkpoint directory to start over."
+                )
+        else:
+            self.data = {"params": params, "collection_prepared": False, "shards": {}}
+            self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fout:
+            json.dump(self.data, fout, indent=2)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_path, self.path)
+
+    def get_shard(self, shard_idx) -> dict:
+        return self.data["shards"].get(str(shard_idx), {"status": "pending"})
+
+    def update_shard(self, shard_idx, **state):
+        self.data["shards"].setdefault(str(shard_idx), {}).update(state)
+        self.save()
+
+    def has_progress(self) -> bool:
+        return any(
+            shard.get("acked_batches", 0) > 0 or shard["status"] == "done"
+            for shard in self.data["shards"].values()
+        )
+
+
+class CheckpointedIngester:
+    """
+    Resumable preprocess -> embed -> insert of the first `samples_length` documents of a text
+    dataset, `shard_size` documents at a time. Progress is checkpointed in `checkpoint_dir` at
+    shard granularity: a restarted run skips completed shards, reuses the saved chunks and
+    embeddings of a shard interrupted during insertion and resumes it after its last acknowledged
+    insert batch. A batch inserted right before a crash but not yet acknowledged is inserted again
+    (at-least-once).
+
+    `prepare_collection(dim)`, if given, is called once before the very first insertion (e.g. to
+    create a LanceDB table), and never on a resumed ingest that already inserted data.
+    """
+
+    def __init__(
+        self,
+        loader,
+        chunker,
+        embedder,
+        db_client,
+        collection_name,
+        samples_length,
+        shard_size,
+        checkpoint_dir,
+        insert_batch_size=512,
+        params=None,
+        prepare_collection=None,
+        keep_shard_files=False,
+    ):
+        self.loader = loader
+        self.chunker = chunker
+        self.embedder = embedder
+        self.db_client = db_client
+        self.collection_name = collection_name
+        self.samples_length = samples_length
+        self.shard_size = shard_size
+        self.nshards = int(math.ceil(samples_length / shard_size))
+        self.checkpoint_dir = checkpoint_dir
+        self.insert_batch_size = insert_batch_size
+        self.prepare_collection = prepare_collection
+        self.keep_shard_files = keep_shard_files
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.manifest = IngestManifest(
+            os.path.join(checkpoint_dir, f"{collection_name}_ingest_manifest.json"),
+            {
+                "dataset": loader.dataset_name,
+                "collection": collection_name,
+                "samples_length": samples_length,
+                "shard_size": shard_size,
+                "insert_batch_size": insert_batch_size,
+            }
+            | (params or {}),
+        )
+
+    def __shard_path(self, shard_idx):
+        return os.path.join(self.checkpoint_dir, f"{self.collection_name}_shard_{shard_idx}.pickle")
+
+    def __load_shard(self, shard_idx):
+        """Chunk and embed one shard, saving the result before anything is inserted"""
+        log_time_breakdown("load")
+        df = self.loader.get_dataset_slice(length=self.shard_size, offset=shard_idx)
+        # the last shard stops at samples_length
+        df = df.iloc[: self.samples_length - shard_idx * self.shard_size]
+        log_time_breakdown("chunking")
+        chunks = self.chunker.chunking_text_to_text(df)
+        log_time_breakdown("embed")
+        embeddings = self.embedder.embedding(chunks)
+
+        shard_path = self.__shard_path(shard_idx)
+        with open(f"{shard_path}.tmp", "wb") as handle:
+            pickle.dump(
+                {"chunks": chunks, "embeddings": embeddings},
+                handle,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(f"{shard_path}.tmp", shard_path)
+        # batches acknowledged before the shard file was lost stay acknowledged
+        acked_batches = self.manifest.get_shard(shard_idx).get("acked_batches", 0)
+        self.manifest.update_shard(
+            shard_idx,
+            status="embedded" if acked_batches == 0 else "inserting",
+            docs=len(df),
+            chunks=len(chunks),
+            acked_batches=acked_batches,
+        )
+        return chunks, embeddings
+
+    def __insert_shard(self, shard_idx, chunks, embeddings):
+        log_time_breakdown("insert")
+        if not self.manifest.data["collection_prepared"]:
+            if self.prepare_collection is not None and not self.manifest.has_progress():
+                self.prepare_collection(len(embeddings[0]))
+            self.manifest.data["collection_prepared"] = True
+            self.manifest.save()
+
+        nbatches = int(math.ceil(len(chunks) / self.insert_batch_size))
+        acked_batches = self.manifest.get_shard(shard_idx).get("acked_batches", 0)
+        if acked_batches > 0:
+            cprint.iprintf(
+                f"*** Resuming shard {shard_idx} at insert batch {acked_batches}/{nbatches}"
+            )
+        for batch_idx in range(acked_batches, nbatches):
+            start_idx = batch_idx * self.insert_batch_size
+            end_idx = start_idx + self.insert_batch_size
+            self.db_client.insert_data_vector(
+                vector=embeddings[start_idx:end_idx],
+                chunks=chunks[start_idx:end_idx],
+                collection_name=self.collection_name,
+                insert_batch_size=self.insert_batch_size,
+                create_collection=True,
+            )
+            self.manifest.update_shard(shard_idx, status="inserting", acked_batches=batch_idx + 1)
+
+    def run(self) -> dict:
+        if self.manifest.has_progress():
+            cprint.iprintf(f"*** Resuming ingest from {self.manifest.path}")
+            # backends assigning their own sequential ids must not overwrite inserted data
+            if hasattr(self.db_client, "sync_id_num"):
+                self.db_client.sync_id_num(self.collection_name)
+
+        stats = {"shards": self.nshards, "skipped": 0, "resumed": 0, "chunks": 0}
+        for shard_idx in range(self.nshards):
+            shard = self.manifest.get_shard(shard_idx)
+            if shard["status"] == "done":
+                stats["skipped"] += 1
+                stats["chunks"] += shard["chunks"]
+                continue
+
+            start_time = time.monotonic_ns()
+            shard_path = self.__shard_path(shard_idx)
+            if shard["status"] in ["embedded", "inserting"] and os.path.isfile(shard_path):
+                with open(shard_path, "rb") as handle:
+                    shard_data = pickle.load(handle)
+                chunks, embeddings = shard_data["chunks"], shard_data["embeddings"]
+                stats["resumed"] += 1
+            else:
+                chunks, embeddings = self.__load_shard(shard_idx)
+            self.__insert_shard(shard_idx, chunks, embeddings)
+
+            self.manifest.update_shard(shard_idx, status="done")
+            if not self.keep_shard_files:
+                os.remove(shard_path)
+            stats["chunks"] += len(chunks)
+            cprint.iprintf(
+                f"*** Shard {shard_idx + 1}/{self.nshards} done: {len(chunks)} chunks in "
+                f"{(time.monotonic_ns() - start_time) / 1e9:.3f} s"
+            )
+
+        cprint.iprintf(
+            f"*** Ingest done: {stats['chunks']} chunks in {stats['shards']} shards, "
+            f"{stats['skipped']} already done, {stats['resumed']} resumed"
+        )
+        return stats
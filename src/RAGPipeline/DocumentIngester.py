@@ -0,0 +1,43 @@
+import time
+
+
+class DocumentIngester:
+    """
+    Online write path: chunk freshly arrived documents, embed the chunks and append them to the
+    collection through `insert_data_vector`, while the same vector DB keeps serving queries. The
+    embedder is shared with the query pipeline, so writes also compete for the embedding model.
+    `ingest` may be called from several threads at once, backends numbering points themselves
+    reserve a disjoint id range for every insertion (e.g. qdrant_client.reserve_ids).
+    """
+
+    def __init__(self, db_client, collection_name, embedder, chunker, insert_batch_size=512):
+        self.db_client = db_client
+        self.collection_name = collection_name
+        self.embedder = embedder
+        self.chunker = chunker
+        self.insert_batch_size = insert_batch_size
+        # backends assigning their own sequential ids must not overwrite what is already there
+        if hasattr(db_client, "sync_id_num"):
+            db_client.sync_id_num(collection_name)
+
+    def ingest(self, documents) -> dict:
+        """Insert `documents` (list of texts), returns the number of chunks and time of each step"""
+        start_time = time.monotonic_ns()
+        chunks = self.chunker.chunking_text_to_text({"content": documents})
+        chunk_time = time.monotonic_ns()
+        vectors = self.embedder.embedding(chunks)
+        embed_time = time.monotonic_ns()
+        self.db_client.insert_data_vector(
+            vector=vectors,
+            chunks=chunks,
+            collection_name=self.collection_name,
+            insert_batch_size=self.insert_batch_size,
+        )
+        insert_time = time.monotonic_ns()
+        return {
+            "docs": len(documents),
+            "chunks": len(chunks),
+            "chunk_ns": chunk_time - start_time,
+            "embed_ns": embed_time - chunk_time,
+            "insert_ns": insert_time - embed_time,
+        }
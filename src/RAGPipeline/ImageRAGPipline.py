@@ -1,18 +1,23 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
 import os
+from typing import TYPE_CHECKING
 import time
-import math
-from RAGPipeline.responser.TextsResponser import VLLMResponser
 from RAGPipeline.BaseRAGPipline import BaseRAGPipeline
-from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
 from RAGPipeline.retriever.BaseRetriever import BaseRetriever
-from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
-from evaluator.RagasEvaluator import RagasEvaluator
 from datasets import Dataset
 import utils.colored_print as cprint
 from utils.logger import Logger, log_time_breakdown
+from utils.span_tracer import SpanTracer
 from qwen_vl_utils import process_vision_info
 
+# model wrappers are only needed for type hints, importing them would pull in vllm, ragas, ...
+if TYPE_CHECKING:
+    from RAGPipeline.responser.TextsResponser import VLLMResponser
+    from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
+    from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
+    from evaluator.RagasEvaluator import RagasEvaluator
 
 # should make the pipeline fully modular with request queue passing
 
@@ -33,6 +38,7 @@ class ImagesRAGPipeline(BaseRAGPipeline):
         self.retriever = retriever
         self.responser = responser
         self.embedder = embedder
+        self.tracer = SpanTracer()
         return
 
     def generate_prompt(self, questions, contexts):
@@ -57,39 +63,34 @@ class ImagesRAGPipeline(BaseRAGPipeline):
             self.responser.load_llm()
             cprint.iprintf(f"*** Loading models done")
 
-            nrounds = int(math.ceil(request.req_count / batch_size))
-            cprint.iprintf(f"*** Will run {nrounds} rounds")
-            for round_idx in range(0, nrounds):
-                start_sample_idx = round_idx * batch_size
-                questions, gt_answer = request.get_questions(batch_size, start_idx=start_sample_idx)
             print(f"***Processing {request.req_count} questions")
-            for i in range(0, request.req_count, batch_size):
+            for batch_idx, i in enumerate(range(0, request.req_count, batch_size)):
                 questions, gt_answer = request.get_questions(batch_size, start_idx=i)
+                req_ids = list(range(i, i + len(questions)))
 
                 # encode questions TODO: parameter
                 # Embedding chunked texts
                 # self.embedder.load_encoder()
                 log_time_breakdown("embed")
-                embedding_start_time = time.monotonic_ns()
-                vectors = self.embedder.embedding_query(questions)
-                embedding_end_time = time.monotonic_ns()
+                with self.tracer.span("embed", batch_idx, req_ids):
+                    vectors = self.embedder.embedding_query(questions)
                 # self.embedder.free_encoder()
                 cprint.iprintf(f"*** Embedding done")
 
-                for i, query in enumerate(vectors):
+                for j, query in enumerate(vectors):
                     query = query.float().numpy()
                     # retrieval
                     log_time_breakdown("retrieve")
-                    retrieval_start_time = time.monotonic_ns()
-                    results = self.retriever.search_db_image(query)
-                    retrieval_end_time = time.monotonic_ns()
+                    with self.tracer.span("retrieve", batch_idx, [req_ids[j]]) as span:
+                        results = self.retriever.search_db_image(query)
+                        span["top_k"] = self.retriever.top_k
+                        span["n_candidates"] = len(results)
                     cprint.iprintf(f"*** Retrieval done")
 
                     # augment
                     log_time_breakdown("prompt")
-                    prompt_start_time = time.monotonic_ns()
-                    prompts = self.generate_prompt(questions[i], results)
-                    prompt_end_time = time.monotonic_ns()
+                    with self.tracer.span("prompt", batch_idx, [req_ids[j]]):
+                        prompts = self.generate_prompt(questions[j], results)
                     cprint.iprintf(f"*** Prompt generation done")
                     with open("prompt.out", "w") as fout:
                         for idx, prompt in enumerate(prompts):
@@ -100,9 +101,8 @@ class ImagesRAGPipeline(BaseRAGPipeline):
                     cprint.iprintf(f"*** Generating answers")
                     # self.responser.load_llm()
                     log_time_breakdown("generate")
-                    generation_start_time = time.monotonic_ns()
-                    responses = self.responser.query_llm(prompts)
-                    generation_end_time = time.monotonic_ns()
+                    with self.tracer.span("generate", batch_idx, [req_ids[j]]):
+                        responses = self.responser.query_llm(prompts)
                     # self.responser.free_llm()
                     cprint.iprintf(f"*** Generation done")
 
@@ -118,26 +118,15 @@ class ImagesRAGPipeline(BaseRAGPipeline):
             self.responser.free_llm()
             cprint.iprintf(f"*** Unloading models done")
             log_time_breakdown("done")
-            embedding_time = embedding_end_time - embedding_start_time
-            retrieval_time = retrieval_end_time - retrieval_start_time
-            prompt_time = prompt_end_time - prompt_start_time
-            generation_time = generation_end_time - generation_start_time
-            total_time = embedding_time + retrieval_time + prompt_time + generation_time
-            print(
-                f"At round {round_idx}\n"
-                f"  embedding time:  {embedding_time} ns ({embedding_time / 1e9} s, ({embedding_time / total_time * 100:.2f}%)\n"
-                f"  retrieval time:  {retrieval_time} ns ({retrieval_time / 1e9} s, ({retrieval_time / total_time * 100:.2f}%)\n"
-                f"  prompt time:     {prompt_time} ns ({prompt_time / 1e9} s, ({prompt_time / total_time * 100:.2f}%)\n"
-                f"  generation time: {generation_time} ns ({generation_time / 1e9} s, ({generation_time / total_time * 100:.2f}%)\n"
-            )
+            self.tracer.dump("image_pipeline")
+            stages = ["embed", "retrieve", "prompt", "generate"]
             output_path = os.path.join(Logger().log_dirpath, "text_pipeline_stats.txt")
             with open(output_path, "a") as fout:
-                fout.write(
-                    f"{round_idx}\t"
-                    f"{embedding_time}\t"
-                    f"{retrieval_time}\t"
-                    f"{prompt_time}\t"
-                    f"{generation_time}\t"
-                    f"{total_time}\n"
-                )
+                for round_idx, latencies in sorted(self.tracer.batch_latencies().items()):
+                    stage_times = [latencies.get(stage, 0) for stage in stages]
+                    fout.write(
+                        f"{round_idx}\t"
+                        + "".join(f"{stage_time}\t" for stage_time in stage_times)
+                        + f"{sum(stage_times)}\n"
+                    )
         return
@@ -0,0 +1,286 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+
+class MicroBatcher:
+    """
+    Collect individual items into micro-batches for one stage. A batch closes as soon as it holds
+    `max_batch_size` items or its oldest item has waited `max_wait_ms`, whichever comes first
+    (with `max_wait_ms` of 0 the batch takes whatever is already waiting). `func` maps a list of
+    items to a list of results, each submitted item returns a Future resolving to its result.
+
+    Every closed batch is recorded with its size, fill ratio, close reason and the time each of
+    its items waited in this stage.
+    """
+
+    __STOP = object()
+
+    def __init__(self, name, func, max_batch_size, max_wait_ms=0, tracer=None):
+        assert max_batch_size >= 1, f"Max batch size must be positive, got {max_batch_size}"
+        self.name = name
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait_ns = int(max_wait_ms * 1e6)
+        self.tracer = tracer
+        self.batches = []
+        self.__queue = queue.Queue()
+        self.__thread = None
+
+    def start(self):
+        assert self.__thread is None, f"MicroBatcher {self.name} already started"
+        self.__thread = threading.Thread(
+            target=self.__serve, name=f"microbatch_{self.name}", daemon=True
+        )
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__queue.put(MicroBatcher.__STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def submit(self, req_id, item) -> Future:
+        future = Future()
+        self.__queue.put((req_id, item, time.monotonic_ns(), future))
+        return future
+
+    def queue_depth(self) -> int:
+        return self.__queue.qsize()
+
+    def __collect_batch(self):
+        """Block for the first item, then wait for more until the batch is full or times out"""
+        item = self.__queue.get()
+        if item is MicroBatcher.__STOP:
+            return [], "stop", True
+        batch = [item]
+        deadline = item[2] + self.max_wait_ns
+        while len(batch) < self.max_batch_size:
+            remaining_ns = deadline - time.monotonic_ns()
+            try:
+                if remaining_ns > 0:
+                    item = self.__queue.get(timeout=remaining_ns / 1e9)
+                else:
+                    item = self.__queue.get_nowait()
+            except queue.Empty:
+                return batch, "timeout", False
+            if item is MicroBatcher.__STOP:
+                return batch, "stop", True
+            batch.append(item)
+        return batch, "full", False
+
+    def __serve(self):
+        stopping = False
+        while not stopping:
+            batch, reason, stopping = self.__collect_batch()
+            if len(batch) == 0:
+                continue
+
+            batch_idx = len(self.batches)
+            req_ids = [req_id for req_id, _, _, _ in batch]
+            dispatch_time = time.monotonic_ns()
+            try:
+                results = self.func([item for _, item, _, _ in batch])
+            except Exception as e:
+                cprint.eprintf(f"*** {self.name} micro-batch {batch_idx} failed: {e}")
+                results = None
+                error = e
+            done_time = time.monotonic_ns()
+
+            self.batches.append(
+                {
+                    "batch_idx": batch_idx,
+                    "size": len(batch),
+                    "fill": len(batch) / self.max_batch_size,
+                    "reason": reason,
+                    "waits_ns": [dispatch_time - enqueue_ns for _, _, enqueue_ns, _ in batch],
+                    "dispatch_ns": dispatch_time,
+                    "done_ns": done_time,
+                }
+            )
+            if self.tracer is not None:
+                self.tracer.record(self.name, batch_idx, req_ids, dispatch_time, done_time)
+            for idx, (_, _, _, future) in enumerate(batch):
+                if results is None:
+                    future.set_exception(error)
+                else:
+                    future.set_result((results[idx], batch_idx, len(batch), dispatch_time))
+
+    def get_stats(self) -> dict:
+        nbatches = len(self.batches)
+        waits = [wait for batch in self.batches for wait in batch["waits_ns"]]
+        return {
+            "stage": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ns": self.max_wait_ns,
+            "batches": nbatches,
+            "requests": len(waits),
+            "avg_batch_size": len(waits) / nbatches if nbatches else 0.0,
+            "avg_fill": (
+                sum(batch["fill"] for batch in self.batches) / nbatches if nbatches else 0.0
+            ),
+            "closed_full": sum(batch["reason"] == "full" for batch in self.batches),
+            "closed_timeout": sum(batch["reason"] == "timeout" for batch in self.batches),
+            "wait": summarize_latency(waits),
+        }
+
+
+class MicroBatchScheduler:
+    """
+    Serve individual requests with a deadline-aware micro-batcher in front of every stage of a
+    TextsRAGPipeline (embed, retrieve, rerank, generate), each with its own max batch size and max
+    wait. A request moves to the next stage as soon as its micro-batch returns, so different stages
+    group requests differently.
+
+    `stage_limits` maps a stage name to `{"max_batch_size": int, "max_wait_ms": float}`, stages
+    left out use `default_batch_size` and no wait. Exposes the same interface as RequestServer
+    (start/stop, `submit(question) -> Future` of a request record), so it can be driven by the
+    open- and closed-loop load generators. `dispatch_ns` of a record is when its embed batch
+    started, `batch_idx` and `batch_size` are those of its generate batch.
+    """
+
+    def __init__(self, pipeline, stage_limits=None, default_batch_size=1):
+        self.pipeline = pipeline
+        stage_limits = stage_limits or {}
+        stage_funcs = {
+            "embed": pipeline.embedder.embedding,
+            "retrieve": pipeline.retriever.search_db,
+            "generate": pipeline.responser.query_llm,
+        }
+        if pipeline.reranker is not None:
+            stage_funcs["rerank"] = lambda items: pipeline.reranker.batch_rerank(
+                [question for question, _ in items], [context for _, context in items]
+            )
+        self.batchers = {}
+        for stage in ["embed", "retrieve", "rerank", "generate"]:
+            if stage not in stage_funcs:
+                continue
+            limits = stage_limits.get(stage, {})
+            self.batchers[stage] = MicroBatcher(
+                stage,
+                stage_funcs[stage],
+                max_batch_size=limits.get("max_batch_size", default_batch_size),
+                max_wait_ms=limits.get("max_wait_ms", 0),
+                tracer=pipeline.tracer,
+            )
+        self.__next_req_id = 0
+        self.__id_lock = threading.Lock()
+
+    def start(self):
+        for batcher in self.batchers.values():
+            batcher.start()
+        return self
+
+    def stop(self):
+        # stop upstream stages first so that no request is pushed into a stopped stage
+        for batcher in self.batchers.values():
+            batcher.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exctype, value, tb):
+        self.stop()
+        return False
+
+    def queue_depth(self) -> int:
+        return sum(batcher.queue_depth() for batcher in self.batchers.values())
+
+    def submit(self, question) -> Future:
+        with self.__id_lock:
+            req_id = self.__next_req_id
+            self.__next_req_id += 1
+        future = Future()
+        record = {"req_id": req_id, "question": question, "submit_ns": time.monotonic_ns()}
+
+        def chain(stage_future, on_result):
+            # forward stage errors to the request, otherwise move it to its next stage
+            def callback(done_future):
+                try:
+                    on_result(*done_future.result())
+                except Exception as e:
+                    future.set_exception(e)
+
+            stage_future.add_done_callback(callback)
+
+        def on_embedded(vector, batch_idx, batch_size, dispatch_ns):
+            record["dispatch_ns"] = dispatch_ns
+            chain(self.batchers["retrieve"].submit(req_id, vector), on_retrieved)
+
+        def on_retrieved(context, batch_idx, batch_size, dispatch_ns):
+            if "rerank" in self.batchers:
+                chain(self.batchers["rerank"].submit(req_id, (question, context)), on_reranked)
+            else:
+                on_reranked(context, batch_idx, batch_size, dispatch_ns)
+
+        def on_reranked(context, batch_idx, batch_size, dispatch_ns):
+            record["context"] = context
+            prompt = self.pipeline.generate_prompt([question], [context])[0]
+            chain(self.batchers["generate"].submit(req_id, prompt), on_generated)
+
+        def on_generated(response, batch_idx, batch_size, dispatch_ns):
+            record.update(
+                done_ns=time.monotonic_ns(),
+                batch_idx=batch_idx,
+                batch_size=batch_size,
+                response=response,
+            )
+            future.set_result(record)
+
+        chain(self.batchers["embed"].submit(req_id, question), on_embedded)
+        return future
+
+    def report_stats(self) -> list[dict]:
+        """
+        Per-stage batch fill and queueing wait, one row per stage in microbatch_stats.txt and one
+        row per micro-batch in microbatch_batches.txt
+        """
+        stage_stats = [batcher.get_stats() for batcher in self.batchers.values()]
+        print("Micro-batch stats:")
+        for stats in stage_stats:
+            print(
+                f"  {stats['stage']:<9} batches: {stats['batches']}, "
+                f"avg size: {stats['avg_batch_size']:.2f}/{stats['max_batch_size']} "
+                f"(fill {stats['avg_fill'] * 100:.2f}%), "
+                f"closed full/timeout: {stats['closed_full']}/{stats['closed_timeout']}\n"
+                f"            wait: {format_latency_summary(stats['wait'])}"
+            )
+
+        output_dir = Logger().log_dirpath
+        with open(os.path.join(output_dir, "microbatch_stats.txt"), "a") as fout:
+            for stats in stage_stats:
+                fout.write(
+                    f"{stats['stage']}\t"
+                    f"{stats['max_batch_size']}\t"
+                    f"{stats['max_wait_ns']}\t"
+                    f"{stats['batches']}\t"
+                    f"{stats['requests']}\t"
+                    f"{stats['avg_fill']:.4f}\t"
+                    f"{stats['closed_full']}\t"
+                    f"{stats['closed_timeout']}\t"
+                    f"{stats['wait']['p50']:.0f}\t"
+                    f"{stats['wait']['p95']:.0f}\t"
+                    f"{stats['wait']['p99']:.0f}\n"
+                )
+        with open(os.path.join(output_dir, "microbatch_batches.txt"), "a") as fout:
+            for batcher in self.batchers.values():
+                for batch in batcher.batches:
+                    fout.write(
+                        f"{batcher.name}\t"
+                        f"{batch['batch_idx']}\t"
+                        f"{batch['size']}\t"
+                        f"{batch['fill']:.4f}\t"
+                        f"{batch['reason']}\t"
+                        f"{max(batch['waits_ns'])}\t"
+                        f"{batch['dispatch_ns']}\t"
+                        f"{batch['done_ns']}\n"
+                    )
+        return stage_stats
@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+
+
+class PipelineStage(threading.Thread):
+    """
+    A pipeline stage running in its own worker thread. The stage pulls items from `in_queue`,
+    applies `func` to each of them and pushes the result into `out_queue`. Stages are chained
+    together through bounded queues, so a slow stage backpressures the stages in front of it.
+
+    A stage with `in_queue` set to None is a source stage, `func` is then called with no argument
+    and should return an iterable of items to be pushed downstream.
+
+    Stages of a pipeline share the `abort` event, set by a stage whose `func` raises. The source
+    then stops producing and the other stages drop the items still in flight instead of
+    processing them, so that a failure ends the pipeline promptly.
+
+    Per-stage statistics are collected while running:
+        `busy_ns`: time spent inside `func`
+        `input_stall_ns`: time spent waiting for an input item (starved by the previous stage)
+        `output_stall_ns`: time spent waiting for space in `out_queue` (blocked by the next stage)
+        `queue_depth_samples`: depth of `in_queue` sampled each time an item is taken out
+    """
+
+    # marks the end of the stream, forwarded through every stage
+    STOP = object()
+
+    def __init__(self, name, func, in_queue=None, out_queue=None, abort=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.abort = abort if abort is not None else threading.Event()
+        self.exception = None
+
+        self.nitems = 0
+        self.busy_ns = 0
+        self.input_stall_ns = 0
+        self.output_stall_ns = 0
+        self.queue_depth_samples = []
+
+    def __put(self, item):
+        if self.out_queue is None:
+            return
+        put_start_time = time.monotonic_ns()
+        self.out_queue.put(item)
+        self.output_stall_ns += time.monotonic_ns() - put_start_time
+
+    def __run_source(self):
+        iterator = iter(self.func())
+        while not self.abort.is_set():
+            busy_start_time = time.monotonic_ns()
+            item = next(iterator, PipelineStage.STOP)
+            self.busy_ns += time.monotonic_ns() - busy_start_time
+            if item is PipelineStage.STOP:
+                return
+            self.nitems += 1
+            self.__put(item)
+
+    def __run_stage(self):
+        while True:
+            get_start_time = time.monotonic_ns()
+            item = self.in_queue.get()
+            self.input_stall_ns += time.monotonic_ns() - get_start_time
+            if item is PipelineStage.STOP:
+                return
+            if self.abort.is_set():
+                # another stage failed, the results would be thrown away
+                continue
+            self.queue_depth_samples.append(self.in_queue.qsize())
+
+            busy_start_time = time.monotonic_ns()
+            result = self.func(item)
+            self.busy_ns += time.monotonic_ns() - busy_start_time
+            self.nitems += 1
+            self.__put(result)
+
+    def run(self):
+        try:
+            if self.in_queue is None:
+                self.__run_source()
+            else:
+                self.__run_stage()
+        except BaseException as e:
+            self.exception = e
+            self.abort.set()
+            # drain the input so upstream stages blocked on a full queue can make progress
+            if self.in_queue is not None:
+                while self.in_queue.get() is not PipelineStage.STOP:
+                    pass
+        finally:
+            self.__put(PipelineStage.STOP)
+
+    def get_stats(self) -> dict:
+        nsamples = len(self.queue_depth_samples)
+        return {
+            "stage": self.name,
+            "items": self.nitems,
+            "busy_ns": self.busy_ns,
+            "input_stall_ns": self.input_stall_ns,
+            "output_stall_ns": self.output_stall_ns,
+            "avg_queue_depth": sum(self.queue_depth_samples) / nsamples if nsamples else 0.0,
+            "max_queue_depth": max(self.queue_depth_samples) if nsamples else 0,
+        }
+
+
+def run_stages(stage_funcs, queue_depth=2):
+    """
+    Chain `stage_funcs` (list of (name, func) tuples, the first one being the source) with bounded
+    queues of size `queue_depth`, run them to completion and return the list of items coming out
+    of the last stage together with the list of started stages.
+
+    Exceptions raised inside any stage abort the pipeline and are re-raised in the caller thread.
+    """
+    assert len(stage_funcs) >= 1, "At least a source stage is required"
+    assert queue_depth >= 1, f"Queue depth must be positive, got {queue_depth}"
+
+    queues = [queue.Queue(maxsize=queue_depth) for _ in range(len(stage_funcs))]
+    abort = threading.Event()
+    stages = []
+    for idx, (name, func) in enumerate(stage_funcs):
+        stages.append(
+            PipelineStage(
+                name=name,
+                func=func,
+                in_queue=queues[idx - 1] if idx > 0 else None,
+                out_queue=queues[idx],
+                abort=abort,
+            )
+        )
+    for stage in stages:
+        stage.start()
+
+    outputs = []
+    while (item := queues[-1].get()) is not PipelineStage.STOP:
+        outputs.append(item)
+    for stage in stages:
+        stage.join()
+
+    for stage in stages:
+        if stage.exception is not None:
+            raise stage.exception
+    return outputs, stages
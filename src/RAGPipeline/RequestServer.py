@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import utils.colored_print as cprint
+
+
+class RequestServer:
+    """
+    Serve individual requests on top of a batch pipeline (any object exposing
+    `run_batch(questions, req_ids, batch_idx) -> (contexts, responses)`, e.g. TextsRAGPipeline).
+
+    Requests submitted from any thread are queued, a serving thread takes whatever is waiting (up
+    to `batch_size` requests, blocking only for the first one) and runs them as one batch. Every
+    request carries its own timestamps, so the time it spent queued before the embed stage is
+    visible in the end-to-end latency.
+
+    Each submitted request returns a Future resolving to a record dict with keys:
+        `req_id`, `question`, `submit_ns`, `dispatch_ns`, `done_ns`, `batch_idx`, `batch_size`,
+        `context`, `response`
+    """
+
+    __STOP = object()
+
+    def __init__(self, pipeline, batch_size=1):
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.__queue = queue.Queue()
+        self.__thread = None
+        self.__next_req_id = 0
+        self.__nbatches = 0
+        self.__id_lock = threading.Lock()
+
+    def start(self):
+        assert self.__thread is None, "RequestServer already started"
+        self.__thread = threading.Thread(target=self.__serve, name="request_server", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__queue.put(RequestServer.__STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exctype, value, tb):
+        self.stop()
+        return False
+
+    def submit(self, question) -> Future:
+        with self.__id_lock:
+            req_id = self.__next_req_id
+            self.__next_req_id += 1
+        future = Future()
+        record = {"req_id": req_id, "question": question, "submit_ns": time.monotonic_ns()}
+        self.__queue.put((record, future))
+        return future
+
+    def queue_depth(self) -> int:
+        return self.__queue.qsize()
+
+    def __collect_batch(self):
+        """Block for the first request, then take whatever else is already waiting"""
+        batch = []
+        item = self.__queue.get()
+        while item is not RequestServer.__STOP:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, item is RequestServer.__STOP
+
+    def __serve(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self.__collect_batch()
+            if len(batch) == 0:
+                continue
+
+            dispatch_time = time.monotonic_ns()
+            questions = [record["question"] for record, _ in batch]
+            try:
+                contexts, responses = self.pipeline.run_batch(
+                    questions,
+                    req_ids=[record["req_id"] for record, _ in batch],
+                    batch_idx=self.__nbatches,
+                )
+            except Exception as e:
+                cprint.eprintf(f"*** Batch {self.__nbatches} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                self.__nbatches += 1
+                continue
+            done_time = time.monotonic_ns()
+
+            for idx, (record, future) in enumerate(batch):
+                record |= {
+                    "dispatch_ns": dispatch_time,
+                    "done_ns": done_time,
+                    "batch_idx": self.__nbatches,
+                    "batch_size": len(batch),
+                    "context": contexts[idx],
+                    "response": responses[idx],
+                }
+                future.set_result(record)
+            self.__nbatches += 1
@@ -0,0 +1,273 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+
+# per-process state of the stage workers, set up once by the pool initializers
+_worker_state = {}
+
+
+def _init_chunk_worker(dataset_name, loader_kwargs, chunker_kwargs):
+    from components import DATASET_LOADERS, DATASET_PREPROCESSORS
+
+    _worker_state["loader"] = DATASET_LOADERS.get(dataset_name)(
+        dataset_name=dataset_name, **loader_kwargs
+    )
+    _worker_state["chunker"] = DATASET_PREPROCESSORS.get(dataset_name)(**chunker_kwargs)
+
+
+def _init_embed_worker(bench_type, encoder_kwargs, devices):
+    from components import ENCODERS
+
+    # every embedding process takes its own device
+    embedder = ENCODERS.get(bench_type)(device=devices.get(), **encoder_kwargs)
+    embedder.load_encoder()
+    _worker_state["embedder"] = embedder
+
+
+def _init_insert_worker(db_type, db_kwargs):
+    from components import VECTOR_DBS
+
+    db_client = VECTOR_DBS.get(db_type)(**db_kwargs)
+    db_client.setup()
+    _worker_state["db_client"] = db_client
+
+
+def _chunk_shard(shard_idx, shard_size, samples_length):
+    start_ns = time.monotonic_ns()
+    df = _worker_state["loader"].get_dataset_slice(length=shard_size, offset=shard_idx)
+    # the last shard stops at samples_length
+    df = df.iloc[: samples_length - shard_idx * shard_size]
+    chunks = _worker_state["chunker"].chunking_text_to_text(df)
+    return chunks, {
+        "docs": len(df),
+        "chunks": len(chunks),
+        "chunk_pid": os.getpid(),
+        "chunk_start_ns": start_ns,
+        "chunk_end_ns": time.monotonic_ns(),
+    }
+
+
+def _embed_shard(chunks):
+    start_ns = time.monotonic_ns()
+    embeddings = _worker_state["embedder"].embedding(chunks)
+    return embeddings, {
+        "embed_pid": os.getpid(),
+        "embed_start_ns": start_ns,
+        "embed_end_ns": time.monotonic_ns(),
+    }
+
+
+def _insert_shard(chunks, embeddings, collection_name, insert_batch_size, id_base):
+    start_ns = time.monotonic_ns()
+    db_client = _worker_state["db_client"]
+    # backends numbering points themselves get a disjoint id range for every shard
+    if hasattr(db_client, "id_num"):
+        db_client.id_num = id_base
+    db_client.insert_data_vector(
+        vector=embeddings,
+        chunks=chunks,
+        collection_name=collection_name,
+        insert_batch_size=insert_batch_size,
+        create_collection=True,
+    )
+    return {
+        "insert_pid": os.getpid(),
+        "insert_start_ns": start_ns,
+        "insert_end_ns": time.monotonic_ns(),
+    }
+
+
+class ShardedIngestDriver:
+    """
+    Multi-process text ingest. The first `samples_length` documents are split into shards of
+    `shard_size` documents (the length/offset contract of `get_dataset_slice`), and every shard
+    goes through three process pools: `chunk_workers` processes load and chunk it, one process per
+    device in `embed_devices` embeds it, and `insert_workers` processes insert it, each with its
+    own vector DB connection. Stages overlap across shards, at most `max_inflight_shards` shards
+    are in flight so that memory stays bounded. Chunk workers build their dataset loader with
+    `loader_kwargs` (e.g. the parameters of the synthetic corpus).
+
+    The parent only hands shards from one stage to the next. It also calls
+    `prepare_collection(dim)`, if given, once before the first insertion. Per-shard stage
+    timestamps are on the monotonic clock shared by all processes, so they line up with the MSys
+    recording wrapping the run.
+    """
+
+    STAGES = ["chunk", "embed", "insert"]
+
+    def __init__(
+        self,
+        dataset_name,
+        samples_length,
+        shard_size,
+        collection_name,
+        db_type,
+        db_kwargs,
+        chunker_kwargs,
+        encoder_kwargs,
+        embed_devices,
+        bench_type="text",
+        chunk_workers=4,
+        insert_workers=2,
+        insert_batch_size=512,
+        max_inflight_shards=None,
+        prepare_collection=None,
+        id_base=0,
+        loader_kwargs=None,
+    ):
+        if db_type == "chroma":
+            raise ValueError(
+                "Sharded ingest does not support chroma, its insert recreates the collection"
+            )
+        self.dataset_name = dataset_name
+        self.loader_kwargs = loader_kwargs or {}
+        self.samples_length = samples_length
+        self.shard_size = shard_size
+        self.nshards = -(-samples_length // shard_size)
+        self.collection_name = collection_name
+        self.db_type = db_type
+        # workers must never drop what the other workers inserted
+        self.db_kwargs = db_kwargs | {"drop_previous_collection": False}
+        self.chunker_kwargs = chunker_kwargs
+        self.encoder_kwargs = encoder_kwargs
+        self.embed_devices = embed_devices
+        self.bench_type = bench_type
+        self.workers = {
+            "chunk": chunk_workers,
+            "embed": len(embed_devices),
+            "insert": insert_workers,
+        }
+        self.insert_batch_size = insert_batch_size
+        self.max_inflight_shards = max_inflight_shards or 2 * sum(self.workers.values())
+        self.prepare_collection = prepare_collection
+        self.id_base = id_base
+
+    def run(self) -> list[dict]:
+        # spawn, CUDA cannot be used in forked processes
+        mp_context = multiprocessing.get_context("spawn")
+        devices = mp_context.Queue()
+        for device in self.embed_devices:
+            devices.put(device)
+        cprint.iprintf(
+            f"*** Sharded ingest of {self.samples_length} documents in {self.nshards} shards, "
+            f"workers: {self.workers}"
+        )
+
+        shards = {}
+        inflight = {}
+        next_shard = 0
+        next_id = self.id_base
+        prepared = self.prepare_collection is None
+        start_time = time.monotonic_ns()
+        with (
+            ProcessPoolExecutor(
+                self.workers["chunk"],
+                mp_context,
+                initializer=_init_chunk_worker,
+                initargs=(self.dataset_name, self.loader_kwargs, self.chunker_kwargs),
+            ) as chunk_pool,
+            ProcessPoolExecutor(
+                self.workers["embed"],
+                mp_context,
+                initializer=_init_embed_worker,
+                initargs=(self.bench_type, self.encoder_kwargs, devices),
+            ) as embed_pool,
+            ProcessPoolExecutor(
+                self.workers["insert"],
+                mp_context,
+                initializer=_init_insert_worker,
+                initargs=(self.db_type, self.db_kwargs),
+            ) as insert_pool,
+        ):
+            while next_shard < self.nshards or len(inflight) > 0:
+                while next_shard < self.nshards and len(inflight) < self.max_inflight_shards:
+                    future = chunk_pool.submit(
+                        _chunk_shard, next_shard, self.shard_size, self.samples_length
+                    )
+                    inflight[future] = ("chunk", next_shard, None)
+                    shards[next_shard] = {"shard": next_shard}
+                    next_shard += 1
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, shard_idx, chunks = inflight.pop(future)
+                    if stage == "chunk":
+                        chunks, stats = future.result()
+                        shards[shard_idx] |= stats | {"id_base": next_id}
+                        next_id += len(chunks)
+                        inflight[embed_pool.submit(_embed_shard, chunks)] = (
+                            "embed",
+                            shard_idx,
+                            chunks,
+                        )
+                    elif stage == "embed":
+                        embeddings, stats = future.result()
+                        shards[shard_idx] |= stats
+                        if not prepared and len(embeddings) > 0:
+                            self.prepare_collection(len(embeddings[0]))
+                            prepared = True
+                        future = insert_pool.submit(
+                            _insert_shard,
+                            chunks,
+                            embeddings,
+                            self.collection_name,
+                            self.insert_batch_size,
+                            shards[shard_idx]["id_base"],
+                        )
+                        inflight[future] = ("insert", shard_idx, None)
+                    else:
+                        shards[shard_idx] |= future.result()
+                        cprint.iprintf(
+                            f"*** Shard {shard_idx + 1}/{self.nshards} done: "
+                            f"{shards[shard_idx]['chunks']} chunks"
+                        )
+        wall_time = time.monotonic_ns() - start_time
+
+        shard_stats = [shards[shard_idx] for shard_idx in range(self.nshards)]
+        self.report(shard_stats, wall_time)
+        return shard_stats
+
+    def report(self, shard_stats, wall_time):
+        output_path = os.path.join(Logger().log_dirpath, "sharded_ingest_shards.txt")
+        with open(output_path, "w") as fout:
+            for stats in shard_stats:
+                columns = [stats["shard"], stats["docs"], stats["chunks"]]
+                for stage in ShardedIngestDriver.STAGES:
+                    columns += [
+                        stats[f"{stage}_pid"],
+                        stats[f"{stage}_start_ns"],
+                        stats[f"{stage}_end_ns"],
+                    ]
+                fout.write("\t".join(str(column) for column in columns) + "\n")
+
+        ndocs = sum(stats["docs"] for stats in shard_stats)
+        nchunks = sum(stats["chunks"] for stats in shard_stats)
+        print(
+            f"Sharded ingest finished in {wall_time / 1e9:.3f} s: {ndocs} documents "
+            f"({ndocs / wall_time * 1e9:.3f} docs/s), {nchunks} chunks "
+            f"({nchunks / wall_time * 1e9:.3f} chunks/s)"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "sharded_ingest_stats.txt")
+        with open(output_path, "a") as fout:
+            for stage in ShardedIngestDriver.STAGES:
+                busy_ns = sum(
+                    stats[f"{stage}_end_ns"] - stats[f"{stage}_start_ns"] for stats in shard_stats
+                )
+                utilization = busy_ns / (wall_time * self.workers[stage])
+                print(
+                    f"  {stage:<6} workers: {self.workers[stage]}, busy: {busy_ns / 1e9:.3f} s, "
+                    f"utilization: {utilization * 100:.2f}%"
+                )
+                fout.write(
+                    f"{stage}\t"
+                    f"{self.workers[stage]}\t"
+                    f"{busy_ns}\t"
+                    f"{utilization:.4f}\t"
+                    f"{ndocs}\t"
+                    f"{nchunks}\t"
+                    f"{wall_time}\n"
+                )
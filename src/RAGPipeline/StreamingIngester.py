@@ -0,0 +1,174 @@
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+
+
+def rebatch(batches, batch_size):
+    """Regroup a stream of lists into lists of exactly `batch_size` items (the last one shorter)"""
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            pending = pending[batch_size:]
+    if len(pending) > 0:
+        yield pending
+
+
+class StreamingIngester:
+    """
+    Bounded-memory text ingest as a generator chain: documents are read as Arrow record batches
+    of `doc_batch_size` documents, chunked batch by batch, regrouped into batches of exactly
+    `chunk_batch_size` chunks, embedded, and inserted. Nothing is materialized beyond the
+    batches in flight, so peak memory does not depend on the number of documents, and the first
+    insert happens as soon as the first chunk batch is embedded.
+
+    Inserts run in a background thread, overlapping with the chunking and embedding of the next
+    batches. At most `max_inflight_inserts` embedded batches wait for insertion, beyond which
+    embedding blocks (backpressure).
+
+    `prepare_collection(dim)`, if given, is called once before the first insertion (e.g. to
+    create a LanceDB table). With an `embedding_cache` (EmbeddingCache), only the chunks it
+    misses are embedded.
+    """
+
+    def __init__(
+        self,
+        loader,
+        chunker,
+        embedder,
+        db_client,
+        collection_name,
+        samples_length,
+        doc_batch_size=1024,
+        chunk_batch_size=8192,
+        max_inflight_inserts=2,
+        insert_batch_size=512,
+        prepare_collection=None,
+        embedding_cache=None,
+    ):
+        self.loader = loader
+        self.chunker = chunker
+        self.embedder = embedder
+        self.db_client = db_client
+        self.collection_name = collection_name
+        self.samples_length = samples_length
+        self.doc_batch_size = doc_batch_size
+        self.chunk_batch_size = chunk_batch_size
+        self.max_inflight_inserts = max_inflight_inserts
+        self.insert_batch_size = insert_batch_size
+        self.prepare_collection = prepare_collection
+        self.embedding_cache = embedding_cache
+
+    def iter_chunk_batches(self):
+        """Chunks of the first `samples_length` documents, `chunk_batch_size` at a time"""
+        record_batches = self.loader.iter_record_batches(
+            length=self.samples_length, batch_size=self.doc_batch_size
+        )
+        return rebatch(
+            self.chunker.iter_chunking_record_batches(record_batches), self.chunk_batch_size
+        )
+
+    def iter_embedded_batches(self):
+        """(chunks, embeddings, embed time in ns) of every chunk batch"""
+        for chunks in self.iter_chunk_batches():
+            start_ns = time.monotonic_ns()
+            if self.embedding_cache is not None:
+                embeddings = self.embedding_cache.embed(
+                    chunks,
+                    lambda indices: self.embedder.embedding([chunks[idx] for idx in indices]),
+                ).tolist()
+            else:
+                embeddings = self.embedder.embedding(chunks)
+            yield chunks, embeddings, time.monotonic_ns() - start_ns
+
+    def __insert_batch(self, chunks, embeddings):
+        start_ns = time.monotonic_ns()
+        self.db_client.insert_data_vector(
+            vector=embeddings,
+            chunks=chunks,
+            collection_name=self.collection_name,
+            insert_batch_size=self.insert_batch_size,
+            create_collection=True,
+        )
+        return start_ns, time.monotonic_ns()
+
+    def run(self) -> list[dict]:
+        """Ingest everything, returns the chunk count, embed and insert times of every batch"""
+        start_ns = time.monotonic_ns()
+        if self.prepare_collection is not None:
+            self.prepare_collection(self.embedder.dim)
+        batch_stats = []
+        inflight = []
+        with ThreadPoolExecutor(max_workers=1) as insert_pool:
+            for chunks, embeddings, embed_ns in self.iter_embedded_batches():
+                if len(inflight) >= self.max_inflight_inserts:
+                    self.__wait_insert(inflight.pop(0), batch_stats)
+                batch_stats.append({"chunks": len(chunks), "embed_ns": embed_ns})
+                inflight.append(
+                    (
+                        len(batch_stats) - 1,
+                        insert_pool.submit(self.__insert_batch, chunks, embeddings),
+                    )
+                )
+                del chunks, embeddings
+            for pending in inflight:
+                self.__wait_insert(pending, batch_stats)
+        self.report(batch_stats, start_ns, time.monotonic_ns() - start_ns)
+        if self.embedding_cache is not None:
+            self.embedding_cache.flush()
+            self.embedding_cache.report()
+        return batch_stats
+
+    @staticmethod
+    def __wait_insert(pending, batch_stats):
+        batch_idx, future = pending
+        insert_start_ns, insert_end_ns = future.result()
+        batch_stats[batch_idx] |= {
+            "insert_start_ns": insert_start_ns,
+            "insert_ns": insert_end_ns - insert_start_ns,
+        }
+
+    def report(self, batch_stats, start_ns, wall_time):
+        output_path = os.path.join(Logger().log_dirpath, "streaming_ingest_batches.txt")
+        with open(output_path, "w") as fout:
+            for batch_idx, stats in enumerate(batch_stats):
+                fout.write(
+                    f"{batch_idx}\t"
+                    f"{stats['chunks']}\t"
+                    f"{stats['embed_ns']}\t"
+                    f"{stats['insert_start_ns']}\t"
+                    f"{stats['insert_ns']}\n"
+                )
+
+        nchunks = sum(stats["chunks"] for stats in batch_stats)
+        first_insert_ns = batch_stats[0]["insert_start_ns"] - start_ns if batch_stats else 0
+        embed_ns = sum(stats["embed_ns"] for stats in batch_stats)
+        insert_ns = sum(stats["insert_ns"] for stats in batch_stats)
+        # ru_maxrss is in KiB on Linux
+        peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        cprint.iprintf(
+            f"*** Streaming ingest finished in {wall_time / 1e9:.3f} s: {self.samples_length} "
+            f"documents, {nchunks} chunks in {len(batch_stats)} batches "
+            f"({nchunks / wall_time * 1e9:.3f} chunks/s), first insert after "
+            f"{first_insert_ns / 1e9:.3f} s, embed: {embed_ns / 1e9:.3f} s, insert: "
+            f"{insert_ns / 1e9:.3f} s, peak RSS: {peak_rss_bytes / 2**30:.3f} GiB"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "streaming_ingest_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.doc_batch_size}\t"
+                f"{self.chunk_batch_size}\t"
+                f"{self.max_inflight_inserts}\t"
+                f"{self.samples_length}\t"
+                f"{nchunks}\t"
+                f"{wall_time}\t"
+                f"{first_insert_ns}\t"
+                f"{embed_ns}\t"
+                f"{insert_ns}\t"
+                f"{peak_rss_bytes}\n"
+            )
@@ -1,16 +1,23 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
 import os
+from typing import TYPE_CHECKING
 import time
-import math
-from RAGPipeline.responser.TextsResponser import VLLMResponser
 from RAGPipeline.BaseRAGPipline import BaseRAGPipeline
-from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
+from RAGPipeline.PipelineStage import run_stages
 from RAGPipeline.retriever.BaseRetriever import BaseRetriever
-from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
-from evaluator.RagasEvaluator import RagasEvaluator
 from datasets import Dataset
 import utils.colored_print as cprint
 from utils.logger import Logger, log_time_breakdown
+from utils.span_tracer import SpanTracer
+
+# model wrappers are only needed for type hints, importing them would pull in vllm, ragas, ...
+if TYPE_CHECKING:
+    from RAGPipeline.responser.TextsResponser import VLLMResponser
+    from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
+    from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
+    from evaluator.RagasEvaluator import RagasEvaluator
 
 # should make the pipeline fully modular with request queue passing
 
@@ -27,6 +34,7 @@ class TextsRAGPipeline(BaseRAGPipeline):
         embedder: SentenceTransformerEncoder,
         reranker: CrossEncoderReranker = None,
         evaluator: RagasEvaluator = None,
+        keep_models_loaded=False,
     ) -> None:
 
         self.retriever = retriever
@@ -34,6 +42,9 @@ class TextsRAGPipeline(BaseRAGPipeline):
         self.responser = responser
         self.embedder = embedder
         self.evaluator = evaluator
+        self.tracer = SpanTracer()
+        # models stay resident after process() when they are shared across runs (e.g. sweeps)
+        self.keep_models_loaded = keep_models_loaded
         return
 
     def generate_prompt(self, questions, contexts):
@@ -59,93 +70,173 @@ class TextsRAGPipeline(BaseRAGPipeline):
             )
         return prompts
 
-    def process(self, request, batch_size=2) -> None:
+    def load_models(self):
+        cprint.iprintf(f"*** Loading models")
+        self.embedder.load_encoder()
+        if self.reranker is not None:
+            self.reranker.load_reranker()
+        self.responser.load_llm()
+        cprint.iprintf(f"*** Loading models done")
+
+    def free_models(self):
+        cprint.iprintf(f"*** Unloading models")
+        self.embedder.free_encoder()
+        if self.reranker is not None:
+            self.reranker.free_reranker()
+        self.responser.free_llm()
+        cprint.iprintf(f"*** Unloading models done")
+
+    def run_batch(self, questions, req_ids=None, batch_idx=0):
+        """
+        Push one batch of questions through embed, retrieve, rerank, prompt and generate with
+        models already loaded. Returns the retrieved contexts and the responses.
+        """
+        if req_ids is None:
+            req_ids = list(range(len(questions)))
+        batch = {"batch_idx": batch_idx, "req_ids": req_ids, "questions": questions}
+        for _, stage_func in self.__get_stage_funcs():
+            batch = stage_func(batch)
+        return batch["results"], batch["responses"]
+
+    # every batch flowing through the stages is a dict holding the intermediate batch results
+    def __embed_stage(self, batch):
+        with self.tracer.span("embed", batch["batch_idx"], batch["req_ids"]):
+            batch["vectors"] = self.embedder.embedding(batch["questions"])
+        return batch
+
+    def __retrieve_stage(self, batch):
+        with self.tracer.span("retrieve", batch["batch_idx"], batch["req_ids"]) as span:
+            batch["results"] = self.retriever.search_db(batch["vectors"])
+            span["top_k"] = self.retriever.top_k
+            span["n_candidates"] = [len(result) for result in batch["results"]]
+        return batch
+
+    def __rerank_stage(self, batch):
+        with self.tracer.span("rerank", batch["batch_idx"], batch["req_ids"]) as span:
+            span["n_candidates"] = [len(result) for result in batch["results"]]
+            batch["results"] = self.reranker.batch_rerank(batch["questions"], batch["results"])
+            span["top_k"] = self.reranker.top_n
+        return batch
+
+    def __prompt_stage(self, batch):
+        with self.tracer.span("prompt", batch["batch_idx"], batch["req_ids"]) as span:
+            batch["prompts"] = self.generate_prompt(batch["questions"], batch["results"])
+            span["n_candidates"] = [len(result) for result in batch["results"]]
+        return batch
+
+    def __generate_stage(self, batch):
+        with self.tracer.span("generate", batch["batch_idx"], batch["req_ids"]) as span:
+            batch["responses"], span["input_tokens"], span["output_tokens"] = (
+                self.responser.query_llm(batch["prompts"], return_token_counts=True)
+            )
+        return batch
+
+    def __get_stage_funcs(self):
+        stage_funcs = [("embed", self.__embed_stage), ("retrieve", self.__retrieve_stage)]
+        if self.reranker is not None:
+            stage_funcs.append(("rerank", self.__rerank_stage))
+        stage_funcs.append(("prompt", self.__prompt_stage))
+        stage_funcs.append(("generate", self.__generate_stage))
+        return stage_funcs
+
+    def __load_batches(self, request, batch_size):
+        for batch_idx, i in enumerate(range(0, request.req_count, batch_size)):
+            questions, gt_answer = request.get_questions(batch_size, start_idx=i)
+            yield {
+                "batch_idx": batch_idx,
+                "req_ids": list(range(i, i + len(questions))),
+                "questions": questions,
+                "gt_answer": gt_answer,
+            }
+
+    def process_sequential(self, request, batch_size=2):
+        """Run the query path one stage at a time, batch after batch"""
+        batches = []
+        for batch in self.__load_batches(request, batch_size):
+            for stage_name, stage_func in self.__get_stage_funcs():
+                log_time_breakdown(stage_name)
+                batch = stage_func(batch)
+                cprint.iprintf(f"*** Batch {batch['batch_idx']} {stage_name} done")
+            batches.append(batch)
+        return batches
+
+    def process_pipelined(self, request, batch_size=2, queue_depth=2):
+        """
+        Run the query path with every stage in its own worker, connected by bounded queues of size
+        `queue_depth`, so that consecutive batches overlap (e.g. batch N+1 is embedded and
+        retrieved while batch N is generating). Returns the processed batches in order and the
+        per-stage statistics.
+        """
+        cprint.iprintf(f"*** Running pipelined stages with queue depth {queue_depth}")
+        log_time_breakdown("pipelined")
+        batches, stages = run_stages(
+            [("load", lambda: self.__load_batches(request, batch_size))] + self.__get_stage_funcs(),
+            queue_depth=queue_depth,
+        )
+        batches.sort(key=lambda batch: batch["batch_idx"])
+        return batches, [stage.get_stats() for stage in stages]
+
+    def report_batch_stats(self):
+        """Per-batch stage latency breakdown, one row per batch in text_pipeline_stats.txt"""
+        stages = ["embed", "retrieve", "rerank", "prompt", "generate"]
+        output_path = os.path.join(Logger().log_dirpath, "text_pipeline_stats.txt")
+        with open(output_path, "a") as fout:
+            for round_idx, latencies in sorted(self.tracer.batch_latencies().items()):
+                stage_times = [latencies.get(stage, 0) for stage in stages]
+                fout.write(
+                    f"{round_idx}\t"
+                    + "".join(f"{stage_time}\t" for stage_time in stage_times)
+                    + f"{sum(stage_times)}\n"
+                )
+
+    def __report_stage_stats(self, stage_stats, wall_time):
+        print(f"Pipelined run finished in {wall_time} ns ({wall_time / 1e9} s)")
+        for stats in stage_stats:
+            print(
+                f"  {stats['stage']:<9} items: {stats['items']}, "
+                f"busy: {stats['busy_ns'] / 1e9:.3f} s ({stats['busy_ns'] / wall_time * 100:.2f}%), "
+                f"input stall: {stats['input_stall_ns'] / 1e9:.3f} s, "
+                f"output stall: {stats['output_stall_ns'] / 1e9:.3f} s, "
+                f"queue depth avg/max: {stats['avg_queue_depth']:.2f}/{stats['max_queue_depth']}"
+            )
+        output_path = os.path.join(Logger().log_dirpath, "text_pipeline_stage_stats.txt")
+        with open(output_path, "a") as fout:
+            for stats in stage_stats:
+                fout.write(
+                    f"{stats['stage']}\t"
+                    f"{stats['items']}\t"
+                    f"{stats['busy_ns']}\t"
+                    f"{stats['input_stall_ns']}\t"
+                    f"{stats['output_stall_ns']}\t"
+                    f"{stats['avg_queue_depth']:.4f}\t"
+                    f"{stats['max_queue_depth']}\t"
+                    f"{wall_time}\n"
+                )
+
+    def process(self, request, batch_size=2, pipelined=False, queue_depth=2) -> None:
         if request.req_type == "query":
             cprint.iprintf(
                 f"*** Processing {request.req_count} questions with batch size {batch_size}"
             )
             log_time_breakdown("start")
-            cprint.iprintf(f"*** Loading models")
-            self.embedder.load_encoder()
-            if self.reranker is not None:
-                self.reranker.load_reranker()
-            self.responser.load_llm()
-            cprint.iprintf(f"*** Loading models done")
-
-            nrounds = int(math.ceil(request.req_count / batch_size))
-            cprint.iprintf(f"*** Will run {nrounds} rounds")
-            for round_idx in range(0, nrounds):
-                start_sample_idx = round_idx * batch_size
-                questions, gt_answer = request.get_questions(batch_size, start_idx=start_sample_idx)
+            self.load_models()
+
             print(f"***Processing {request.req_count} questions")
             user_input_list = []
             response_list = []
             retrieved_contexts_list = []
             reference_list = []
-            for i in range(0, request.req_count, batch_size):
-                questions, gt_answer = request.get_questions(batch_size, start_idx=i)
-
-                # encode questions TODO: parameter
-                # Embedding chunked texts
-                # self.embedder.load_encoder()
-                log_time_breakdown("embed")
-                embedding_start_time = time.monotonic_ns()
-                vectors = self.embedder.embedding(questions)
-                embedding_end_time = time.monotonic_ns()
-                # self.embedder.free_encoder()
-                cprint.iprintf(f"*** Embedding done")
-
-                # retrieval
-                log_time_breakdown("retrieve")
-                retrieval_start_time = time.monotonic_ns()
-                results = self.retriever.search_db(vectors)
-                retrieval_end_time = time.monotonic_ns()
-                cprint.iprintf(f"*** Retrieval done")
-                # rerank
-                if self.reranker is not None:
-                    cprint.iprintf(
-                        f"*** Reranking top-{self.reranker.top_n} from {self.retriever.top_k} candidates"
-                    )
-                    # self.reranker.load_reranker()
-                    log_time_breakdown("rerank")
-                    rerank_start_time = time.monotonic_ns()
-                    # print(results)
-                    results = self.reranker.batch_rerank(questions, results)
-                    rerank_end_time = time.monotonic_ns()
-                    # self.reranker.free_reranker()
-                    cprint.iprintf(f"*** Reranking done")
-
-                # augment
-                log_time_breakdown("prompt")
-                prompt_start_time = time.monotonic_ns()
-                prompts = self.generate_prompt(questions, results)
-                prompt_end_time = time.monotonic_ns()
-                cprint.iprintf(f"*** Prompt generation done")
-                # with open("prompt.out", "w") as fout:
-                #     for idx, prompt in enumerate(prompts):
-                #         fout.write(f"=== Prompt {idx + 1} ===\n")
-                #         fout.write(prompt.strip() + "\n\n")
-
-                # generation
-                cprint.iprintf(f"*** Generating answers")
-                # self.responser.load_llm()
-                log_time_breakdown("generate")
-                generation_start_time = time.monotonic_ns()
-                responses = self.responser.query_llm(prompts)
-                # response = []
-                generation_end_time = time.monotonic_ns()
-                # self.responser.free_llm()
-                cprint.iprintf(f"*** Generation done")
-
-                # with open("response.out", "w") as fout:
-                #     for idx, response in enumerate(responses):
-                #         fout.write(f"=== response {idx + 1} ===\n")
-                #         fout.write(response.strip() + "\n\n")
-
-                user_input_list.extend(questions)
-                response_list.extend(responses)
-                retrieved_contexts_list.extend(results)
-                reference_list.extend(gt_answer)
+            pipeline_start_time = time.monotonic_ns()
+            if pipelined:
+                batches, stage_stats = self.process_pipelined(request, batch_size, queue_depth)
+            else:
+                batches = self.process_sequential(request, batch_size)
+            pipeline_end_time = time.monotonic_ns()
+            for batch in batches:
+                user_input_list.extend(batch["questions"])
+                response_list.extend(batch["responses"])
+                retrieved_contexts_list.extend(batch["results"])
+                reference_list.extend(batch["gt_answer"])
 
             evaluate_dataset = Dataset.from_dict(
                 {
@@ -156,43 +247,16 @@ class TextsRAGPipeline(BaseRAGPipeline):
                 }
             )
             # finished
-            log_time_breakdown("free_models")
-            cprint.iprintf(f"*** Unloading models")
-            self.embedder.free_encoder()
-            if self.reranker is not None:
-                self.reranker.free_reranker()
-            self.responser.free_llm()
-            cprint.iprintf(f"*** Unloading models done")
+            if not self.keep_models_loaded:
+                log_time_breakdown("free_models")
+                self.free_models()
             log_time_breakdown("done")
             if self.evaluator is not None:
                 print(f"***Evaluating answers")
                 self.evaluator.evaluate_dataset(evaluate_dataset)
 
-            embedding_time = embedding_end_time - embedding_start_time
-            retrieval_time = retrieval_end_time - retrieval_start_time
-            rerank_time = rerank_end_time - rerank_start_time if self.reranker is not None else 0
-            prompt_time = prompt_end_time - prompt_start_time
-            generation_time = generation_end_time - generation_start_time
-            total_time = (
-                embedding_time + retrieval_time + rerank_time + prompt_time + generation_time
-            )
-            print(
-                f"At round {round_idx}\n"
-                f"  embedding time:  {embedding_time} ns ({embedding_time / 1e9} s, ({embedding_time / total_time * 100:.2f}%)\n"
-                f"  retrieval time:  {retrieval_time} ns ({retrieval_time / 1e9} s, ({retrieval_time / total_time * 100:.2f}%)\n"
-                f"  rerank time:     {rerank_time} ns ({rerank_time / 1e9} s, ({rerank_time / total_time * 100:.2f}%)\n"
-                f"  prompt time:     {prompt_time} ns ({prompt_time / 1e9} s, ({prompt_time / total_time * 100:.2f}%)\n"
-                f"  generation time: {generation_time} ns ({generation_time / 1e9} s, ({generation_time / total_time * 100:.2f}%)\n"
-            )
-            output_path = os.path.join(Logger().log_dirpath, "text_pipeline_stats.txt")
-            with open(output_path, "a") as fout:
-                fout.write(
-                    f"{round_idx}\t"
-                    f"{embedding_time}\t"
-                    f"{retrieval_time}\t"
-                    f"{rerank_time}\t"
-                    f"{prompt_time}\t"
-                    f"{generation_time}\t"
-                    f"{total_time}\n"
-                )
+            self.tracer.dump("text_pipeline")
+            self.report_batch_stats()
+            if pipelined:
+                self.__report_stage_stats(stage_stats, pipeline_end_time - pipeline_start_time)
         return
@@ -0,0 +1,63 @@
+import os
+import time
+
+from utils.logger import Logger, log_time_breakdown
+from utils.latency_stats import summarize_latency, format_latency_summary
+from utils.span_tracer import SpanTracer
+
+
+class VectorSearchBenchmark:
+    """
+    Retrieval-only run over pre-embedded queries (SyntheticRequests on a pre-embedded corpus): no
+    encoder or LLM is loaded, query vectors go straight to the vector DB. Besides the search
+    latency, the recall@top_k of the planted neighbor of every query is measured.
+    """
+
+    def __init__(self, retriever, backend=""):
+        self.retriever = retriever
+        self.backend = backend
+        self.tracer = SpanTracer()
+
+    def process(self, request, batch_size) -> dict:
+        log_time_breakdown("search")
+        hits = []
+        start_time = time.monotonic_ns()
+        for batch_idx, start_idx in enumerate(range(0, request.req_count, batch_size)):
+            vectors, markers = request.get_query_vectors(batch_size, start_idx=start_idx)
+            req_ids = list(range(start_idx, start_idx + len(markers)))
+            with self.tracer.span("retrieve", batch_idx, req_ids) as span:
+                results = self.retriever.search_db(vectors.tolist())
+                span["top_k"] = self.retriever.top_k
+                span["n_candidates"] = [len(result) for result in results]
+            hits.extend(request.recall_at_k(results, markers))
+        wall_time = time.monotonic_ns() - start_time
+        log_time_breakdown("done")
+
+        latency = summarize_latency(self.tracer.stage_latencies()["retrieve"])
+        summary = {
+            "queries": len(hits),
+            "recall": sum(hits) / len(hits),
+            "throughput": len(hits) / wall_time * 1e9,
+            "latency": latency,
+        }
+        print(
+            f"Vector search ({self.backend}): {summary['queries']} queries, batch size "
+            f"{batch_size}, top_k {self.retriever.top_k}, recall@{self.retriever.top_k} "
+            f"{summary['recall']:.4f}, {summary['throughput']:.3f} queries/s\n"
+            f"  latency: {format_latency_summary(latency)}"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "vector_search_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.backend}\t"
+                f"{summary['queries']}\t"
+                f"{batch_size}\t"
+                f"{self.retriever.top_k}\t"
+                f"{summary['recall']:.6f}\t"
+                f"{summary['throughput']:.6f}\t"
+                f"{latency['p50']:.0f}\t"
+                f"{latency['p95']:.0f}\t"
+                f"{latency['p99']:.0f}\n"
+            )
+        self.tracer.dump("vector_search")
+        return summary
@@ -10,8 +10,12 @@ class CrossEncoderReranker(BaseReranker):
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.model_name = model_name
         self.top_n = top_n
+        self.model = None
 
     def load_reranker(self):
+        if self.model is not None:
+            print(f"***Reranker already loaded: {self.model_name}")
+            return
         self.model = CrossEncoder(self.model_name, device=self.device)
 
     def rerank(self, query, candidate_docs):
@@ -49,6 +53,7 @@ class CrossEncoderReranker(BaseReranker):
 
     def free_reranker(self):
         del self.model
+        self.model = None
         torch.cuda.synchronize()
         gc.collect()
         torch.cuda.empty_cache()
@@ -1,5 +1,10 @@
+import asyncio
+import threading
+import time
+import uuid
 import torch, gc
-from vllm import LLM, SamplingParams
+from vllm import LLM, AsyncLLMEngine, SamplingParams
+from vllm.engine.arg_utils import AsyncEngineArgs
 from RAGPipeline.responser.BaseResponser import BaseResponser
 
 
@@ -38,7 +43,9 @@ class VLLMResponser(BaseResponser):
         except Exception:
             pass
 
-    def query_llm(self, prompts, max_tokens=1024, temperature=0.7, top_p=0.9):
+    def query_llm(
+        self, prompts, max_tokens=1024, temperature=0.7, top_p=0.9, return_token_counts=False
+    ):
         # make load and free out of this function
 
         sampling_params = SamplingParams(
@@ -51,4 +58,118 @@ class VLLMResponser(BaseResponser):
         assert len(results) == len(
             prompts
         ), f"Mismatch detected, generated {len(results)} responses for {len(prompts)} prompts"
-        return [res.outputs[0].text for res in results]
+        responses = [res.outputs[0].text for res in results]
+        if return_token_counts:
+            prompt_tokens = [len(res.prompt_token_ids) for res in results]
+            output_tokens = [len(res.outputs[0].token_ids) for res in results]
+            return responses, prompt_tokens, output_tokens
+        return responses
+
+
+class AsyncVLLMResponser(BaseResponser):
+    """
+    Streaming responser backed by vLLM's AsyncLLMEngine. Every prompt is an independent request
+    on the engine, so thousands of them can be in flight from a single event loop while the
+    engine batches them continuously.
+
+    The engine is bound to the event loop its background loop started on, so the responser owns
+    one persistent loop, running in a dedicated thread from `load_llm` to `free_llm`. Coroutines
+    using the engine must run on it, submitted from other threads with `run`.
+    """
+
+    def __init__(self, model="Qwen/Qwen2.5-7B-Instruct", device="cuda:0", parallelism=1):
+        self.model_name = model
+        self.device = device
+        self.llm = None
+        self.parallelism = parallelism
+        self.loop = None
+        self.__loop_thread = None
+        return
+
+    def run(self, coro):
+        """Run `coro` on the engine's event loop and wait for its result, from any other thread"""
+        assert self.loop is not None, "Run called when LLM is not loaded"
+        if threading.current_thread() is self.__loop_thread:
+            raise RuntimeError("Run called from the engine's event loop, await the coroutine")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def load_llm(self):
+        if self.llm is not None:
+            print(f"***LLM already loaded: {self.model_name}")
+            return
+        self.loop = asyncio.new_event_loop()
+        self.__loop_thread = threading.Thread(
+            target=self.loop.run_forever, name="async_llm_loop", daemon=True
+        )
+        self.__loop_thread.start()
+        print(f"***Loading async LLM engine: {self.model_name} on {self.device}")
+        self.llm = AsyncLLMEngine.from_engine_args(
+            AsyncEngineArgs(
+                model=self.model_name,
+                enforce_eager=True,
+                dtype=torch.bfloat16,
+                trust_remote_code=True,
+                gpu_memory_utilization=0.85,
+                max_model_len=8096,
+                tensor_parallel_size=self.parallelism,
+            )
+        )
+        print(f"***Loaded async LLM engine: {self.model_name}")
+
+    def free_llm(self):
+        if self.llm is not None:
+
+            async def shutdown():
+                self.llm.shutdown_background_loop()
+
+            self.run(shutdown())
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.__loop_thread.join()
+            self.loop.close()
+            self.loop = None
+            self.__loop_thread = None
+        del self.llm
+        self.llm = None
+        gc.collect()
+        torch.cuda.empty_cache()
+        try:
+            torch.cuda.ipc_collect()
+        except Exception:
+            pass
+
+    async def stream_llm(self, prompt, max_tokens=1024, temperature=0.7, top_p=0.9):
+        """
+        Generate the answer of a single prompt, yielding (text, token_timestamps) every time the
+        engine produces new tokens. `token_timestamps` holds one monotonic timestamp (ns) per
+        generated token so far; tokens produced in the same engine step share a timestamp.
+        """
+        assert self.llm is not None, "Query called when LLM is not loaded"
+        sampling_params = SamplingParams(
+            max_tokens=max_tokens, temperature=temperature, top_p=top_p
+        )
+        token_timestamps = []
+        async for request_output in self.llm.generate(
+            prompt, sampling_params, request_id=str(uuid.uuid4())
+        ):
+            now = time.monotonic_ns()
+            output = request_output.outputs[0]
+            token_timestamps.extend([now] * (len(output.token_ids) - len(token_timestamps)))
+            yield output.text, token_timestamps
+
+    async def aquery_llm(self, prompt, max_tokens=1024, temperature=0.7, top_p=0.9):
+        """Generate the answer of a single prompt, returns (text, token_timestamps)"""
+        text, token_timestamps = "", []
+        async for text, token_timestamps in self.stream_llm(
+            prompt, max_tokens=max_tokens, temperature=temperature, top_p=top_p
+        ):
+            pass
+        return text, token_timestamps
+
+    def query_llm(self, prompts, max_tokens=1024, temperature=0.7, top_p=0.9):
+        async def query_all():
+            return await asyncio.gather(
+                *[self.aquery_llm(prompt, max_tokens, temperature, top_p) for prompt in prompts]
+            )
+
+        return [text for text, _ in self.run(query_all())]
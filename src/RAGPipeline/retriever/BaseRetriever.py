@@ -1,10 +1,18 @@
+from __future__ import annotations
+
+import asyncio
 import time
 import os
 from abc import ABC, abstractmethod
-from vectordb.milvus_api import milvus_client
 import concurrent.futures
 import numpy as np
-from PIL import Image
+from typing import TYPE_CHECKING
+
+from datasetPreprocess.PageRenderer import PAGE_REF_SEPARATOR, open_page
+
+# only used as a type hint, importing it would pull in pymilvus for every vector DB
+if TYPE_CHECKING:
+    from vectordb.milvus_api import milvus_client
 
 
 class BaseRetriever(ABC):
@@ -38,6 +46,16 @@ class BaseRetriever(ABC):
 
         return results
 
+    async def asearch_db(self, query_embedding, executor=None):
+        # search a single query, natively async if the DB client supports it
+        if hasattr(self.client, "async_query_search"):
+            return await self.client.async_query_search(
+                query_embedding, self.top_k, collection_name=self.collection_name
+            )
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(executor, self.search_db, [query_embedding])
+        return results[0]
+
     def search_db_image(self, query_embeddings):
         # Perform a vector search on the collection to find the top-k most similar documents.
         # topk set to a reasonable large num
@@ -90,9 +108,9 @@ class BaseRetriever(ABC):
             """
             Loads and returns the image at the given filepath.
             """
-            if os.path.exists(filepath):
-                image = Image.open(filepath)
-                return image
+            if os.path.exists(filepath.rsplit(PAGE_REF_SEPARATOR, 1)[0]):
+                # pages not persisted by the PageRenderer are rendered again from their PDF
+                return open_page(filepath)
             else:
                 print(f"File does not exist: {filepath}")
                 return None
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+
+import utils.colored_print as cprint
+from utils.logger import Logger, log_time_breakdown
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+
+class ClosedLoopLoadGenerator:
+    """
+    Closed-loop load generator. `concurrency` independent virtual users share one RequestServer
+    and issue `total_requests` requests cycling over `questions`, each user sends its next
+    question only when the answer to its previous one has returned.
+    """
+
+    def __init__(self, questions, server, concurrency, total_requests):
+        assert concurrency >= 1, f"Concurrency must be positive, got {concurrency}"
+        assert len(questions) > 0, "No question to issue"
+        self.questions = questions
+        self.server = server
+        self.concurrency = concurrency
+        self.total_requests = total_requests
+
+    def run(self) -> list[dict]:
+        records = []
+        records_lock = threading.Lock()
+        next_idx = [0]
+        errors = []
+
+        def user():
+            while True:
+                with records_lock:
+                    idx = next_idx[0]
+                    if idx >= self.total_requests or len(errors) != 0:
+                        return
+                    next_idx[0] += 1
+                question = self.questions[idx % len(self.questions)]
+                try:
+                    record = self.server.submit(question).result()
+                except Exception as e:
+                    with records_lock:
+                        errors.append(e)
+                    return
+                with records_lock:
+                    records.append(record)
+
+        users = [
+            threading.Thread(target=user, name=f"virtual_user_{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        if len(errors) != 0:
+            raise errors[0]
+        return records
+
+
+def growth(before, after) -> float:
+    """Relative growth from `before` to `after`, infinite from 0 to anything above 0"""
+    if before > 0:
+        return after / before
+    return float("inf") if after > 0 else 1.0
+
+
+def find_saturation_knee(level_summaries, throughput_gain_threshold=0.1, p99_growth_threshold=1.0):
+    """
+    Find the concurrency after which adding users stops paying off. `level_summaries` are sorted
+    by concurrency, the knee is the first level either that no higher level improves throughput
+    upon by more than `throughput_gain_threshold`, or whose p99 latency grows by more than
+    `p99_growth_threshold` at the next level (relative, 1.0 is doubling), i.e. where latency
+    starts growing much faster than throughput. The p99 growth at the next level is attached as
+    `p99_growth`, and what triggered the knee as `reason`. Returns None if throughput kept growing
+    and latency stayed in check up to the last level.
+    """
+    for idx, cur in enumerate(level_summaries[:-1]):
+        nxt = level_summaries[idx + 1]
+        p99_growth = growth(cur["e2e"]["p99"], nxt["e2e"]["p99"])
+        best_after = max(summary["throughput"] for summary in level_summaries[idx + 1 :])
+        if best_after < cur["throughput"] * (1 + throughput_gain_threshold):
+            return cur | {"p99_growth": p99_growth, "reason": "throughput"}
+        if p99_growth > 1 + p99_growth_threshold:
+            return cur | {"p99_growth": p99_growth, "reason": "p99"}
+    return None
+
+
+class ConcurrencySweep:
+    """
+    Sweep the number of closed-loop virtual users over `levels` (e.g. 1, 2, 4, ... 256) and build
+    the throughput-vs-latency curve. Every level runs inside its own MSys recording region, so that
+    each concurrency gets its own resource trace; `monitor_factory(subdir)` creates a fresh MSys
+    instance recording to `subdir` (`c<concurrency>`) of the output directory.
+    """
+
+    def __init__(
+        self,
+        request,
+        server,
+        levels,
+        monitor_factory=None,
+        requests_per_user=4,
+        throughput_gain_threshold=0.1,
+        p99_growth_threshold=1.0,
+    ):
+        if request.req_type != "query":
+            raise ValueError("Concurrency sweep only supports query requests.")
+        self.request = request
+        self.server = server
+        self.levels = sorted(levels)
+        self.monitor_factory = monitor_factory
+        self.requests_per_user = requests_per_user
+        self.throughput_gain_threshold = throughput_gain_threshold
+        self.p99_growth_threshold = p99_growth_threshold
+
+    def run_level(self, questions, concurrency) -> dict:
+        total_requests = max(len(questions), concurrency * self.requests_per_user)
+        generator = ClosedLoopLoadGenerator(questions, self.server, concurrency, total_requests)
+
+        log_time_breakdown(f"closed_loop_c{concurrency}")
+        start_time = time.monotonic_ns()
+        if self.monitor_factory is not None:
+            with self.monitor_factory(f"c{concurrency:04d}"):
+                records = generator.run()
+        else:
+            records = generator.run()
+        end_time = time.monotonic_ns()
+
+        e2e_latency = [record["done_ns"] - record["submit_ns"] for record in records]
+        summary = {
+            "concurrency": concurrency,
+            "requests": len(records),
+            "throughput": len(records) / ((end_time - start_time) / 1e9),
+            "avg_batch_size": sum(record["batch_size"] for record in records) / len(records),
+            "e2e": summarize_latency(e2e_latency),
+        }
+        print(
+            f"Concurrency {concurrency}: {summary['requests']} requests, "
+            f"throughput {summary['throughput']:.3f} req/s, "
+            f"avg batch size {summary['avg_batch_size']:.2f}\n"
+            f"  end-to-end latency: {format_latency_summary(summary['e2e'])}"
+        )
+
+        output_path = os.path.join(Logger().log_dirpath, f"closed_loop_c{concurrency}_requests.txt")
+        with open(output_path, "w") as fout:
+            for record in records:
+                fout.write(
+                    f"{record['req_id']}\t"
+                    f"{record['batch_idx']}\t"
+                    f"{record['batch_size']}\t"
+                    f"{record['submit_ns']}\t"
+                    f"{record['dispatch_ns']}\t"
+                    f"{record['done_ns']}\n"
+                )
+        return summary
+
+    def run(self) -> dict:
+        questions, _ = self.request.get_questions(self.request.req_count, start_idx=0)
+        cprint.iprintf(
+            f"*** Closed-loop sweep over concurrency {self.levels} with {len(questions)} questions"
+        )
+
+        level_summaries = []
+        for concurrency in self.levels:
+            level_summaries.append(self.run_level(questions, concurrency))
+        knee = find_saturation_knee(
+            level_summaries, self.throughput_gain_threshold, self.p99_growth_threshold
+        )
+
+        output_path = os.path.join(Logger().log_dirpath, "closed_loop_sweep.txt")
+        with open(output_path, "w") as fout:
+            for summary in level_summaries:
+                fout.write(
+                    f"{summary['concurrency']}\t"
+                    f"{summary['requests']}\t"
+                    f"{summary['throughput']:.6f}\t"
+                    f"{summary['avg_batch_size']:.4f}\t"
+                    f"{summary['e2e']['p50']:.0f}\t"
+                    f"{summary['e2e']['p95']:.0f}\t"
+                    f"{summary['e2e']['p99']:.0f}\n"
+                )
+
+        print("Throughput vs latency:")
+        for summary in level_summaries:
+            print(
+                f"  {summary['concurrency']:>5} users: {summary['throughput']:10.3f} req/s, "
+                f"p99 {summary['e2e']['p99'] / 1e6:.3f} ms"
+            )
+        if knee is None:
+            cprint.wprintf("*** Throughput kept growing, no saturation knee found")
+        else:
+            cprint.iprintf(
+                f"*** Saturation knee at {knee['concurrency']} users: "
+                f"{knee['throughput']:.3f} req/s, p99 {knee['e2e']['p99'] / 1e6:.3f} ms "
+                f"(x{knee['p99_growth']:.2f} at the next level, {knee['reason']} knee)"
+            )
+        return {"levels": level_summaries, "knee": knee}
@@ -0,0 +1,175 @@
+import os
+import random
+import time
+
+import utils.colored_print as cprint
+from utils.logger import Logger, log_time_breakdown
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+
+def constant_arrivals(rate):
+    """Arrival offsets (in s) of a constant-rate process with `rate` requests per second"""
+    assert rate > 0, f"Arrival rate must be positive, got {rate}"
+    idx = 0
+    while True:
+        yield idx / rate
+        idx += 1
+
+
+def poisson_arrivals(rate, seed=0):
+    """Arrival offsets (in s) of a Poisson process with mean `rate` requests per second"""
+    assert rate > 0, f"Arrival rate must be positive, got {rate}"
+    rng = random.Random(seed)
+    offset = 0.0
+    while True:
+        yield offset
+        offset += rng.expovariate(rate)
+
+
+def step_arrivals(steps, poisson=False, seed=0):
+    """
+    Arrival offsets (in s) of a step-ramped process. `steps` is a list of (duration_s, rate)
+    pairs, each step issues requests at its own rate (constant or Poisson) for its own duration.
+    The process ends after the last step.
+    """
+    rng = random.Random(seed)
+    step_start = 0.0
+    for duration, rate in steps:
+        assert rate > 0, f"Arrival rate must be positive, got {rate}"
+        offset = 0.0
+        while offset < duration:
+            yield step_start + offset
+            offset += rng.expovariate(rate) if poisson else 1 / rate
+        step_start += duration
+
+
+def get_arrivals(arrival, rate=None, steps=None, seed=0):
+    if arrival == "constant":
+        return constant_arrivals(rate)
+    elif arrival == "poisson":
+        return poisson_arrivals(rate, seed=seed)
+    elif arrival == "step":
+        return step_arrivals(steps, seed=seed)
+    elif arrival == "step_poisson":
+        return step_arrivals(steps, poisson=True, seed=seed)
+    else:
+        raise ValueError(f"Unsupported arrival process: {arrival}")
+
+
+class OpenLoopLoadGenerator:
+    """
+    Open-loop load generator over a RAGRequest (e.g. WikipediaRequests). Requests are issued to a
+    RequestServer at the times given by an arrival process, regardless of whether previous ones
+    have completed, so queueing delay shows up in the measured latency.
+    """
+
+    def __init__(self, request, server, arrivals, stats_prefix="open_loop"):
+        if request.req_type != "query":
+            raise ValueError("Open-loop load generation only supports query requests.")
+        self.request = request
+        self.server = server
+        self.arrivals = arrivals
+        self.stats_prefix = stats_prefix
+
+    def run(self) -> dict:
+        # fetch all questions up front so that dataset loading is not part of the timed region
+        questions, _ = self.request.get_questions(self.request.req_count, start_idx=0)
+        cprint.iprintf(f"*** Open-loop run with {len(questions)} requests")
+
+        futures = []
+        max_lag_ns = 0
+        log_time_breakdown(f"{self.stats_prefix}_start")
+        start_time = time.monotonic_ns()
+        for question, offset in zip(questions, self.arrivals):
+            target_time = start_time + int(offset * 1e9)
+            sleep_ns = target_time - time.monotonic_ns()
+            if sleep_ns > 0:
+                time.sleep(sleep_ns / 1e9)
+            else:
+                # the generator itself fell behind schedule
+                max_lag_ns = max(max_lag_ns, -sleep_ns)
+            futures.append(self.server.submit(question))
+        issue_end_time = time.monotonic_ns()
+        records = []
+        errors = []
+        for issue_idx, future in enumerate(futures):
+            # a failed batch fails its requests only, the others are still measured
+            try:
+                records.append(future.result())
+            except Exception as e:
+                errors.append({"issue_idx": issue_idx, "error": f"{type(e).__name__}: {e}"})
+        log_time_breakdown(f"{self.stats_prefix}_done")
+
+        return self.report(records, start_time, issue_end_time, max_lag_ns, errors)
+
+    def report(self, records, start_time, issue_end_time, max_lag_ns=0, errors=()) -> dict:
+        output_dir = Logger().log_dirpath
+        if len(errors) > 0:
+            cprint.wprintf(
+                f"*** {len(errors)} open-loop requests failed, first: {errors[0]['error']}"
+            )
+            with open(os.path.join(output_dir, f"{self.stats_prefix}_errors.txt"), "w") as fout:
+                for error in errors:
+                    fout.write(f"{error['issue_idx']}\t{error['error']}\n")
+        if len(records) == 0:
+            raise RuntimeError(
+                f"No open-loop request completed ({len(errors)} failed), nothing to report"
+            )
+        end_time = max(record["done_ns"] for record in records)
+        e2e_latency = [record["done_ns"] - record["submit_ns"] for record in records]
+        queue_latency = [record["dispatch_ns"] - record["submit_ns"] for record in records]
+        service_latency = [record["done_ns"] - record["dispatch_ns"] for record in records]
+        issue_duration = issue_end_time - start_time
+        total_duration = end_time - start_time
+
+        summary = {
+            "requests": len(records),
+            "failed": len(errors),
+            # offered load counts every issued request, throughput only the completed ones
+            "offered_rate": (
+                (len(records) + len(errors)) / (issue_duration / 1e9) if issue_duration else 0.0
+            ),
+            "achieved_throughput": (
+                len(records) / (total_duration / 1e9) if total_duration else 0.0
+            ),
+            "max_issue_lag_ns": max_lag_ns,
+            "e2e": summarize_latency(e2e_latency),
+            "queue": summarize_latency(queue_latency),
+            "service": summarize_latency(service_latency),
+        }
+        print(
+            f"Open-loop run: {summary['requests']} requests ({summary['failed']} failed), "
+            f"offered {summary['offered_rate']:.3f} req/s, "
+            f"achieved {summary['achieved_throughput']:.3f} req/s\n"
+            f"  end-to-end latency: {format_latency_summary(summary['e2e'])}\n"
+            f"  queueing latency:   {format_latency_summary(summary['queue'])}\n"
+            f"  service latency:    {format_latency_summary(summary['service'])}"
+        )
+        if max_lag_ns > 1e6:
+            cprint.wprintf(
+                f"*** Load generator fell behind schedule by up to {max_lag_ns / 1e6:.3f} ms"
+            )
+
+        with open(os.path.join(output_dir, f"{self.stats_prefix}_requests.txt"), "w") as fout:
+            for record in records:
+                fout.write(
+                    f"{record['req_id']}\t"
+                    f"{record['batch_idx']}\t"
+                    f"{record['batch_size']}\t"
+                    f"{record['submit_ns']}\t"
+                    f"{record['dispatch_ns']}\t"
+                    f"{record['done_ns']}\n"
+                )
+        with open(os.path.join(output_dir, f"{self.stats_prefix}_stats.txt"), "a") as fout:
+            fout.write(
+                f"{summary['requests']}\t"
+                f"{summary['offered_rate']:.6f}\t"
+                f"{summary['achieved_throughput']:.6f}\t"
+                f"{summary['e2e']['p50']:.0f}\t"
+                f"{summary['e2e']['p95']:.0f}\t"
+                f"{summary['e2e']['p99']:.0f}\t"
+                f"{summary['queue']['p50']:.0f}\t"
+                f"{summary['queue']['p95']:.0f}\t"
+                f"{summary['queue']['p99']:.0f}\n"
+            )
+        return summary
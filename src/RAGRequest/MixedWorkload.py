@@ -0,0 +1,211 @@
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.colored_print as cprint
+from utils.logger import Logger, log_time_breakdown
+from utils.latency_stats import summarize_latency, format_latency_summary
+from RAGRequest.LoadGenerator import poisson_arrivals
+
+
+def level_writes(reads, write_fraction) -> int:
+    """Inserts added to `reads` queries so that they make up `write_fraction` of the operations"""
+    return round(reads * write_fraction / (1 - write_fraction))
+
+
+class MixedWorkloadSweep:
+    """
+    Mixed read/write workload. Queries arrive open-loop as a Poisson process of `rate` queries/s,
+    the same at every level, and inserts of `docs_per_insert` fresh documents arrive on top of
+    them as a second Poisson process, at the rate making them `write_fraction` of the operations.
+    The query load is thus constant, and the query latency only changes through interference
+    with the writes. Queries go to a RequestServer (or MicroBatchScheduler), inserts are
+    chunked, embedded and inserted by a DocumentIngester running concurrently in
+    `ingest_workers` threads.
+
+    Every write fraction in `write_fractions` is one level of the sweep, with `ops_per_level`
+    queries, run in its own MSys recording region (`monitor_factory(subdir)` creates a fresh MSys
+    instance recording to `subdir` of the output directory). The query latency of each level is
+    compared to the read-only level (write fraction 0, added if missing) to get the degradation
+    as a function of ingest rate.
+    """
+
+    def __init__(
+        self,
+        query_request,
+        update_request,
+        server,
+        ingester,
+        write_fractions,
+        rate,
+        ops_per_level=None,
+        docs_per_insert=1,
+        ingest_workers=1,
+        monitor_factory=None,
+        seed=0,
+        backend="",
+    ):
+        if query_request.req_type != "query":
+            raise ValueError("Mixed workload reads need query requests.")
+        if update_request.req_type != "update":
+            raise ValueError("Mixed workload writes need update requests.")
+        for write_fraction in write_fractions:
+            assert (
+                0 <= write_fraction < 1
+            ), f"Write fraction must be in [0, 1), got {write_fraction}"
+        self.query_request = query_request
+        self.update_request = update_request
+        self.server = server
+        self.ingester = ingester
+        self.write_fractions = sorted(set([0] + list(write_fractions)))
+        self.rate = rate
+        self.ops_per_level = ops_per_level or query_request.req_count
+        self.docs_per_insert = docs_per_insert
+        self.ingest_workers = ingest_workers
+        self.monitor_factory = monitor_factory
+        self.seed = seed
+        self.backend = backend
+
+    def get_schedule(self, write_fraction) -> list[tuple[float, str]]:
+        """(arrival offset in s, "read" or "write") of every operation of a level, by arrival"""
+        # the same query arrivals at every level, only the inserts on top of them change
+        reads = itertools.islice(poisson_arrivals(self.rate, seed=self.seed), self.ops_per_level)
+        schedule = [(offset, "read") for offset in reads]
+        nwrites = level_writes(self.ops_per_level, write_fraction)
+        if nwrites > 0:
+            write_rate = self.rate * write_fraction / (1 - write_fraction)
+            writes = itertools.islice(poisson_arrivals(write_rate, seed=self.seed + 1), nwrites)
+            schedule += [(offset, "write") for offset in writes]
+        return sorted(schedule)
+
+    def run_level(self, write_fraction, schedule, questions, documents) -> dict:
+        log_time_breakdown(f"mixed_w{write_fraction}")
+        with ThreadPoolExecutor(self.ingest_workers, "mixed_ingest") as ingest_executor:
+
+            def timed_ingest(docs):
+                return self.ingester.ingest(docs) | {"done_ns": time.monotonic_ns()}
+
+            def issue_and_wait():
+                ops = []
+                start_time = time.monotonic_ns()
+                nreads = nwrites = 0
+                for offset, op_type in schedule:
+                    target_time = start_time + int(offset * 1e9)
+                    sleep_ns = target_time - time.monotonic_ns()
+                    if sleep_ns > 0:
+                        time.sleep(sleep_ns / 1e9)
+                    submit_time = time.monotonic_ns()
+                    if op_type == "read":
+                        future = self.server.submit(questions[nreads % len(questions)])
+                        nreads += 1
+                    else:
+                        docs = documents[
+                            nwrites * self.docs_per_insert : (nwrites + 1) * self.docs_per_insert
+                        ]
+                        future = ingest_executor.submit(timed_ingest, docs)
+                        nwrites += 1
+                    ops.append((op_type, submit_time, future))
+                return start_time, [
+                    (op_type, submit, future.result()) for op_type, submit, future in ops
+                ]
+
+            if self.monitor_factory is not None:
+                with self.monitor_factory(f"w{write_fraction}"):
+                    start_time, results = issue_and_wait()
+            else:
+                start_time, results = issue_and_wait()
+        end_time = max(result["done_ns"] for _, _, result in results)
+        duration = (end_time - start_time) / 1e9
+
+        read_latency = [
+            result["done_ns"] - submit for op_type, submit, result in results if op_type == "read"
+        ]
+        writes = [(submit, result) for op_type, submit, result in results if op_type == "write"]
+        summary = {
+            "write_fraction": write_fraction,
+            "reads": len(read_latency),
+            "writes": len(writes),
+            "read_throughput": len(read_latency) / duration,
+            "ingest_rate": len(writes) / duration,
+            "chunk_rate": sum(result["chunks"] for _, result in writes) / duration,
+            "read": summarize_latency(read_latency),
+            "write": summarize_latency([result["done_ns"] - submit for submit, result in writes]),
+        }
+        print(
+            f"Write fraction {write_fraction}: {summary['reads']} queries, "
+            f"{summary['writes']} inserts ({summary['ingest_rate']:.3f} inserts/s, "
+            f"{summary['chunk_rate']:.3f} chunks/s)\n"
+            f"  query latency:  {format_latency_summary(summary['read'])}\n"
+            f"  insert latency: {format_latency_summary(summary['write'])}"
+        )
+
+        output_path = os.path.join(Logger().log_dirpath, f"mixed_w{write_fraction}_ops.txt")
+        with open(output_path, "w") as fout:
+            for op_idx, (op_type, submit, result) in enumerate(results):
+                fout.write(
+                    f"{op_idx}\t"
+                    f"{op_type}\t"
+                    f"{submit}\t"
+                    f"{result['done_ns']}\t"
+                    f"{result['chunks'] if op_type == 'write' else 0}\n"
+                )
+        return summary
+
+    def run(self) -> list[dict]:
+        # fetch questions and documents up front so that dataset loading is not part of the runs
+        schedules = [self.get_schedule(write_fraction) for write_fraction in self.write_fractions]
+        questions, _ = self.query_request.get_questions(self.query_request.req_count, start_idx=0)
+        total_writes = sum(
+            level_writes(self.ops_per_level, fraction) for fraction in self.write_fractions
+        )
+        documents = []
+        if total_writes > 0:
+            documents = self.update_request.get_documents(total_writes * self.docs_per_insert)
+        cprint.iprintf(
+            f"*** Mixed workload sweep over write fractions {self.write_fractions} at "
+            f"{self.rate} queries/s, {len(documents)} documents to insert"
+        )
+
+        level_summaries = []
+        doc_idx = 0
+        for write_fraction, schedule in zip(self.write_fractions, schedules):
+            level_docs = level_writes(self.ops_per_level, write_fraction) * self.docs_per_insert
+            level_summaries.append(
+                self.run_level(
+                    write_fraction, schedule, questions, documents[doc_idx : doc_idx + level_docs]
+                )
+            )
+            doc_idx += level_docs
+
+        baseline = level_summaries[0]["read"]
+        for summary in level_summaries:
+            summary["p50_degradation"] = summary["read"]["p50"] / baseline["p50"]
+            summary["p99_degradation"] = summary["read"]["p99"] / baseline["p99"]
+
+        output_path = os.path.join(Logger().log_dirpath, "mixed_workload.txt")
+        with open(output_path, "a") as fout:
+            for summary in level_summaries:
+                fout.write(
+                    f"{self.backend}\t"
+                    f"{summary['write_fraction']}\t"
+                    f"{summary['reads']}\t"
+                    f"{summary['writes']}\t"
+                    f"{summary['ingest_rate']:.6f}\t"
+                    f"{summary['chunk_rate']:.6f}\t"
+                    f"{summary['read_throughput']:.6f}\t"
+                    f"{summary['read']['p50']:.0f}\t"
+                    f"{summary['read']['p95']:.0f}\t"
+                    f"{summary['read']['p99']:.0f}\t"
+                    f"{summary['p50_degradation']:.4f}\t"
+                    f"{summary['p99_degradation']:.4f}\n"
+                )
+
+        print(f"Query latency vs ingest rate ({self.backend}):")
+        for summary in level_summaries:
+            print(
+                f"  {summary['ingest_rate']:8.3f} inserts/s ({summary['chunk_rate']:10.3f} chunks/s): "
+                f"p50 {summary['read']['p50'] / 1e6:.3f} ms (x{summary['p50_degradation']:.2f}), "
+                f"p99 {summary['read']['p99'] / 1e6:.3f} ms (x{summary['p99_degradation']:.2f})"
+            )
+        return level_summaries
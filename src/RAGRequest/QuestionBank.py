@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+import utils.colored_print as cprint
+
+
+class QuestionBank:
+    """
+    Questions and ground-truth answers of a question dataset, loaded from the Hugging Face hub once
+    and persisted as an Arrow IPC file keyed by dataset and split. Later runs memory-map that file,
+    so opening the bank costs no parsing and a batch is a zero-copy slice at any offset.
+
+    `get_batch` can prefetch the following batch in a background thread, so that materializing
+    batches overlaps with the stages consuming them.
+    """
+
+    DEFAULT_CACHE_DIR = os.path.join(
+        os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface")),
+        "ragperf_question_bank",
+    )
+
+    __banks = {}
+    __banks_lock = threading.Lock()
+
+    def __init__(
+        self,
+        dataset_name="sentence-transformers/natural-questions",
+        split="train",
+        question_column="query",
+        answer_column="answer",
+        cache_dir=None,
+    ):
+        self.dataset_name = dataset_name
+        self.split = split
+        self.question_column = question_column
+        self.answer_column = answer_column
+        self.cache_dir = cache_dir or QuestionBank.DEFAULT_CACHE_DIR
+        self.path = os.path.join(self.cache_dir, f"{dataset_name.replace('/', '__')}_{split}.arrow")
+        if not os.path.isfile(self.path):
+            self.__build()
+        # the table references the mapped file, nothing is read until a batch is materialized
+        self.table = ipc.open_file(pa.memory_map(self.path, "r")).read_all()
+        self.__executor = ThreadPoolExecutor(1, "question_prefetch")
+        self.__prefetched = None
+        self.__prefetch_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, dataset_name="sentence-transformers/natural-questions", split="train", **kwargs):
+        """Return the bank of `dataset_name`/`split` shared by the whole process, open it if needed"""
+        with cls.__banks_lock:
+            if (dataset_name, split) not in cls.__banks:
+                cls.__banks[(dataset_name, split)] = cls(dataset_name, split, **kwargs)
+            return cls.__banks[(dataset_name, split)]
+
+    def __build(self):
+        import datasets
+
+        cprint.iprintf(f"*** Building question bank {self.path}")
+        try:
+            ds = datasets.load_dataset(self.dataset_name, split=self.split)
+        except ConnectionError as e:
+            if datasets.config.HF_DATASETS_OFFLINE:
+                print(
+                    "***Dataset autodownload disabled and no dataset is found under "
+                    f"HF_CACHE_HOME: <{datasets.config.HF_CACHE_HOME}>"
+                )
+            raise e
+        table = ds.select_columns([self.question_column, self.answer_column]).with_format("arrow")[
+            :
+        ]
+        table = table.rename_columns(["question", "answer"])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __read(self, start_idx, batch_size):
+        batch = self.table.slice(start_idx, batch_size)
+        return batch.column("question").to_pylist(), batch.column("answer").to_pylist()
+
+    def get_batch(self, start_idx, batch_size, prefetch_next=False):
+        """
+        Questions and answers [start_idx, start_idx + batch_size). With `prefetch_next`, the batch
+        right after it is read in the background for the next call.
+        """
+        with self.__prefetch_lock:
+            prefetched, self.__prefetched = self.__prefetched, None
+            next_idx = start_idx + batch_size
+            if prefetch_next and next_idx < len(self):
+                self.__prefetched = (
+                    (next_idx, batch_size),
+                    self.__executor.submit(self.__read, next_idx, batch_size),
+                )
+        if prefetched is not None and prefetched[0] == (start_idx, batch_size):
+            return prefetched[1].result()
+        return self.__read(start_idx, batch_size)
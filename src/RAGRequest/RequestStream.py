@@ -0,0 +1,219 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+import utils.colored_print as cprint
+from RAGRequest.BaseRAGRequest import BaseRAGRequest
+from utils.logger import Logger
+
+DISTRIBUTIONS = ["sequential", "uniform", "zipf"]
+
+# how every request of the stream was drawn
+FRESH, REPEAT, PARAPHRASE = 0, 1, 2
+KIND_NAMES = ["fresh", "repeat", "paraphrase"]
+
+PARAPHRASE_PREFIXES = [
+    "can you tell me ",
+    "i would like to know ",
+    "do you know ",
+    "please explain ",
+    "question: ",
+]
+
+
+def paraphrase(question, rng) -> str:
+    """
+    Near-duplicate of `question`: a leading phrase is added, then the question mark and the
+    order of two adjacent words may change. Never equal to `question`, so an exact-match cache
+    misses it while a semantic one should not.
+    """
+    words = question.split(" ")
+    if len(words) > 2 and rng.random() < 0.5:
+        swap = int(rng.integers(0, len(words) - 1))
+        words[swap], words[swap + 1] = words[swap + 1], words[swap]
+    text = PARAPHRASE_PREFIXES[int(rng.integers(0, len(PARAPHRASE_PREFIXES)))] + " ".join(words)
+    if rng.random() < 0.5:
+        text = text.rstrip("?") if text.endswith("?") else text + "?"
+    return text
+
+
+class RequestStream(BaseRAGRequest):
+    """
+    Skewed request stream of `req_count` queries over the questions of `pool` (a query request,
+    e.g. WikipediaRequests, whose `req_count` is the pool size), served through the same
+    `get_questions` interface so that it can replace the pool in any pipeline or load generator.
+
+    Questions are drawn from the pool in order (`sequential`), uniformly, or with a Zipfian
+    popularity of exponent `zipf_s`. On top of that, a `repeat_ratio` fraction of the requests
+    repeats the exact text of an earlier request and a `paraphrase_ratio` fraction is a near
+    duplicate (see `paraphrase`) of a drawn question. With `locality_window` set, the stream is
+    cut into windows of that many requests: every window ranks the pool popularity anew and
+    repeats only reach back within the window, so the hot set drifts over time.
+
+    The stream is generated once by `init_requests` from `seed`, which then reports the realized
+    distribution: how many distinct questions and texts were issued, the share of the most
+    popular ones, the fitted Zipf exponent and the best hit rate an exact-match or a semantic
+    cache could reach.
+    """
+
+    def __init__(
+        self,
+        pool,
+        req_count,
+        distribution="zipf",
+        zipf_s=1.0,
+        repeat_ratio=0.0,
+        paraphrase_ratio=0.0,
+        locality_window=None,
+        seed=0,
+    ):
+        if pool.req_type != "query":
+            raise ValueError("Request streams only support query requests.")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(
+                f"Unsupported request distribution: {distribution}. Must be one of {DISTRIBUTIONS}."
+            )
+        if repeat_ratio < 0 or paraphrase_ratio < 0 or repeat_ratio + paraphrase_ratio > 1:
+            raise ValueError(
+                f"Invalid repeat ({repeat_ratio}) and paraphrase ({paraphrase_ratio}) ratios, "
+                f"they must be non-negative and sum to at most 1."
+            )
+        super().__init__(pool.run_name, pool.collection_name, "query", pool.dataset_name, req_count)
+        self.pool = pool
+        self.distribution = distribution
+        self.zipf_s = zipf_s
+        self.repeat_ratio = repeat_ratio
+        self.paraphrase_ratio = paraphrase_ratio
+        self.locality_window = locality_window or req_count
+        self.seed = seed
+        self.query_list = None
+        self.pool_ids = None
+        self.kinds = None
+
+    def __draw(self, rng, pool_size, window_start, count) -> np.ndarray:
+        """Pool indices of `count` requests of the window starting at request `window_start`"""
+        if self.distribution == "sequential":
+            return np.arange(window_start, window_start + count) % pool_size
+        if self.distribution == "uniform":
+            return rng.integers(0, pool_size, count)
+        weights = 1.0 / np.arange(1, pool_size + 1) ** self.zipf_s
+        ranks = rng.choice(pool_size, count, p=weights / weights.sum())
+        # the popularity rank of every question is reshuffled with each window
+        return rng.permutation(pool_size)[ranks]
+
+    def init_requests(self, num=None):
+        if self.query_list is not None:
+            return
+        self.pool.init_requests()
+        pool_questions, pool_answers = self.pool.get_questions(self.pool.req_count, start_idx=0)
+        pool_size = len(pool_questions)
+        rng = np.random.default_rng(self.seed)
+
+        questions, answers = [], []
+        self.pool_ids = np.empty(self.req_count, dtype=np.int64)
+        self.kinds = np.empty(self.req_count, dtype=np.int8)
+        for window_start in range(0, self.req_count, self.locality_window):
+            count = min(self.locality_window, self.req_count - window_start)
+            draws = self.__draw(rng, pool_size, window_start, count)
+            coins = rng.random(count)
+            for offset in range(count):
+                idx = window_start + offset
+                if coins[offset] < self.repeat_ratio and offset > 0:
+                    # exact repeat of an earlier request of the window
+                    source = window_start + int(rng.integers(0, offset))
+                    self.pool_ids[idx] = self.pool_ids[source]
+                    self.kinds[idx] = REPEAT
+                    questions.append(questions[source])
+                    answers.append(answers[source])
+                    continue
+                pool_id = int(draws[offset])
+                self.pool_ids[idx] = pool_id
+                if coins[offset] < self.repeat_ratio + self.paraphrase_ratio:
+                    self.kinds[idx] = PARAPHRASE
+                    questions.append(paraphrase(pool_questions[pool_id], rng))
+                else:
+                    self.kinds[idx] = FRESH
+                    questions.append(pool_questions[pool_id])
+                answers.append(pool_answers[pool_id])
+        self.query_list = {"questions": questions, "ground_truth_answers": answers}
+        self.report()
+
+    def get_questions(self, batch_size, start_idx=0):
+        self.init_requests()
+        return (
+            self.query_list["questions"][start_idx : start_idx + batch_size],
+            self.query_list["ground_truth_answers"][start_idx : start_idx + batch_size],
+        )
+
+    def get_stats(self) -> dict:
+        """Realized distribution of the stream"""
+        self.init_requests()
+        counts = np.array(sorted(Counter(self.pool_ids.tolist()).values(), reverse=True))
+        distinct_texts = len(set(self.query_list["questions"]))
+        # least-squares slope of the log-log rank/frequency plot
+        zipf_fit = 0.0
+        if len(counts) > 1:
+            zipf_fit = -np.polyfit(np.log(np.arange(1, len(counts) + 1)), np.log(counts), 1)[0]
+        top_1pct = max(1, self.pool.req_count // 100)
+        return {
+            "requests": self.req_count,
+            "pool_size": self.pool.req_count,
+            "distinct_questions": len(counts),
+            "distinct_texts": distinct_texts,
+            "repeats": int(np.sum(self.kinds == REPEAT)),
+            "paraphrases": int(np.sum(self.kinds == PARAPHRASE)),
+            "top1_share": float(counts[0] / self.req_count),
+            "top1pct_share": float(counts[:top_1pct].sum() / self.req_count),
+            "zipf_fit": float(zipf_fit),
+            # requests whose text (resp. question) was already issued, i.e. the hit rate of an
+            # unbounded exact-match (resp. perfect semantic) cache
+            "exact_hit_bound": 1 - distinct_texts / self.req_count,
+            "semantic_hit_bound": 1 - len(counts) / self.req_count,
+        }
+
+    def report(self) -> dict:
+        stats = self.get_stats()
+        cprint.iprintf(
+            f"*** Request stream ({self.distribution}): {stats['requests']} requests over a pool "
+            f"of {stats['pool_size']}, {stats['distinct_questions']} distinct questions, "
+            f"{stats['distinct_texts']} distinct texts, {stats['repeats']} repeats, "
+            f"{stats['paraphrases']} paraphrases\n"
+            f"  top-1 share: {stats['top1_share'] * 100:.2f}%, top-1% share: "
+            f"{stats['top1pct_share'] * 100:.2f}%, fitted zipf exponent: {stats['zipf_fit']:.3f}\n"
+            f"  cache hit bound, exact: {stats['exact_hit_bound'] * 100:.2f}%, "
+            f"semantic: {stats['semantic_hit_bound'] * 100:.2f}%"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "request_stream_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.distribution}\t"
+                f"{self.zipf_s}\t"
+                f"{self.repeat_ratio}\t"
+                f"{self.paraphrase_ratio}\t"
+                f"{self.locality_window}\t"
+                + "\t".join(
+                    f"{value:.6f}" if isinstance(value, float) else str(value)
+                    for value in stats.values()
+                )
+                + "\n"
+            )
+        # the request sequence itself, to replay it against a cache simulator
+        output_path = os.path.join(Logger().log_dirpath, "request_stream.txt")
+        with open(output_path, "w") as fout:
+            for idx, (pool_id, kind) in enumerate(zip(self.pool_ids, self.kinds)):
+                fout.write(f"{idx}\t{pool_id}\t{KIND_NAMES[kind]}\n")
+        return stats
+
+
+def build_request_stream(make_pool, req_count, stream_config=None):
+    """
+    Query request for a run: `make_pool(count)` builds a query request of `count` questions, which
+    is used as is without `stream_config`, or as the pool of a RequestStream of `req_count`
+    requests configured by `stream_config` (RequestStream arguments, plus the `pool_size`).
+    """
+    if not stream_config:
+        return make_pool(req_count)
+    stream_kwargs = dict(stream_config)
+    pool = make_pool(stream_kwargs.pop("pool_size", req_count))
+    return RequestStream(pool, req_count, **stream_kwargs)
@@ -0,0 +1,103 @@
+import numpy as np
+
+from RAGRequest.BaseRAGRequest import BaseRAGRequest
+from datasetLoader.SyntheticDatasetLoader import doc_marker
+
+
+class SyntheticRequests(BaseRAGRequest):
+    """
+    Queries over a SyntheticDatasetLoader corpus, each one planted next to a known target
+    document drawn uniformly from the first `corpus_length` (ingested) documents.
+
+    A text question is a window of `question_length` words of its target, with that window as the
+    ground truth. A query vector is the target's vector moved by `query_noise` (relative to the
+    cluster spread) and renormalized, so the target is its nearest neighbor as long as
+    `query_noise` stays well below 1. `recall_at_k` checks retrieved contexts for the target.
+    """
+
+    def __init__(
+        self,
+        run_name,
+        collection_name,
+        req_type,
+        req_count,
+        loader,
+        corpus_length=None,
+        question_length=16,
+        query_noise=0.1,
+        seed=0,
+    ):
+        super().__init__(run_name, collection_name, req_type, loader.dataset_name, req_count)
+        self.loader = loader
+        self.corpus_length = corpus_length or loader.total_length
+        self.question_length = question_length
+        self.query_noise = query_noise
+        self.seed = seed
+        rng = np.random.default_rng([loader.seed, 4, seed])
+        self.targets = rng.integers(0, self.corpus_length, req_count)
+        self.offsets = rng.random(req_count)
+        self.query_list = None
+        self.query_vectors = None
+
+    def init_requests(self, num=None):
+        # generate the queries of the corpus kind up front, the other kind is generated on demand
+        if self.req_type != "query":
+            return
+        if self.loader.pre_embedded:
+            self.__build_query_vectors()
+        else:
+            self.__build_questions()
+
+    def __build_questions(self):
+        if self.query_list is not None:
+            return
+        # generate every block holding a target once
+        block_size = self.loader.BLOCK_SIZE
+        questions = [None] * self.req_count
+        for block_idx in np.unique(self.targets // block_size):
+            block = self.loader.get_text_block(block_idx)
+            for query_idx in np.nonzero(self.targets // block_size == block_idx)[0]:
+                words = block[self.targets[query_idx] % block_size].split(" ")
+                first = int(self.offsets[query_idx] * max(len(words) - self.question_length, 0))
+                questions[query_idx] = " ".join(words[first : first + self.question_length])
+        self.query_list = {"questions": questions, "ground_truth_answers": list(questions)}
+
+    def get_questions(self, batch_size, start_idx=0):
+        if self.req_type != "query":
+            raise ValueError("This request type is not supported for question retrieval.")
+        self.__build_questions()
+        return (
+            self.query_list["questions"][start_idx : start_idx + batch_size],
+            self.query_list["ground_truth_answers"][start_idx : start_idx + batch_size],
+        )
+
+    def __build_query_vectors(self):
+        if self.query_vectors is not None:
+            return
+        block_size = self.loader.BLOCK_SIZE
+        vectors = np.empty((self.req_count, self.loader.dim), dtype=np.float32)
+        for block_idx in np.unique(self.targets // block_size):
+            block = self.loader.get_vector_block(block_idx)
+            in_block = np.nonzero(self.targets // block_size == block_idx)[0]
+            vectors[in_block] = block[self.targets[in_block] % block_size]
+        rng = np.random.default_rng([self.loader.seed, 5, self.seed, self.req_count])
+        noise = rng.standard_normal(vectors.shape, dtype=np.float32)
+        vectors += noise * (self.query_noise * self.loader.cluster_std / np.sqrt(self.loader.dim))
+        self.query_vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def get_query_vectors(self, batch_size, start_idx=0):
+        """Query vectors [start_idx, start_idx + batch_size) and the marker of their target"""
+        self.__build_query_vectors()
+        targets = self.targets[start_idx : start_idx + batch_size]
+        return (
+            self.query_vectors[start_idx : start_idx + batch_size],
+            [doc_marker(target) for target in targets],
+        )
+
+    @staticmethod
+    def recall_at_k(contexts, markers) -> list[bool]:
+        """Whether the target of every query is among its retrieved contexts"""
+        return [
+            any(f"Detail: {marker}\n" in context for context in query_contexts)
+            for query_contexts, marker in zip(contexts, markers)
+        ]
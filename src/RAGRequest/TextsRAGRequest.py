@@ -1,40 +1,62 @@
-import datasets
 from RAGRequest.BaseRAGRequest import BaseRAGRequest
+from RAGRequest.QuestionBank import QuestionBank
 
 
 class WikipediaRequests(BaseRAGRequest):
-    def __init__(self, run_name, collection_name, req_type, req_count):
+    def __init__(
+        self,
+        run_name,
+        collection_name,
+        req_type,
+        req_count,
+        doc_offset=None,
+        question_cache_dir=None,
+    ):
         # Ensure dataset_name is fixed to "wikimedia/wikipedia"
         dataset_name = "wikimedia/wikipedia"
-        self.query_list = None
+        # questions come from a memory-mapped question bank shared by the process, see QuestionBank
+        self.question_cache_dir = question_cache_dir
+        self.question_bank = None
+        # update requests insert documents starting from doc_offset, or from the tail of the
+        # dataset (never ingested unless dataset_ratio is 1) if not given
+        self.doc_offset = doc_offset
+        self.loader = None
         super().__init__(run_name, collection_name, req_type, dataset_name, req_count)
 
-    def init_requests(self, num):
-        if self.req_type == "query":
-            questions, gt_answers = self.get_questions(num)
-            query_list = {"questions": questions, "ground_truth_answers": gt_answers}
-            # ground_truth =  data_processor.get_ground_truth(questions, gt_answers)
+    def init_requests(self, num=None):
+        if self.req_type == "query" and self.question_bank is None:
+            self.question_bank = QuestionBank.get(
+                "sentence-transformers/natural-questions",
+                split="train",
+                cache_dir=self.question_cache_dir,
+            )
 
     def get_questions(self, batch_size, start_idx=0):
         if self.req_type != "query":
             raise ValueError("This request type is not supported for question retrieval.")
-        if self.query_list is not None:
-            questions = self.query_list["questions"][start_idx : start_idx + batch_size]
-            gt_answers = self.query_list["ground_truth_answers"][start_idx : start_idx + batch_size]
-            return questions, gt_answers
-        else:
-            try:
-                ds = datasets.load_dataset("sentence-transformers/natural-questions", split="train")
-            except ConnectionError as e:
-                if datasets.config.HF_DATASETS_OFFLINE:
-                    print(
-                        "***Dataset autodownload disabled and no dataset is found under "
-                        f"HF_CACHE_HOME: <{datasets.config.HF_CACHE_HOME}>"
-                    )
-                raise e
+        self.init_requests()
+        # requests are consumed batch after batch, read the next one while this one is processed
+        return self.question_bank.get_batch(
+            start_idx, batch_size, prefetch_next=start_idx + batch_size < self.req_count
+        )
 
-            # Extract questions and answers
-            questions = ds["query"][start_idx : start_idx + batch_size]
-            gt_answers = ds["answer"][start_idx : start_idx + batch_size]
+    def get_documents(self, count, start_idx=0):
+        """Text of `count` documents to insert, starting from the `start_idx`-th update"""
+        if self.req_type != "update":
+            raise ValueError("This request type is not supported for document retrieval.")
+        if self.loader is None:
+            from datasetLoader.TextDatasetLoader import TextDatasetLoader
 
-        return questions, gt_answers
+            self.loader = TextDatasetLoader(dataset_name=self.dataset_name)
+        total_length = self.loader.total_length
+        if self.doc_offset is None:
+            first_idx = total_length - self.req_count + start_idx
+        else:
+            first_idx = self.doc_offset + start_idx
+        last_idx = min(first_idx + count, total_length)
+        if first_idx < 0 or first_idx >= total_length:
+            raise ValueError(
+                f"Documents {first_idx} to {first_idx + count} out of range. "
+                f"Dataset has {total_length} samples."
+            )
+        return self.loader.dataset.select(range(first_idx, last_idx))["text"]
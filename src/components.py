@@ -0,0 +1,118 @@
+from utils.component_registry import ComponentRegistry
+
+# every heavy dependency (torch, vllm, vector DB clients, colpali, docling, ragas) lives behind one
+# of those registries, so a run only imports the backends its config selects
+
+VECTOR_DBS = ComponentRegistry(
+    "vector_db",
+    {
+        "milvus": "vectordb.milvus_api:milvus_client",
+        "lancedb": "vectordb.lancedb_api:lance_client",
+        "qdrant": "vectordb.qdrant_api:qdrant_client",
+        "chroma": "vectordb.chroma_api:chroma_client",
+        "elasticsearch": "vectordb.elastic_api:elastic_client",
+    },
+)
+
+DATASET_LOADERS = ComponentRegistry(
+    "dataset_loader",
+    {
+        "wikimedia/wikipedia": "datasetLoader.TextDatasetLoader:TextDatasetLoader",
+        "common-pile/arxiv_papers": "datasetLoader.PDFDatasetLoader:PDFDatasetLoader",
+        "synthetic": "datasetLoader.SyntheticDatasetLoader:SyntheticDatasetLoader",
+    },
+)
+
+DATASET_PREPROCESSORS = ComponentRegistry(
+    "dataset_preprocess",
+    {
+        "wikimedia/wikipedia": "datasetPreprocess.TextDatasetPreprocess:TextDatasetPreprocess",
+        "common-pile/arxiv_papers": "datasetPreprocess.PDFDatasetPreprocess:PDFDatasetPreprocess",
+        "synthetic": "datasetPreprocess.TextDatasetPreprocess:TextDatasetPreprocess",
+    },
+)
+
+# keyed by bench.type
+ENCODERS = ComponentRegistry(
+    "encoder",
+    {
+        "text": "encoder.sentenceTransformerEncoder:SentenceTransformerEncoder",
+        "image": "encoder.ColPaliEncoder:ColPaliEncoder",
+    },
+)
+
+# keyed by bench.type, with an "_async" suffix for pipeline.mode: async
+RESPONSERS = ComponentRegistry(
+    "responser",
+    {
+        "text": "RAGPipeline.responser.TextsResponser:VLLMResponser",
+        "text_async": "RAGPipeline.responser.TextsResponser:AsyncVLLMResponser",
+        "image": "RAGPipeline.responser.ImagesResponser:ImageResponser",
+    },
+)
+
+PIPELINES = ComponentRegistry(
+    "pipeline",
+    {
+        "text": "RAGPipeline.TextsRAGPipline:TextsRAGPipeline",
+        "text_async": "RAGPipeline.AsyncTextsRAGPipeline:AsyncTextsRAGPipeline",
+        "image": "RAGPipeline.ImageRAGPipline:ImagesRAGPipeline",
+    },
+)
+
+# keyed by reranking.type
+RERANKERS = ComponentRegistry(
+    "reranker",
+    {
+        "cross_encoder": "RAGPipeline.reranker.CrossEncoderReranker:CrossEncoderReranker",
+    },
+)
+
+# keyed by evaluate.type
+EVALUATORS = ComponentRegistry(
+    "evaluator",
+    {
+        "ragas_vllm": "evaluator.Ragasvllm:Ragasvllm",
+        "ragas_openai": "evaluator.RagasOpenAI:RagasOpenAI",
+    },
+)
+
+
+def resolve_components(config) -> dict:
+    """
+    Import the components selected by `config` up front, so that the import cost is paid (and
+    reported) before the run starts. Returns the selected classes keyed by component kind, kinds
+    not needed by the run are left out.
+    """
+    bench_type = config["bench"]["type"]
+    dataset_name = config["bench"]["dataset"]
+    actions = config["rag"]["action"]
+    pipeline_mode = config["rag"].get("pipeline", {}).get("mode", "batch")
+    variant = f"{bench_type}_async" if pipeline_mode == "async" else bench_type
+
+    components = {"vector_db": VECTOR_DBS.get(config["sys"]["vector_db"]["type"])}
+    if dataset_name == "synthetic":
+        # synthetic queries are generated from the corpus
+        components["dataset_loader"] = DATASET_LOADERS.get(dataset_name)
+        if config["bench"].get("synthetic", {}).get("pre_embedded", False):
+            # vectors are generated as well, no model is involved at all
+            return components
+    if actions["preprocess"]:
+        components["dataset_loader"] = DATASET_LOADERS.get(dataset_name)
+    if actions["preprocess"] or (actions["generation"] and pipeline_mode == "mixed"):
+        # the mixed workload chunks the documents it inserts while serving queries
+        components["dataset_preprocess"] = DATASET_PREPROCESSORS.get(dataset_name)
+    if actions["embedding"] or actions["generation"]:
+        components["encoder"] = ENCODERS.get(bench_type)
+    if actions["generation"]:
+        components["responser"] = RESPONSERS.get(variant)
+        components["pipeline"] = PIPELINES.get(variant)
+        if actions["reranking"]:
+            components["reranker"] = RERANKERS.get(
+                config["rag"]["reranking"].get("type", "cross_encoder")
+            )
+        if actions["evaluate"]:
+            components["evaluator"] = EVALUATORS.get(
+                config["rag"]["evaluate"].get("type", "ragas_vllm")
+            )
+    return components
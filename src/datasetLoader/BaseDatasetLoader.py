@@ -5,6 +5,8 @@ import pandas as pd
 class BaseDatasetLoader(ABC):
     def __init__(self, dataset_name) -> None:
         self.dataset_name = dataset_name
+        # identifies the exact content of the dataset (e.g. for caches), None if unknown
+        self.revision = None
         return
 
     @abstractmethod
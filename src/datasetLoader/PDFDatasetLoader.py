@@ -2,8 +2,7 @@ from datasetLoader.BaseDatasetLoader import BaseDatasetLoader
 import pandas as pd
 import datasets
 import os
-import requests
-from tqdm import tqdm
+from datasetLoader.PDFDownloader import PDFDownloader
 
 
 # TODO add a delete method
@@ -30,45 +29,28 @@ class PDFDatasetLoader(BaseDatasetLoader):
         self.total_length = len(ds["train"])
         self.output_dir = output_dir
 
-    def download_pdf(self, load_num):
+    def iter_pdf_urls(self):
+        """(file name, PDF url) of every paper, in dataset order"""
+        for example in self.dataset:
+            url = example["metadata"]["url"]
+            if "arxiv.org/abs/" in url:
+                url = url.replace("arxiv.org/abs/", "arxiv.org/pdf/")
+            yield f"{example['id']}.pdf", url
+
+    def download_pdf(self, load_num, **downloader_kwargs):
+        """
+        Make sure the first `load_num` downloadable papers are in output_dir, see PDFDownloader for
+        `downloader_kwargs` (concurrency, per-host rate limit, retries).
+        """
         if self.dataset_name == "common-pile/arxiv_papers":
             if load_num >= self.total_length:
                 load_num = self.total_length
-            table = self.dataset
             # Directory to store PDFs
             if not self.output_dir:
                 self.output_dir = os.path.join("local_dataset", "arxiv")
-            os.makedirs(self.output_dir, exist_ok=True)
-
-            # check dir already have the datasets
-            if len(os.listdir(self.output_dir)) >= load_num:
-                print("dataset already exists")
-                return
-            pbar = tqdm(total=load_num, desc="Downloading papers")
-            for i, example in enumerate(table):
-                url = example["metadata"]["url"]
-                if "arxiv.org/abs/" in url:
-                    url = url.replace("arxiv.org/abs/", "arxiv.org/pdf/")
-                paper_id = example["id"]
-                filename = f"{paper_id}.pdf"
-                local_path = os.path.join(self.output_dir, filename)
-
-                if not os.path.exists(local_path):
-                    try:
-                        response = requests.get(url, timeout=10)
-                        if response.status_code == 200:
-                            with open(local_path, "wb") as f:
-                                f.write(response.content)
-                            load_num -= 1
-                            pbar.update(1)
-                            if load_num == 0:
-                                return
-                        else:
-                            print(f"Failed to download {url}: status {response.status_code}")
-                            continue
-                    except Exception as e:
-                        print(f"Error downloading {url}: {e}")
-                        continue
+            return PDFDownloader(self.output_dir, **downloader_kwargs).download(
+                self.iter_pdf_urls(), load_num
+            )
         else:
             raise ValueError(f"{self.dataset_name} Dataset not support.")
 
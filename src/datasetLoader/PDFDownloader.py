@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+
+class DownloadManifest:
+    """
+    Append-only JSON-lines record of finished downloads, one line per file, flushed and fsync'ed
+    as soon as the file is in place. Replaying it tells exactly which files an interrupted run
+    completed; a line cut short by a crash is ignored and its file downloaded again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, "r") as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["id"]] = entry
+        self.__lock = threading.Lock()
+        self.__fout = open(path, "a")
+
+    def is_done(self, item_id, local_path) -> bool:
+        entry = self.entries.get(item_id)
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and os.path.isfile(local_path)
+            and os.path.getsize(local_path) == entry["bytes"]
+        )
+
+    def record(self, item_id, **entry):
+        entry = {"id": item_id} | entry
+        with self.__lock:
+            self.entries[item_id] = entry
+            self.__fout.write(json.dumps(entry) + "\n")
+            self.__fout.flush()
+            os.fsync(self.__fout.fileno())
+
+    def close(self):
+        self.__fout.close()
+
+
+class HostRateLimiter:
+    """Space out requests to the same host by at least 1 / `rate` seconds, across all threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.__next_time = {}
+        self.__lock = threading.Lock()
+
+    def wait(self, host):
+        if self.interval == 0:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(now, self.__next_time.get(host, now))
+            self.__next_time[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PDFDownloader:
+    """
+    Concurrent, resumable file downloader. `max_workers` threads fetch over pooled keep-alive
+    sessions (one per thread) that retry connection errors and 429/5xx responses with exponential
+    backoff, while requests to each host are rate limited to `per_host_rate` per second.
+
+    A file is streamed to a temporary name next to its destination and renamed into place once
+    complete, then recorded in the manifest, so an interrupted run never leaves a truncated PDF
+    and a restarted one resumes exactly where it stopped. Any http(s) URL works, which makes it
+    easy to point at a local HTTP server for testing.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        max_workers=16,
+        per_host_rate=8.0,
+        timeout=10,
+        max_retries=3,
+        backoff_factor=0.5,
+        manifest_name="download_manifest.jsonl",
+    ):
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = HostRateLimiter(per_host_rate)
+        self.manifest_path = os.path.join(output_dir, manifest_name)
+        self.__sessions = threading.local()
+
+    def __get_session(self) -> requests.Session:
+        if not hasattr(self.__sessions, "session"):
+            retry = Retry(
+                total=self.max_retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+                respect_retry_after_header=True,
+            )
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.__sessions.session = session
+        return self.__sessions.session
+
+    def fetch(self, url, local_path) -> int:
+        """Download `url` to `local_path` atomically, returns the file size"""
+        self.rate_limiter.wait(urlparse(url).netloc)
+        tmp_path = f"{local_path}.part.{threading.get_ident()}"
+        try:
+            with self.__get_session().get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as fout:
+                    for block in response.iter_content(chunk_size=1 << 16):
+                        fout.write(block)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return os.path.getsize(local_path)
+
+    def download(self, items, load_num) -> dict:
+        """
+        Download files until `load_num` of them are present. `items` is an iterable of
+        (file name, url) pairs, consumed lazily and in order; failed items are skipped and the
+        next ones tried instead.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = DownloadManifest(self.manifest_path)
+        stats = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        pbar = tqdm(total=load_num, desc="Downloading papers")
+        start_time = time.monotonic_ns()
+
+        def fetch_item(filename, url):
+            local_path = os.path.join(self.output_dir, filename)
+            try:
+                nbytes = self.fetch(url, local_path)
+            except (requests.RequestException, OSError) as e:
+                print(f"Error downloading {url}: {e}")
+                return False, 0
+            manifest.record(filename, status="done", bytes=nbytes, url=url)
+            return True, nbytes
+
+        items = iter(items)
+        inflight = set()
+        try:
+            with ThreadPoolExecutor(self.max_workers, "pdf_download") as executor:
+                try:
+                    while True:
+                        # keep enough requests in flight to reach load_num if they all succeed
+                        nmissing = load_num - stats["downloaded"] - stats["skipped"]
+                        while len(inflight) < min(nmissing, 2 * self.max_workers):
+                            item = next(items, None)
+                            if item is None:
+                                break
+                            filename, url = item
+                            if manifest.is_done(filename, os.path.join(self.output_dir, filename)):
+                                stats["skipped"] += 1
+                                pbar.update(1)
+                                nmissing -= 1
+                                continue
+                            inflight.add(executor.submit(fetch_item, filename, url))
+                        if len(inflight) == 0:
+                            break
+                        done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            ok, nbytes = future.result()
+                            if ok:
+                                stats["downloaded"] += 1
+                                stats["bytes"] += nbytes
+                                pbar.update(1)
+                            else:
+                                stats["failed"] += 1
+                finally:
+                    # do not start queued downloads on the way out
+                    for future in inflight:
+                        future.cancel()
+        finally:
+            # the executor has drained by now, nothing writes to the manifest anymore
+            manifest.close()
+            pbar.close()
+
+        wall_time = (time.monotonic_ns() - start_time) / 1e9
+        print(
+            f"Downloaded {stats['downloaded']} files ({stats['bytes'] / 2**20:.1f} MiB) in "
+            f"{wall_time:.3f} s, {stats['skipped']} already present, {stats['failed']} failed"
+        )
+        return stats
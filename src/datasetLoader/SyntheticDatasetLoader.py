@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from datasetLoader.BaseDatasetLoader import BaseDatasetLoader
+
+# consonant-vowel syllables spelling the pseudo-words, a word id is written in base len(SYLLABLES)
+SYLLABLES = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+
+
+def doc_marker(doc_idx) -> str:
+    """Text stored for a pre-embedded document, queries find their neighbors back by it"""
+    return f"doc-{doc_idx}"
+
+
+class SyntheticDatasetLoader(BaseDatasetLoader):
+    """
+    Deterministic synthetic corpus of `num_docs` documents, generated on the fly so that it needs
+    no download and scales to any size. Every document belongs to one of `num_clusters` clusters.
+
+    Documents are either pseudo-text (`get_dataset_slice`, `iter_record_batches`), with
+    log-normally distributed lengths and words drawn from a Zipf distribution shifted per cluster,
+    or pre-embedded vectors (`get_vector_slice`): unit vectors scattered around the cluster center
+    with a spread of `cluster_std`. Generation works by blocks of BLOCK_SIZE documents, each with
+    its own seed, so any slice can be generated independently and always gives the same documents.
+    """
+
+    BLOCK_SIZE = 1024
+
+    def __init__(
+        self,
+        dataset_name="synthetic",
+        num_docs=1000000,
+        seed=0,
+        num_clusters=64,
+        dim=384,
+        cluster_std=0.5,
+        doc_length_mean=300,
+        doc_length_sigma=0.5,
+        vocab_size=30000,
+        pre_embedded=False,
+    ):
+        super().__init__(dataset_name=dataset_name)
+        self.total_length = num_docs
+        self.seed = seed
+        self.num_clusters = num_clusters
+        self.dim = dim
+        self.cluster_std = cluster_std
+        self.doc_length_mean = doc_length_mean
+        self.doc_length_sigma = doc_length_sigma
+        self.vocab_size = vocab_size
+        self.pre_embedded = pre_embedded
+        # the generator parameters determine the corpus
+        self.revision = (
+            f"seed={seed},docs={num_docs},clusters={num_clusters},dim={dim},std={cluster_std},"
+            f"length={doc_length_mean}/{doc_length_sigma},vocab={vocab_size}"
+        )
+
+        rng = np.random.default_rng([seed, 0])
+        centers = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+        self.centers = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+        self.words = np.array(
+            [self.__spell(word_id) for word_id in range(vocab_size)], dtype=object
+        )
+
+    @staticmethod
+    def __spell(word_id) -> str:
+        syllables = []
+        while True:
+            word_id, digit = divmod(word_id, len(SYLLABLES))
+            syllables.append(SYLLABLES[digit])
+            if word_id == 0:
+                return "".join(syllables)
+
+    def __check_range(self, length, offset) -> int:
+        if offset < 0 or offset >= self.total_length:
+            raise ValueError(
+                f"Offset {offset} out of range. Dataset has {self.total_length} samples."
+            )
+        return min(length, self.total_length - offset)
+
+    def __iter_blocks(self, length, offset):
+        """(block index, first and last row of the range inside that block) covering the range"""
+        for block_idx in range(
+            offset // self.BLOCK_SIZE, (offset + length - 1) // self.BLOCK_SIZE + 1
+        ):
+            block_start = block_idx * self.BLOCK_SIZE
+            yield (
+                block_idx,
+                max(offset - block_start, 0),
+                min(offset + length - block_start, self.BLOCK_SIZE),
+            )
+
+    def get_clusters(self, block_idx) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, 1, block_idx])
+        return rng.integers(0, self.num_clusters, self.BLOCK_SIZE)
+
+    def get_text_block(self, block_idx) -> list[str]:
+        clusters = self.get_clusters(block_idx)
+        rng = np.random.default_rng([self.seed, 2, block_idx])
+        lengths = rng.lognormal(
+            np.log(self.doc_length_mean), self.doc_length_sigma, self.BLOCK_SIZE
+        ).astype(np.int64)
+        lengths = np.maximum(lengths, 1)
+        word_ids = rng.zipf(1.3, int(lengths.sum())) - 1
+        # every cluster favors its own part of the vocabulary
+        word_ids += np.repeat(clusters * (self.vocab_size // self.num_clusters), lengths)
+        words = self.words[word_ids % self.vocab_size]
+        ends = np.cumsum(lengths)
+        return [" ".join(words[end - length : end]) for end, length in zip(ends, lengths)]
+
+    def get_vector_block(self, block_idx) -> np.ndarray:
+        clusters = self.get_clusters(block_idx)
+        rng = np.random.default_rng([self.seed, 3, block_idx])
+        noise = rng.standard_normal((self.BLOCK_SIZE, self.dim), dtype=np.float32)
+        vectors = self.centers[clusters] + noise * (self.cluster_std / np.sqrt(self.dim))
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def get_texts(self, length, offset) -> list[str]:
+        """Text of documents [offset, offset + length)"""
+        length = self.__check_range(length, offset)
+        texts = []
+        for block_idx, first, last in self.__iter_blocks(length, offset):
+            texts.extend(self.get_text_block(block_idx)[first:last])
+        return texts
+
+    # return a dataframe with column {content: text}  and {metadata: doc index}
+    def get_dataset_slice(self, length, offset):
+        start_idx = offset * length
+        length = self.__check_range(length, start_idx)
+        texts = self.get_texts(length, start_idx)
+        df = pd.DataFrame({"content": texts, "metadata": range(start_idx, start_idx + length)})
+        print(f"Generated {len(df)} documents from index {start_idx} to {start_idx + length}")
+        return df
+
+    def iter_record_batches(self, length=None, offset=0, batch_size=1024, columns=("text", "id")):
+        """Stream documents [offset, offset + length) as Arrow record batches of `batch_size` rows"""
+        length = self.__check_range(self.total_length if length is None else length, offset)
+        for batch_start in range(offset, offset + length, batch_size):
+            batch_length = min(batch_size, offset + length - batch_start)
+            record_batch = pa.RecordBatch.from_pydict(
+                {
+                    "text": self.get_texts(batch_length, batch_start),
+                    "id": [
+                        str(doc_idx) for doc_idx in range(batch_start, batch_start + batch_length)
+                    ],
+                }
+            )
+            yield record_batch.select(list(columns))
+
+    def get_vector_slice(self, length, offset):
+        """
+        Pre-embedded documents [offset, offset + length): their vectors (float32 array) and the
+        text stored with each one, see `doc_marker`.
+        """
+        length = self.__check_range(length, offset)
+        vectors = np.concatenate(
+            [
+                self.get_vector_block(block_idx)[first:last]
+                for block_idx, first, last in self.__iter_blocks(length, offset)
+            ]
+        )
+        return vectors, [doc_marker(doc_idx) for doc_idx in range(offset, offset + length)]
@@ -19,6 +19,8 @@ class TextDatasetLoader(BaseDatasetLoader):
                     )
                 raise e
             self.dataset = ds["train"]
+            # the fingerprint of a dataset loaded from the hub changes with its files
+            self.revision = f"20231101.en/{self.dataset._fingerprint}"
         else:
             raise ValueError(f"{self.dataset_name} Dataset not support.")
         self.total_length = len(self.dataset)
@@ -28,7 +30,7 @@ class TextDatasetLoader(BaseDatasetLoader):
     def get_dataset_slice(self, length, offset):
         if self.dataset_name == "wikimedia/wikipedia":
             start_idx = offset * length
-            end_idx = (offset + 1) * length
+            end_idx = min((offset + 1) * length, self.total_length)
 
             # check slice within range
             if start_idx >= self.total_length:
@@ -44,3 +46,31 @@ class TextDatasetLoader(BaseDatasetLoader):
             return df
         else:
             raise ValueError(f"{self.dataset_name} Dataset not support.")
+
+    def iter_record_batches(self, length=None, offset=0, batch_size=1024, columns=("text", "id")):
+        """
+        Stream documents [offset, offset + length) as Arrow record batches of at most `batch_size`
+        rows. Batches are zero-copy views of the memory-mapped HF cache files, so no document is
+        turned into a Python object until the consumer reads it.
+        """
+        if self.dataset_name != "wikimedia/wikipedia":
+            raise ValueError(f"{self.dataset_name} Dataset not support.")
+        if offset >= self.total_length:
+            raise ValueError(
+                f"Offset {offset} out of range. Dataset has {self.total_length} samples."
+            )
+        if length is None:
+            length = self.total_length - offset
+        length = min(length, self.total_length - offset)
+
+        print(f"Streaming {length} documents from index {offset} in batches of {batch_size}")
+        if self.dataset._indices is None:
+            # rows are stored in order in the cache files, slicing the table is zero-copy
+            table = self.dataset.data.table.select(list(columns)).slice(offset, length)
+            yield from table.to_batches(max_chunksize=batch_size)
+        else:
+            dataset = self.dataset.select_columns(list(columns)).select(
+                range(offset, offset + length)
+            )
+            for table in dataset.with_format("arrow").iter(batch_size=batch_size):
+                yield from table.to_batches()
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+import utils.colored_print as cprint
+from datasetPreprocess.ChunkStore import ChunkStore
+
+
+class ChunkCache:
+    """
+    On-disk cache of chunked dataset slices, one Arrow IPC file per entry holding the chunk text,
+    the dataset index of the document of every chunk and, for token chunking, the token ids of
+    every chunk. An entry is keyed by the dataset name and revision, the slice bounds and the
+    chunker parameters, so any change to one of them is a miss.
+
+    A hit memory-maps the file instead of loading and chunking the documents again. Files are
+    written to a temporary name and renamed into place, and once the cache grows over
+    `max_bytes` the least recently used entries are evicted.
+    """
+
+    DEFAULT_CACHE_DIR = os.path.join(
+        os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface")),
+        "ragperf_chunk_cache",
+    )
+
+    def __init__(self, cache_dir=None, max_bytes=50 * 2**30):
+        self.cache_dir = cache_dir or ChunkCache.DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(dataset_name, revision, start_idx, stop_idx, chunker_params) -> dict:
+        return {
+            "dataset": dataset_name,
+            "revision": revision,
+            "slice": [start_idx, stop_idx],
+            "chunker": chunker_params,
+        }
+
+    def __path(self, key) -> str:
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{key['dataset'].replace('/', '__')}_{digest}.arrow")
+
+    def get(self, key, as_store=False):
+        """
+        Chunks of the entry `key` if cached, otherwise None. Returns the chunks, the document of
+        every chunk (None if not recorded), and the token ids and offsets (None if not recorded).
+        With `as_store`, the chunks are a ChunkStore over the memory-mapped file, not a list.
+        """
+        path = self.__path(key)
+        if not os.path.isfile(path):
+            return None
+        # the modification time orders entries by last use
+        os.utime(path)
+        table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+        chunks = ChunkStore.from_table(table) if as_store else table.column("chunk").to_pylist()
+        doc_ids = token_ids = token_offsets = None
+        if "doc_id" in table.column_names:
+            doc_ids = table.column("doc_id").to_numpy()
+        if "token_ids" in table.column_names:
+            token_lists = table.column("token_ids").combine_chunks()
+            token_ids = token_lists.values.to_numpy()
+            token_offsets = token_lists.offsets.to_numpy()
+        cprint.iprintf(f"*** Chunk cache hit: {len(chunks)} chunks from {path}")
+        return chunks, doc_ids, token_ids, token_offsets
+
+    def put(self, key, chunks, doc_ids=None, token_ids=None, token_offsets=None):
+        if isinstance(chunks, ChunkStore):
+            columns = {"chunk": chunks.chunks}
+        else:
+            columns = {"chunk": pa.array(chunks, type=pa.large_string())}
+        if doc_ids is not None:
+            columns["doc_id"] = pa.array(np.asarray(doc_ids, dtype=np.int64))
+        if token_ids is not None:
+            columns["token_ids"] = pa.LargeListArray.from_arrays(
+                pa.array(np.asarray(token_offsets, dtype=np.int64)), pa.array(token_ids)
+            )
+        table = pa.table(columns).replace_schema_metadata({"key": json.dumps(key)})
+
+        path = self.__path(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        cprint.iprintf(f"*** Chunk cache stored {len(chunks)} chunks in {path}")
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries (but `keep`) until the cache fits `max_bytes`"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".arrow"):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                entries.append(
+                    (stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, filename))
+                )
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total_bytes -= size
+            cprint.iprintf(f"*** Chunk cache evicted {path}")
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import zlib
+
+import numpy as np
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+
+# Mersenne prime modulus of the MinHash permutations, a * x + b stays below 2^64 for 32-bit x
+MINHASH_PRIME = (1 << 31) - 1
+
+
+class ChunkDeduplicator:
+    """
+    Drop duplicate chunks before they are embedded. Exact duplicates are found by their blake2b
+    digest. With `near_duplicates`, chunks whose word `shingle_size`-grams have an estimated
+    Jaccard similarity of at least `threshold` with an earlier chunk are dropped as well: every
+    chunk gets a MinHash signature of `num_perm` permutations, split into `bands` LSH bands, and
+    only chunks sharing a band bucket are compared.
+
+    Chunks are kept in order, the first occurrence representing its duplicates. `deduplicate`
+    returns the kept indices and the map from every chunk to its representative, so that a kept
+    chunk can still be attributed to all the documents its duplicates came from (`chunk_sources`).
+    """
+
+    def __init__(
+        self,
+        near_duplicates=False,
+        threshold=0.8,
+        num_perm=128,
+        bands=32,
+        shingle_size=5,
+        seed=0,
+    ):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.perm_a = rng.integers(1, MINHASH_PRIME, num_perm, dtype=np.uint64)
+        self.perm_b = rng.integers(0, MINHASH_PRIME, num_perm, dtype=np.uint64)
+        self.stats = None
+
+    def minhash(self, chunk) -> np.ndarray:
+        words = chunk.split()
+        shingles = [
+            " ".join(words[start : start + self.shingle_size])
+            for start in range(max(len(words) - self.shingle_size + 1, 1))
+        ]
+        hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.uint64)
+        # (a * x + b) mod p of every shingle for every permutation, minimum over the shingles
+        return ((np.outer(self.perm_a, hashes) + self.perm_b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    def deduplicate(self, chunks):
+        """
+        Returns the indices of the chunks to keep (increasing) and, for every chunk, the position
+        among the kept chunks of its representative (int64 arrays).
+        """
+        chunk_map = np.empty(len(chunks), dtype=np.int64)
+        keep = []
+        digests = {}
+        buckets = {}
+        signatures = []
+        rows = self.num_perm // self.bands
+        self.stats = {"exact_duplicates": 0, "near_duplicates": 0}
+        for chunk_idx, chunk in enumerate(chunks):
+            digest = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+            if digest in digests:
+                chunk_map[chunk_idx] = digests[digest]
+                self.stats["exact_duplicates"] += 1
+                continue
+            if self.near_duplicates:
+                signature = self.minhash(chunk)
+                band_keys = [
+                    (band, signature[band * rows : (band + 1) * rows].tobytes())
+                    for band in range(self.bands)
+                ]
+                representative = self.__find_similar(signature, band_keys, buckets, signatures)
+                if representative is not None:
+                    chunk_map[chunk_idx] = representative
+                    digests[digest] = representative
+                    self.stats["near_duplicates"] += 1
+                    continue
+                # every kept chunk of a bucket is a candidate, not only its first one
+                for band_key in band_keys:
+                    buckets.setdefault(band_key, []).append(len(keep))
+                signatures.append(signature)
+            digests[digest] = len(keep)
+            chunk_map[chunk_idx] = len(keep)
+            keep.append(chunk_idx)
+
+        self.stats |= {
+            "chunks": len(chunks),
+            "kept": len(keep),
+            "reduction_ratio": 1 - len(keep) / len(chunks) if len(chunks) > 0 else 0.0,
+        }
+        return np.array(keep, dtype=np.int64), chunk_map
+
+    def __find_similar(self, signature, band_keys, buckets, signatures):
+        """Earliest kept chunk sharing a band with `signature` and similar enough, if any"""
+        candidates = set()
+        for band_key in band_keys:
+            candidates.update(buckets.get(band_key, ()))
+        for candidate in sorted(candidates):
+            if np.mean(signatures[candidate] == signature) >= self.threshold:
+                return candidate
+        return None
+
+    @staticmethod
+    def chunk_sources(chunk_map, doc_ids, num_kept) -> list[list[int]]:
+        """Documents (from `doc_ids`, one per chunk) every kept chunk stands for"""
+        sources = [set() for _ in range(num_kept)]
+        for kept_idx, doc_id in zip(chunk_map.tolist(), doc_ids.tolist()):
+            sources[kept_idx].add(doc_id)
+        return [sorted(doc_set) for doc_set in sources]
+
+    def report(self, chunk_map=None, doc_ids=None):
+        """Print and log the reduction, save the chunk map (and source documents) if given"""
+        cprint.iprintf(
+            f"*** Chunk dedup: {self.stats['chunks']} chunks, {self.stats['kept']} kept, "
+            f"{self.stats['exact_duplicates']} exact and {self.stats['near_duplicates']} near "
+            f"duplicates dropped, reduction: {self.stats['reduction_ratio'] * 100:.2f}%"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "chunk_dedup_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.near_duplicates}\t"
+                f"{self.threshold}\t"
+                f"{self.stats['chunks']}\t"
+                f"{self.stats['kept']}\t"
+                f"{self.stats['exact_duplicates']}\t"
+                f"{self.stats['near_duplicates']}\t"
+                f"{self.stats['reduction_ratio']:.6f}\n"
+            )
+        if chunk_map is not None:
+            arrays = {"chunk_map": chunk_map}
+            if doc_ids is not None:
+                arrays["doc_ids"] = doc_ids
+            np.savez(os.path.join(Logger().log_dirpath, "chunk_dedup_map.npz"), **arrays)
@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+
+def chunk_positions(doc_ids) -> np.ndarray:
+    """Position of every chunk within its document, for chunks grouped by document"""
+    doc_ids = np.asarray(doc_ids)
+    if len(doc_ids) == 0:
+        return np.empty(0, dtype=np.int32)
+    starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    lengths = np.diff(np.r_[starts, len(doc_ids)])
+    return (np.arange(len(doc_ids)) - np.repeat(starts, lengths)).astype(np.int32)
+
+
+def _to_array(column) -> pa.Array:
+    # a single chunk is used as is, combining would copy it
+    if isinstance(column, pa.ChunkedArray):
+        return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    return column
+
+
+class ChunkStore:
+    """
+    Columnar chunk storage: the chunk texts as one Arrow large_string array (a contiguous UTF-8
+    buffer plus int64 offsets), and optionally the document of every chunk and its position in
+    that document as numpy arrays. A chunk costs its UTF-8 bytes plus 8 bytes of offset, rather
+    than a Python str object each.
+
+    A store behaves like the list of chunks it replaces: `len`, indexing (a str), iteration (str,
+    materialized a block at a time) and slicing, which returns a zero-copy ChunkStore view, so it
+    can be handed as `chunks` to the vector DB clients and to the encoders. `save` writes an
+    Arrow IPC file which `open` memory-maps back without reading it.
+    """
+
+    # chunks turned into Python strings at a time while iterating
+    ITER_BLOCK_SIZE = 8192
+
+    def __init__(self, chunks, doc_ids=None, positions=None):
+        chunks = _to_array(chunks)
+        if chunks.type != pa.large_string():
+            chunks = chunks.cast(pa.large_string())
+        self.chunks = chunks
+        self.doc_ids = doc_ids
+        if positions is None and doc_ids is not None:
+            positions = chunk_positions(doc_ids)
+        self.positions = positions
+
+    @classmethod
+    def from_texts(cls, texts, doc_ids=None) -> "ChunkStore":
+        """Store of `texts` (list of str or Arrow string array)"""
+        if not isinstance(texts, (pa.Array, pa.ChunkedArray)):
+            texts = pa.array(texts, type=pa.large_string())
+        if doc_ids is not None:
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        return cls(texts, doc_ids)
+
+    @classmethod
+    def concat(cls, stores) -> "ChunkStore":
+        """One store of `stores` (e.g. built batch by batch), doc ids kept only if all have them"""
+        stores = list(stores)
+        if len(stores) == 0:
+            return cls.from_texts([])
+        chunks = pa.concat_arrays([store.chunks for store in stores])
+        if any(store.doc_ids is None for store in stores):
+            return cls(chunks)
+        return cls(
+            chunks,
+            np.concatenate([store.doc_ids for store in stores]),
+            np.concatenate([store.positions for store in stores]),
+        )
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            length = max(stop - start, 0)
+            return ChunkStore(
+                self.chunks.slice(start, length),
+                None if self.doc_ids is None else self.doc_ids[start : start + length],
+                None if self.positions is None else self.positions[start : start + length],
+            )
+        return self.chunks[key].as_py()
+
+    def __iter__(self):
+        for start in range(0, len(self), ChunkStore.ITER_BLOCK_SIZE):
+            yield from self.chunks.slice(start, ChunkStore.ITER_BLOCK_SIZE).to_pylist()
+
+    def take(self, indices) -> "ChunkStore":
+        """Store of the chunks at `indices` only (e.g. after deduplication)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return ChunkStore(
+            self.chunks.take(pa.array(indices)),
+            None if self.doc_ids is None else self.doc_ids[indices],
+            None if self.positions is None else self.positions[indices],
+        )
+
+    def to_pylist(self) -> list[str]:
+        return self.chunks.to_pylist()
+
+    @property
+    def nbytes(self) -> int:
+        nbytes = self.chunks.nbytes
+        for column in [self.doc_ids, self.positions]:
+            if column is not None:
+                nbytes += column.nbytes
+        return nbytes
+
+    def save(self, path):
+        """Write the store to `path` as an Arrow IPC file (temp file + rename)"""
+        columns = {"chunk": self.chunks}
+        if self.doc_ids is not None:
+            columns["doc_id"] = pa.array(self.doc_ids)
+            columns["position"] = pa.array(self.positions)
+        table = pa.table(columns)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path) -> "ChunkStore":
+        """Memory-map a store written by `save`, pages are read on access"""
+        return cls.from_table(ipc.open_file(pa.memory_map(path, "r")).read_all())
+
+    @classmethod
+    def from_table(cls, table) -> "ChunkStore":
+        """Store of the `chunk` (and `doc_id`, `position`) columns of an Arrow table, zero-copy"""
+        doc_ids = positions = None
+        if "doc_id" in table.column_names:
+            doc_ids = _to_array(table.column("doc_id")).to_numpy()
+        if "position" in table.column_names:
+            positions = _to_array(table.column("position")).to_numpy()
+        return cls(table.column("chunk"), doc_ids, positions)
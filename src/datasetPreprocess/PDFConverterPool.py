@@ -0,0 +1,192 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+# converters of the worker process, built once by the pool initializer
+_worker_state = {}
+
+
+def make_docling_converter(do_ocr=True, do_table_structure=True, num_threads=8):
+    import torch
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
+    from docling.datamodel.base_models import InputFormat
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.accelerator_options = AcceleratorOptions(
+        num_threads=num_threads,
+        device=AcceleratorDevice.CUDA if torch.cuda.is_available() else AcceleratorDevice.CPU,
+    )
+    pipeline_options.do_ocr = do_ocr
+    pipeline_options.do_table_structure = do_table_structure
+    pipeline_options.table_structure_options.do_cell_matching = True
+    return DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+    )
+
+
+def probe_text_layer(path, min_chars_per_page) -> tuple[int, int]:
+    """Page count of the PDF at `path` and how many of its pages have no usable text layer"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(path)
+    try:
+        scanned_pages = 0
+        for page_idx in range(len(pdf)):
+            page = pdf[page_idx]
+            textpage = page.get_textpage()
+            if len(textpage.get_text_range().strip()) < min_chars_per_page:
+                scanned_pages += 1
+            textpage.close()
+            page.close()
+        return len(pdf), scanned_pages
+    finally:
+        pdf.close()
+
+
+def _init_convert_worker(fast_path, do_table_structure, num_threads):
+    _worker_state["fast_path"] = fast_path
+    _worker_state["converters"] = {}
+    _worker_state["converter_kwargs"] = {
+        "do_table_structure": do_table_structure,
+        "num_threads": num_threads,
+    }
+
+
+def _get_converter(do_ocr):
+    # built on first use, a worker only seeing born-digital PDFs never loads the OCR models
+    converters = _worker_state["converters"]
+    if do_ocr not in converters:
+        converters[do_ocr] = make_docling_converter(
+            do_ocr=do_ocr, **_worker_state["converter_kwargs"]
+        )
+    return converters[do_ocr]
+
+
+def _convert_pdf(path, min_chars_per_page):
+    start_ns = time.monotonic_ns()
+    stats = {"path": path, "pages": 0, "scanned_pages": 0, "pid": os.getpid()}
+    doc = None
+    stats["mode"] = "failed"
+    try:
+        do_ocr = True
+        if _worker_state["fast_path"]:
+            stats["pages"], stats["scanned_pages"] = probe_text_layer(path, min_chars_per_page)
+            do_ocr = stats["scanned_pages"] > 0
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+    else:
+        # outside of the try, a converter that cannot be built fails the whole run
+        converter = _get_converter(do_ocr)
+        try:
+            doc = converter.convert(path).document
+            stats["mode"] = "ocr" if do_ocr else "text_layer"
+        except Exception as e:
+            print(f"Error converting {path}: {e}")
+    stats["convert_ns"] = time.monotonic_ns() - start_ns
+    return doc, stats
+
+
+class PDFConverterPool:
+    """
+    docling PDF conversion spread over `num_workers` processes, each with its own converters
+    (`num_threads` threads each, by default the cores split evenly between the workers).
+
+    With `fast_path`, every PDF is first probed with pypdfium2: if each page has an embedded text
+    layer of at least `min_chars_per_page` characters, it is converted from that text layer with
+    OCR disabled. A PDF with scanned or image-only pages goes through the OCR converter, where
+    docling only OCRs the bitmap areas, i.e. those pages. Without `fast_path`, every PDF is OCR'ed
+    as by the serial converter.
+
+    `convert` reports the conversion time of every document, which path it took, and the share of
+    documents and pages that needed OCR.
+    """
+
+    def __init__(
+        self,
+        num_workers=4,
+        fast_path=True,
+        min_chars_per_page=32,
+        do_table_structure=True,
+        num_threads=None,
+    ):
+        self.num_workers = num_workers
+        self.fast_path = fast_path
+        self.min_chars_per_page = min_chars_per_page
+        self.do_table_structure = do_table_structure
+        self.num_threads = num_threads or max(1, multiprocessing.cpu_count() // num_workers)
+
+    def convert(self, paths) -> list:
+        """Convert the PDFs at `paths`, returns their documents in order (failed ones skipped)"""
+        # spawn, CUDA cannot be used in forked processes
+        with ProcessPoolExecutor(
+            self.num_workers,
+            multiprocessing.get_context("spawn"),
+            initializer=_init_convert_worker,
+            initargs=(self.fast_path, self.do_table_structure, self.num_threads),
+        ) as pool:
+            start_time = time.monotonic_ns()
+            futures = [pool.submit(_convert_pdf, path, self.min_chars_per_page) for path in paths]
+            results = [future.result() for future in tqdm(futures, desc="convert pdf data")]
+            wall_time = time.monotonic_ns() - start_time
+        self.report([stats for _, stats in results], wall_time)
+        return [doc for doc, _ in results if doc is not None]
+
+    def report(self, doc_stats, wall_time):
+        output_path = os.path.join(Logger().log_dirpath, "pdf_convert_docs.txt")
+        with open(output_path, "w") as fout:
+            for stats in doc_stats:
+                fout.write(
+                    f"{stats['path']}\t"
+                    f"{stats['mode']}\t"
+                    f"{stats['pages']}\t"
+                    f"{stats['scanned_pages']}\t"
+                    f"{stats['pid']}\t"
+                    f"{stats['convert_ns']}\n"
+                )
+
+        ndocs = len(doc_stats)
+        nfailed = sum(stats["mode"] == "failed" for stats in doc_stats)
+        ocr_docs = sum(stats["mode"] == "ocr" for stats in doc_stats)
+        npages = sum(stats["pages"] for stats in doc_stats)
+        scanned_pages = sum(stats["scanned_pages"] for stats in doc_stats)
+        ocr_rate = ocr_docs / ndocs if ndocs > 0 else 0.0
+        scanned_rate = scanned_pages / npages if npages > 0 else 0.0
+        latency = summarize_latency([stats["convert_ns"] for stats in doc_stats])
+        print(
+            f"Converted {ndocs - nfailed}/{ndocs} PDFs with {self.num_workers} workers in "
+            f"{wall_time / 1e9:.3f} s ({ndocs / wall_time * 1e9:.3f} docs/s), "
+            f"OCR: {ocr_docs} docs ({ocr_rate * 100:.2f}%)"
+            + (
+                f", {scanned_pages}/{npages} pages without text layer "
+                f"({scanned_rate * 100:.2f}%)"
+                if self.fast_path
+                else ""
+            )
+            + f"\n  per document: {format_latency_summary(latency, unit_scale=1e9, unit='s')}"
+        )
+        if nfailed > 0:
+            cprint.wprintf(f"*** {nfailed} PDFs failed to convert and were skipped")
+        output_path = os.path.join(Logger().log_dirpath, "pdf_convert_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.num_workers}\t"
+                f"{self.fast_path}\t"
+                f"{ndocs}\t"
+                f"{nfailed}\t"
+                f"{ocr_docs}\t"
+                f"{npages}\t"
+                f"{scanned_pages}\t"
+                f"{wall_time}\t"
+                f"{latency['p50']:.0f}\t"
+                f"{latency['p95']:.0f}\t"
+                f"{latency['p99']:.0f}\n"
+            )
@@ -1,46 +1,38 @@
 from datasetPreprocess.BaseDatasetPreprocess import BaseDatasetPreprocess
-import torch
+from datasetPreprocess.PDFConverterPool import PDFConverterPool, make_docling_converter
+from datasetPreprocess.PageRenderer import PageRenderer
 from docling_core.transforms.chunker import HierarchicalChunker
-from docling.document_converter import DocumentConverter, PdfFormatOption
 from tqdm import tqdm
-from docling.datamodel.pipeline_options import (
-    PdfPipelineOptions,
-)
-from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
-from docling.datamodel.base_models import InputFormat
+from docling.datamodel.base_models import ConversionStatus
 import os
 from pdf2image import convert_from_path
 
 
 class PDFDatasetPreprocess(BaseDatasetPreprocess):
-    def __init__(self):
+    # with num_workers > 1 or fast_path, PDFs are converted by a PDFConverterPool
+    def __init__(self, num_workers=1, fast_path=False, **converter_pool_kwargs):
         super().__init__()
+        self.num_workers = num_workers
+        self.fast_path = fast_path
+        self.converter_pool_kwargs = converter_pool_kwargs
 
     def convert_PDF_to_text(self, df):
-        # using docling as document converting and chunking
-        # Check if GPU or MPS is available
-
-        accelerator_options = AcceleratorOptions(
-            num_threads=8,
-            device=AcceleratorDevice.CUDA if torch.cuda.is_available() else AcceleratorDevice.CPU,
-        )
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.accelerator_options = accelerator_options
-        pipeline_options.do_ocr = True
-        pipeline_options.do_table_structure = True
-        pipeline_options.table_structure_options.do_cell_matching = True
-
-        converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(
-                    pipeline_options=pipeline_options,
-                )
-            }
-        )
+        if self.num_workers > 1 or self.fast_path:
+            return PDFConverterPool(
+                num_workers=self.num_workers,
+                fast_path=self.fast_path,
+                **self.converter_pool_kwargs,
+            ).convert(list(df["content"]))
+        # using docling as document converting and chunking, set up as in the converter pool
+        converter = make_docling_converter()
         docs = []
         for path in tqdm(df["content"], desc="convert pdf data"):
-            # Convert the input file to Docling Document
-            doc = converter.convert(path).document
+            # Convert the input file to Docling Document, a PDF that fails is skipped as by the pool
+            try:
+                doc = converter.convert(path).document
+            except Exception as e:
+                print(f"Error converting {path}: {e}")
+                continue
             docs.append(doc)
         return docs
 
@@ -58,24 +50,7 @@ class PDFDatasetPreprocess(BaseDatasetPreprocess):
         return chunked_texts
 
     def batch_chunking_PDF_to_text(self, df, batch_size=8):
-        # Check if GPU or MPS is available
-        accelerator_options = AcceleratorOptions(
-            num_threads=8,
-            device=AcceleratorDevice.CUDA if torch.cuda.is_available() else AcceleratorDevice.CPU,
-        )
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.accelerator_options = accelerator_options
-        pipeline_options.do_ocr = True
-        pipeline_options.do_table_structure = True
-        pipeline_options.table_structure_options.do_cell_matching = True
-
-        converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(
-                    pipeline_options=pipeline_options,
-                )
-            }
-        )
+        converter = make_docling_converter()
         # converter = DocumentConverter()
         chunker = HierarchicalChunker()
         chunked_texts = []
@@ -83,10 +58,13 @@ class PDFDatasetPreprocess(BaseDatasetPreprocess):
         for path in df["content"]:
             input_doc_paths.append(path)
 
-        # Convert the input file to Docling Document
-        docs = converter.convert_all(input_doc_paths)
+        # Convert the input file to Docling Document, a PDF that fails is skipped as by the pool
+        docs = converter.convert_all(input_doc_paths, raises_on_error=False)
         # Perform hierarchical chunking
         for doc in tqdm(docs, desc="chunking pdf data"):
+            if doc.status == ConversionStatus.FAILURE:
+                print(f"Error converting {doc.input.file}: {doc.errors}")
+                continue
             texts = [chunk.text for chunk in chunker.chunk(doc.document)]
             chunked_texts.extend(texts)
 
@@ -112,5 +90,10 @@ class PDFDatasetPreprocess(BaseDatasetPreprocess):
 
         return saved_pages
 
+    def stream_PDF_to_image(self, df, **renderer_kwargs):
+        # pages rendered in the background and streamed in memory, see PageRenderer
+        paths = [path for path in df["content"] if path.lower().endswith(".pdf")]
+        return PageRenderer(**renderer_kwargs).render(paths)
+
     def chunking_text_to_text(self):
         return
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+# reference to a page that was not persisted, rendered again from the PDF when displayed:
+# <pdf>#page=<n>&dpi=<dpi>, at the resolution it was embedded at
+PAGE_REF_SEPARATOR = "#page="
+PAGE_REF_DPI_SEPARATOR = "&dpi="
+
+
+def render_page(path, page_idx, dpi):
+    """PIL image of page `page_idx` (0-based) of the PDF at `path`, rasterized at `dpi`"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[page_idx]
+        image = page.render(scale=dpi / 72).to_pil()
+        page.close()
+        return image
+    finally:
+        pdf.close()
+
+
+def page_ref(path, page_idx, dpi):
+    """Reference to page `page_idx` (0-based) of the PDF at `path` rendered at `dpi`"""
+    return f"{path}{PAGE_REF_SEPARATOR}{page_idx + 1}{PAGE_REF_DPI_SEPARATOR}{dpi}"
+
+
+def open_page(filepath, dpi=200):
+    """
+    Image of a page stored by `PageRenderer`, either a persisted file or a `<pdf>#page=<n>`
+    reference, rendered at the dpi it records (`dpi` for references without one)
+    """
+    if PAGE_REF_SEPARATOR in filepath:
+        path, page = filepath.rsplit(PAGE_REF_SEPARATOR, 1)
+        if PAGE_REF_DPI_SEPARATOR in page:
+            page, dpi = page.split(PAGE_REF_DPI_SEPARATOR, 1)
+        return render_page(path, int(page) - 1, float(dpi))
+    from PIL import Image
+
+    return Image.open(filepath)
+
+
+def _render_pdf(path, dpi, persist_dir, jpeg_quality):
+    """Pages of the PDF at `path` as (filepath, image) pairs, and the render time in ns"""
+    import pypdfium2 as pdfium
+
+    start_ns = time.monotonic_ns()
+    pdf_base = os.path.splitext(os.path.basename(path))[0]
+    pages = []
+    pdf = pdfium.PdfDocument(path)
+    try:
+        for page_idx in range(len(pdf)):
+            page = pdf[page_idx]
+            image = page.render(scale=dpi / 72).to_pil()
+            page.close()
+            if persist_dir is not None:
+                pages_dir = persist_dir or os.path.join(os.path.dirname(path), "pages")
+                os.makedirs(pages_dir, exist_ok=True)
+                filepath = os.path.join(pages_dir, f"{pdf_base}_page_{page_idx + 1}.jpg")
+                image.save(filepath, "JPEG", quality=jpeg_quality)
+            else:
+                filepath = page_ref(path, page_idx, dpi)
+            pages.append((filepath, image))
+    finally:
+        pdf.close()
+    return pages, time.monotonic_ns() - start_ns
+
+
+class PageRenderer:
+    """
+    Rasterize PDF pages at `dpi` in a background pool of `num_workers` processes and hand them
+    over in memory, in document and page order, as (filepath, PIL image) pairs, e.g. to
+    ColPaliEncoder.embedding_from_images. Up to `max_inflight` PDFs (default: two per worker) are
+    rendered ahead of the consumer, so that rendering overlaps with encoding.
+
+    Pages are only written to disk with `persist`, as JPEG (`jpeg_quality`) under `persist_dir`
+    (default: `pages/` next to each PDF), for display of the retrieved pages. Otherwise the
+    filepath of a page is a `<pdf>#page=<n>&dpi=<dpi>` reference, rendered again at the same dpi
+    by `open_page` when needed, so retrieving such pages also pays their render time.
+    """
+
+    def __init__(
+        self,
+        dpi=200,
+        num_workers=4,
+        max_inflight=None,
+        persist=False,
+        persist_dir=None,
+        jpeg_quality=85,
+    ):
+        self.dpi = dpi
+        self.num_workers = num_workers
+        self.max_inflight = max_inflight or 2 * num_workers
+        # "" is the default directory next to each PDF, None is no persistence
+        self.persist_dir = (persist_dir or "") if persist else None
+        self.jpeg_quality = jpeg_quality
+        if not persist:
+            cprint.wprintf(
+                "*** Rendered pages are not persisted, retrieved pages are rendered again from "
+                "their PDF, which adds to the retrieve latency"
+            )
+
+    def render(self, paths):
+        """
+        Start rendering the PDFs at `paths` and return an iterator over their pages. The first
+        PDFs are submitted right away, so they render while e.g. the encoder is loaded.
+        """
+        paths = list(paths)
+        # spawn, the parent may hold CUDA state which must not be forked
+        pool = ProcessPoolExecutor(self.num_workers, multiprocessing.get_context("spawn"))
+        start_ns = time.monotonic_ns()
+        inflight = [self.__submit(pool, path) for path in paths[: self.max_inflight]]
+        return self.__iter_pages(pool, paths, inflight, start_ns)
+
+    def __submit(self, pool, path):
+        return pool.submit(_render_pdf, path, self.dpi, self.persist_dir, self.jpeg_quality)
+
+    def __iter_pages(self, pool, paths, inflight, start_ns):
+        render_times = []
+        npages = 0
+        try:
+            for next_idx in range(len(inflight), len(paths) + len(inflight)):
+                pages, render_ns = inflight.pop(0).result()
+                if next_idx < len(paths):
+                    inflight.append(self.__submit(pool, paths[next_idx]))
+                render_times.append(render_ns)
+                npages += len(pages)
+                yield from pages
+        finally:
+            pool.shutdown(cancel_futures=True)
+        self.report(render_times, npages, time.monotonic_ns() - start_ns)
+
+    def report(self, render_times, npages, wall_time):
+        latency = summarize_latency(render_times)
+        print(
+            f"Rendered {npages} pages of {len(render_times)} PDFs at {self.dpi} dpi with "
+            f"{self.num_workers} workers in {wall_time / 1e9:.3f} s "
+            f"({npages / wall_time * 1e9:.3f} pages/s)"
+            f"\n  per document: {format_latency_summary(latency, unit_scale=1e9, unit='s')}"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "page_render_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.dpi}\t"
+                f"{self.num_workers}\t"
+                f"{self.persist_dir is not None}\t"
+                f"{len(render_times)}\t"
+                f"{npages}\t"
+                f"{wall_time}\t"
+                f"{latency['p50']:.0f}\t"
+                f"{latency['p95']:.0f}\t"
+                f"{latency['p99']:.0f}\n"
+            )
@@ -0,0 +1,127 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+
+# splitter of the worker process, built once by the pool initializer
+_worker_state = {}
+
+
+def _init_chunk_worker(chunk_size, chunk_overlap):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    _worker_state["splitter"] = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+def _chunk_block(texts):
+    """Chunks of a block of documents (an Arrow string array) and the chunk count of each one"""
+    splitter = _worker_state["splitter"]
+    chunks = []
+    counts = np.empty(len(texts), dtype=np.int64)
+    for doc_idx, text in enumerate(texts.to_pylist()):
+        doc_chunks = splitter.split_text(text)
+        counts[doc_idx] = len(doc_chunks)
+        chunks.extend(doc_chunks)
+    # sent back as one contiguous Arrow buffer rather than one pickled string per chunk
+    return pa.array(chunks, type=pa.large_string()), counts
+
+
+def _to_arrow(texts) -> pa.Array:
+    """Contiguous Arrow string array of `texts` (pandas Series, list or Arrow array)"""
+    if isinstance(texts, pa.ChunkedArray):
+        texts = texts.combine_chunks()
+    if isinstance(texts, pa.Array):
+        return texts
+    return pa.array(list(texts), type=pa.large_string())
+
+
+class ParallelChunker:
+    """
+    RecursiveCharacterTextSplitter chunking spread over `num_workers` processes. Documents are
+    handed out in contiguous blocks of `block_size` documents (by default, enough for about four
+    blocks per worker) as Arrow string arrays, and every block comes back as one Arrow array of
+    chunks plus the chunk count of each document, so that neither direction pickles individual
+    strings. Blocks are put back in order: the chunks are exactly those of the serial splitter.
+
+    The pool is started on first use and kept until `close`, so that a chunker can be reused
+    across calls (e.g. every streamed record batch) without paying the process startup again.
+    """
+
+    def __init__(self, chunk_size=512, chunk_overlap=0, num_workers=None, block_size=None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.block_size = block_size
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn, the parent may hold CUDA state which must not be forked
+            self.pool = ProcessPoolExecutor(
+                self.num_workers,
+                multiprocessing.get_context("spawn"),
+                initializer=_init_chunk_worker,
+                initargs=(self.chunk_size, self.chunk_overlap),
+            )
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __submit_blocks(self, texts, block_size) -> list:
+        pool = self.__get_pool()
+        # a pickled slice carries its whole parent buffer, hand out compacted copies instead
+        return [
+            pool.submit(_chunk_block, pa.concat_arrays([texts.slice(start, block_size)]))
+            for start in range(0, len(texts), block_size)
+        ]
+
+    @staticmethod
+    def __gather_chunks(futures) -> pa.Array:
+        if len(futures) == 0:
+            return pa.array([], type=pa.large_string())
+        return pa.concat_arrays([future.result()[0] for future in futures])
+
+    def chunk_texts(self, texts, return_doc_ids=False):
+        """
+        Chunk `texts` (pandas Series, list or Arrow string array). Returns the chunks as one Arrow
+        large_string array in document order, and with `return_doc_ids`, the index in `texts` of
+        the document of every chunk (int64 array).
+        """
+        texts = _to_arrow(texts)
+        block_size = self.block_size or max(1, -(-len(texts) // (4 * self.num_workers)))
+        futures = self.__submit_blocks(texts, block_size)
+        chunks = self.__gather_chunks(futures)
+        if not return_doc_ids:
+            return chunks
+        counts = [future.result()[1] for future in futures]
+        counts = np.concatenate(counts) if len(counts) > 0 else np.empty(0, dtype=np.int64)
+        return chunks, np.repeat(np.arange(len(texts), dtype=np.int64), counts)
+
+    def iter_chunk_record_batches(self, record_batches, text_column="text", max_inflight=None):
+        """
+        Chunk a stream of Arrow record batches, yield the chunks of every batch (Arrow array) in
+        order. Up to `max_inflight` batches (default: one per worker) are chunked concurrently,
+        each one as a single block unless `block_size` is set, so that reading the next batches
+        overlaps with chunking.
+        """
+        max_inflight = max_inflight or self.num_workers
+        inflight = []
+        for record_batch in record_batches:
+            texts = _to_arrow(record_batch.column(text_column))
+            inflight.append(self.__submit_blocks(texts, self.block_size or max(1, len(texts))))
+            if len(inflight) >= max_inflight:
+                yield self.__gather_chunks(inflight.pop(0))
+        for futures in inflight:
+            yield self.__gather_chunks(futures)
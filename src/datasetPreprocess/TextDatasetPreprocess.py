@@ -1,26 +1,139 @@
+import numpy as np
+
 from datasetPreprocess.BaseDatasetPreprocess import BaseDatasetPreprocess
+from datasetPreprocess.ChunkStore import ChunkStore
+from datasetPreprocess.ParallelChunker import ParallelChunker
+from datasetPreprocess.TokenChunker import TokenChunker
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+CHUNK_TYPES = ["length", "token"]
+
 
 class TextDatasetPreprocess(BaseDatasetPreprocess):
-    def __init__(self, chunk_size=512, chunk_overlap=0.1):
+    # chunktype "length" counts chunk_size/chunk_overlap in characters, with num_workers > 1 the
+    # documents are chunked by a ParallelChunker process pool; chunktype "token" counts them in
+    # tokens of `tokenizer_name` (the embedding model), within its `max_seq_length`, see TokenChunker
+    def __init__(
+        self,
+        chunk_size=512,
+        chunk_overlap=0.1,
+        num_workers=1,
+        block_size=None,
+        chunktype="length",
+        tokenizer_name=None,
+        max_seq_length=None,
+    ):
         super().__init__()
+        if chunktype not in CHUNK_TYPES:
+            raise ValueError(f"Unsupported chunk type: {chunktype}. Must be one of {CHUNK_TYPES}.")
+        if chunktype == "token" and tokenizer_name is None:
+            raise ValueError("Token chunking needs the tokenizer of the embedding model")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.num_workers = num_workers
+        self.block_size = block_size
+        self.chunktype = chunktype
+        self.tokenizer_name = tokenizer_name
+        self.max_seq_length = max_seq_length
+        self.token_chunker = None
+
+    def __get_token_chunker(self) -> TokenChunker:
+        if self.token_chunker is None:
+            self.token_chunker = TokenChunker(
+                self.tokenizer_name,
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                max_seq_length=self.max_seq_length,
+            )
+        return self.token_chunker
+
+    def chunking_text_to_tokens(self, df):
+        """
+        Token chunking (chunktype "token") of the documents of `df`. Returns the chunks, their
+        token ids (flat int32 array) and offsets, and the row of `df` every chunk comes from.
+        """
+        result = self.__get_token_chunker().chunk_texts(df["content"])
+        print(f"Total chunks to process: {len(result[0])}.")
+        return result
+
+    def __make_parallel_chunker(self) -> ParallelChunker:
+        return ParallelChunker(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            num_workers=self.num_workers,
+            block_size=self.block_size,
+        )
+
+    def chunking_text_to_arrow(self, df, return_doc_ids=False):
+        """
+        Chunks of the documents of `df` as one Arrow large_string array, in document order. With
+        `return_doc_ids`, also returns the row of `df` every chunk comes from (int64 array).
+        """
+        with self.__make_parallel_chunker() as chunker:
+            result = chunker.chunk_texts(df["content"], return_doc_ids=return_doc_ids)
+        chunks = result[0] if return_doc_ids else result
+        print(f"Total chunks to process: {len(chunks)}.")
+        return result
+
+    def chunking_text_to_store(self, df) -> ChunkStore:
+        """Chunks of the documents of `df` as a ChunkStore, with the row of `df` of every chunk"""
+        if self.chunktype == "length" and self.num_workers > 1:
+            # the pool already returns one Arrow array, no chunk becomes a Python str
+            return ChunkStore.from_texts(*self.chunking_text_to_arrow(df, return_doc_ids=True))
+        return ChunkStore.from_texts(*self.chunking_text_to_text(df, return_doc_ids=True))
 
     # TODO add more chunking stratgy
-    def chunking_text_to_text(self, df):
+    def chunking_text_to_text(self, df, return_doc_ids=False):
+        if self.chunktype == "token":
+            chunked_texts, _, _, doc_ids = self.chunking_text_to_tokens(df)
+            return (chunked_texts, doc_ids) if return_doc_ids else chunked_texts
+        if self.num_workers > 1:
+            result = self.chunking_text_to_arrow(df, return_doc_ids=return_doc_ids)
+            if return_doc_ids:
+                return result[0].to_pylist(), result[1]
+            return result.to_pylist()
         chunked_texts = []
+        doc_chunk_counts = []
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
         )
         for text in df["content"]:
             chunks = text_splitter.split_text(text)
             chunked_texts.extend(chunks)
+            doc_chunk_counts.append(len(chunks))
         total_chunks_num = len(chunked_texts)
         print(f"Total chunks to process: {total_chunks_num}.")
+        if return_doc_ids:
+            doc_ids = np.repeat(np.arange(len(doc_chunk_counts), dtype=np.int64), doc_chunk_counts)
+            return chunked_texts, doc_ids
         return chunked_texts
 
+    def iter_chunking_record_batches(self, record_batches, text_column="text"):
+        """
+        Chunk a stream of Arrow record batches (e.g. TextDatasetLoader.iter_record_batches), yield
+        the chunks of every batch as soon as it is split. Only the documents of the current batch
+        are ever materialized as Python strings.
+        """
+        if self.chunktype == "token":
+            for record_batch in record_batches:
+                texts = record_batch.column(text_column).to_pylist()
+                yield self.__get_token_chunker().chunk_texts(texts)[0]
+            return
+        if self.num_workers > 1:
+            # batches are chunked concurrently by the pool while the next ones are read
+            with self.__make_parallel_chunker() as chunker:
+                for chunks in chunker.iter_chunk_record_batches(record_batches, text_column):
+                    yield chunks.to_pylist()
+            return
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+        )
+        for record_batch in record_batches:
+            chunked_texts = []
+            for text in record_batch.column(text_column):
+                chunked_texts.extend(text_splitter.split_text(text.as_py()))
+            yield chunked_texts
+
     def chunking_PDF_to_image(self):
         return
 
@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+
+
+def encoder_max_seq_length(model_name):
+    """
+    Max sequence length of the sentence-transformers model `model_name` (from its
+    sentence_bert_config.json, without loading it), None if the model does not set one
+    """
+    from transformers.utils import cached_file
+
+    # SentenceTransformer resolves bare model names in the sentence-transformers organization
+    for repo_id in [model_name, f"sentence-transformers/{model_name}"]:
+        try:
+            config_path = cached_file(
+                repo_id,
+                "sentence_bert_config.json",
+                _raise_exceptions_for_missing_entries=False,
+            )
+        except Exception:
+            continue
+        if config_path is not None:
+            with open(config_path, "r") as fin:
+                return json.load(fin).get("max_seq_length")
+    return None
+
+
+class TokenChunker:
+    """
+    Chunking at exact token budgets of an embedding model. Documents are tokenized `batch_size`
+    at a time by the model's fast (Rust) tokenizer, which gives the character span of every
+    token, and cut into windows of `chunk_size` tokens overlapping by `chunk_overlap` tokens. The
+    text of a chunk is the span of its tokens in the document.
+
+    `chunk_size` excludes the special tokens the encoder adds ([CLS], [SEP], ...), and with
+    those must fit in the encoder's `max_seq_length` (default: read from the model, see
+    encoder_max_seq_length, else the tokenizer's limit), so that no chunk is ever truncated by
+    the encoder. The token ids of every chunk, special tokens included, are kept so that the
+    encoder can embed them without tokenizing again (see
+    SentenceTransformerEncoder.embedding_from_token_ids).
+    """
+
+    def __init__(
+        self,
+        tokenizer_name,
+        chunk_size=256,
+        chunk_overlap=0,
+        max_seq_length=None,
+        batch_size=1024,
+    ):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+        if not self.tokenizer.is_fast:
+            raise ValueError(f"Token chunking needs a fast tokenizer, {tokenizer_name} has none")
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(
+                f"Invalid token chunk size {chunk_size} and overlap {chunk_overlap}, the overlap "
+                f"must be non-negative and smaller than the chunk size"
+            )
+        # the encoder may truncate below the tokenizer's own limit (e.g. 256 vs 512 tokens)
+        max_seq_length = (
+            max_seq_length
+            or encoder_max_seq_length(tokenizer_name)
+            or self.tokenizer.model_max_length
+        )
+        num_special_tokens = self.tokenizer.num_special_tokens_to_add()
+        if chunk_size + num_special_tokens > max_seq_length:
+            raise ValueError(
+                f"Token chunk size {chunk_size} (plus {num_special_tokens} special tokens) "
+                f"exceeds the max sequence length {max_seq_length} of {tokenizer_name}"
+            )
+        self.tokenizer_name = tokenizer_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+
+    def chunk_texts(self, texts):
+        """
+        Chunk `texts` (any sequence of strings, e.g. a pandas Series). Returns the chunks, their
+        token ids as one flat int32 array plus the offsets of every chunk in it (int64 array of
+        length chunks + 1), and the index in `texts` of the document of every chunk.
+        """
+        texts = list(texts)
+        stride = self.chunk_size - self.chunk_overlap
+        chunks = []
+        # token ids are packed into an array batch by batch, not kept as Python ints
+        token_id_blocks = []
+        lengths = []
+        doc_ids = []
+        for batch_start in range(0, len(texts), self.batch_size):
+            batch = texts[batch_start : batch_start + self.batch_size]
+            batch_token_ids = []
+            encoding = self.tokenizer(
+                batch,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+                verbose=False,
+            )
+            for doc_offset, (text, ids, spans) in enumerate(
+                zip(batch, encoding["input_ids"], encoding["offset_mapping"])
+            ):
+                for start in range(0, len(ids), stride):
+                    end = min(start + self.chunk_size, len(ids))
+                    chunks.append(text[spans[start][0] : spans[end - 1][1]])
+                    chunk_ids = self.tokenizer.build_inputs_with_special_tokens(ids[start:end])
+                    batch_token_ids.extend(chunk_ids)
+                    lengths.append(len(chunk_ids))
+                    doc_ids.append(batch_start + doc_offset)
+                    if end == len(ids):
+                        break
+            token_id_blocks.append(np.array(batch_token_ids, dtype=np.int32))
+        token_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=token_offsets[1:])
+        return (
+            chunks,
+            np.concatenate(token_id_blocks) if token_id_blocks else np.empty(0, dtype=np.int32),
+            token_offsets,
+            np.array(doc_ids, dtype=np.int64),
+        )
+
+    @staticmethod
+    def select(token_ids, token_offsets, indices):
+        """Token ids and offsets of the chunks at `indices` only (e.g. after deduplication)"""
+        starts = token_offsets[indices]
+        lengths = token_offsets[np.asarray(indices) + 1] - starts
+        new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_offsets[1:])
+        positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+        return token_ids[positions], new_offsets
@@ -63,50 +63,31 @@ class ColPaliEncoder(BaseEncoder):
         return
 
     def embedding(self, pages):
-
-        images = [Image.open(name) for name in pages]
-
-        dataloader = DataLoader(
-            dataset=ListDataset[str](images),
-            batch_size=1,
-            shuffle=False,
-            collate_fn=lambda x: self.processor.process_images(x),
-        )
-
-        ds: List[torch.Tensor] = []
-        for batch_doc in tqdm(dataloader, "embedding pdf's images"):
+        return self.embedding_from_images((name, Image.open(name)) for name in pages)
+
+    def embedding_from_images(self, pages):
+        """
+        Embed `pages`, an iterable of (filepath, PIL image) pairs, e.g. streamed by a
+        PageRenderer. Pages are consumed one at a time, so the next ones can be rendered while
+        the current one is encoded, and none has to be read back from disk.
+        """
+        dict_list = []
+        for doc_id, (filepath, image) in enumerate(tqdm(pages, "embedding pdf's images")):
             with torch.no_grad():
+                batch_doc = self.processor.process_images([image])
                 batch_doc = {k: v.to(self.encoder.device) for k, v in batch_doc.items()}
                 embeddings_doc = self.encoder(**batch_doc)
-            ds.extend(list(torch.unbind(embeddings_doc.to("cpu"))))
-
-        filepaths = [name for name in pages]
-        data = []
-        for i in range(len(filepaths)):
-            data.append(
-                {
-                    "colbert_vecs": ds[i].float().numpy(),
-                    "doc_id": i,
-                    "filepath": filepaths[i],
-                }
-            )
-
-        dict_list = []
-        for pdf in tqdm(data, "insert pdf's image"):
-            # Insert ColBERT embeddings and metadata for a document into the collection.
-            colbert_vecs = [vec for vec in pdf["colbert_vecs"]]
-            seq_length = len(colbert_vecs)
-            doc_ids = [pdf["doc_id"] for i in range(seq_length)]
-            seq_ids = list(range(seq_length))
+            # ColBERT embeddings and metadata of the page, one row per token vector
+            colbert_vecs = embeddings_doc[0].to("cpu").float().numpy()
             dict_list.extend(
                 [
                     {
-                        "vector": colbert_vecs[i],
-                        "seq_id": seq_ids[i],
-                        "doc_id": doc_ids[i],
-                        "filepath": pdf["filepath"],
+                        "vector": colbert_vecs[seq_id],
+                        "seq_id": seq_id,
+                        "doc_id": doc_id,
+                        "filepath": filepath,
                     }
-                    for i in range(seq_length)
+                    for seq_id in range(len(colbert_vecs))
                 ]
             )
         return dict_list
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+
+# bytes of the blake2b digest identifying a chunk
+DIGEST_SIZE = 16
+
+
+def model_revision(model_name):
+    """Commit of the locally cached Hugging Face snapshot of `model_name`, None if unknown"""
+    try:
+        from huggingface_hub import try_to_load_from_cache
+
+        for repo_id in [model_name, f"sentence-transformers/{model_name}"]:
+            config_path = try_to_load_from_cache(repo_id, "config.json")
+            if isinstance(config_path, str):
+                # .../models--<org>--<name>/snapshots/<commit>/config.json
+                return os.path.basename(os.path.dirname(config_path))
+    except Exception:
+        pass
+    return None
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of chunk embeddings. Entries are keyed by the blake2b digest of the chunk text,
+    within a namespace of the model name and revision, the normalization and the storage dtype,
+    so that a different model (or model version) never serves stale vectors.
+
+    New vectors are buffered in memory and appended in segments of `segment_rows` rows, each one
+    a .npy matrix memory-mapped on lookup plus the sorted digests of its rows, which are kept in
+    memory as the hash index. Looking a chunk up costs a binary search per segment and a hit
+    reads only its row. `embed` serves hits from the cache (or the buffer) and calls the encoder
+    on the misses only, and never if there is none. Once the cache grows over `max_bytes`, the
+    least recently used segments are evicted. `flush` writes out what is still buffered.
+    """
+
+    DEFAULT_CACHE_DIR = os.path.join(
+        os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface")),
+        "ragperf_embedding_cache",
+    )
+
+    def __init__(
+        self,
+        model_name,
+        revision=None,
+        normalization="l2",
+        dtype="float16",
+        cache_dir=None,
+        max_bytes=100 * 2**30,
+        segment_rows=1 << 20,
+    ):
+        self.cache_dir = cache_dir or EmbeddingCache.DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.segment_rows = segment_rows
+        self.dtype = np.dtype(dtype)
+        revision = revision or model_revision(model_name)
+        if revision is None:
+            cprint.wprintf(
+                f"*** Unknown revision of {model_name}, an updated model would still hit the "
+                f"embedding cache, set it explicitly to tell versions apart"
+            )
+        self.key = {
+            "model": model_name,
+            "revision": revision,
+            "normalization": normalization,
+            "dtype": self.dtype.name,
+        }
+        digest = hashlib.sha256(json.dumps(self.key, sort_keys=True).encode()).hexdigest()[:32]
+        self.namespace_dir = os.path.join(
+            self.cache_dir, f"{model_name.replace('/', '__')}_{digest}"
+        )
+        self.stats = {"hits": 0, "misses": 0, "embedded": 0}
+        self.__load_index()
+
+    @staticmethod
+    def digest(chunks) -> np.ndarray:
+        """Digests of `chunks` (any iterable of str, e.g. a ChunkStore)"""
+        return np.array(
+            [hashlib.blake2b(chunk.encode(), digest_size=DIGEST_SIZE).digest() for chunk in chunks],
+            dtype=f"S{DIGEST_SIZE}",
+        )
+
+    def __segment_paths(self):
+        """Vector and digest files of every complete segment, oldest first"""
+        if not os.path.isdir(self.namespace_dir):
+            return []
+        names = sorted(
+            filename[: -len(".keys.npy")]
+            for filename in os.listdir(self.namespace_dir)
+            if filename.endswith(".keys.npy")
+        )
+        return [
+            (
+                os.path.join(self.namespace_dir, f"{name}.vecs.npy"),
+                os.path.join(self.namespace_dir, f"{name}.keys.npy"),
+            )
+            for name in names
+        ]
+
+    def __load_index(self):
+        # every segment keeps its own sorted digests, a new segment never rewrites the others
+        self.segments = []
+        self.dim = None
+        for vecs_path, keys_path in self.__segment_paths():
+            self.__add_segment(vecs_path, np.load(keys_path))
+        self.pending_keys = []
+        self.pending_vectors = []
+        self.pending_index = {}
+        self.pending_rows = 0
+
+    def __add_segment(self, vecs_path, segment_keys):
+        segment_vectors = np.load(vecs_path, mmap_mode="r")
+        self.dim = segment_vectors.shape[1]
+        # segments are written sorted by digest, `order` only maps rows of unsorted ones
+        order = None
+        if np.any(segment_keys[1:] < segment_keys[:-1]):
+            order = np.argsort(segment_keys, kind="stable")
+            segment_keys = segment_keys[order]
+        self.segments.append((vecs_path, segment_vectors, segment_keys, order))
+
+    @property
+    def num_vectors(self) -> int:
+        return sum(len(segment_keys) for _, _, segment_keys, _ in self.segments) + self.pending_rows
+
+    def lookup(self, digests):
+        """Cached vectors of `digests` (float32, rows of misses left at 0) and the hit mask"""
+        hit = np.zeros(len(digests), dtype=bool)
+        vectors = np.zeros((len(digests), self.dim or 0), dtype=np.float32)
+        for vecs_path, segment_vectors, segment_keys, order in self.segments:
+            miss_idx = np.flatnonzero(~hit)
+            if len(miss_idx) == 0:
+                break
+            positions = np.searchsorted(segment_keys, digests[miss_idx])
+            found = np.zeros(len(miss_idx), dtype=bool)
+            in_range = positions < len(segment_keys)
+            found[in_range] = segment_keys[positions[in_range]] == digests[miss_idx[in_range]]
+            if not found.any():
+                continue
+            rows = positions[found] if order is None else order[positions[found]]
+            # read in row order, the memory-mapped pages are then touched sequentially
+            row_order = np.argsort(rows)
+            vectors[miss_idx[found][row_order]] = segment_vectors[rows[row_order]]
+            hit[miss_idx[found]] = True
+            # the modification time orders segments by last use
+            os.utime(vecs_path)
+        # vectors stored since the last segment was written
+        if self.pending_rows > 0:
+            for idx in np.flatnonzero(~hit):
+                location = self.pending_index.get(digests[idx])
+                if location is not None:
+                    block_idx, row = location
+                    vectors[idx] = self.pending_vectors[block_idx][row]
+                    hit[idx] = True
+        return vectors, hit
+
+    def put(self, digests, vectors):
+        """
+        Store `vectors` (one row per digest). They are buffered in memory and written out a full
+        segment of `segment_rows` rows at a time (see `flush`), evicting to fit the budget after
+        every segment written.
+        """
+        vectors = np.asarray(vectors).astype(self.dtype, copy=False)
+        if self.dim is None and len(vectors) > 0:
+            self.dim = vectors.shape[1]
+        block_idx = len(self.pending_keys)
+        self.pending_keys.append(digests)
+        self.pending_vectors.append(vectors)
+        for row, digest in enumerate(digests):
+            self.pending_index[digest] = (block_idx, row)
+        self.pending_rows += len(digests)
+        if self.pending_rows >= self.segment_rows:
+            self.__write_pending(full_segments_only=True)
+
+    def flush(self):
+        """Write the buffered vectors out as a (possibly partial) segment, e.g. at the end of a run"""
+        if self.pending_rows > 0:
+            self.__write_pending(full_segments_only=False)
+
+    def __write_pending(self, full_segments_only):
+        digests = np.concatenate(self.pending_keys)
+        vectors = np.concatenate(self.pending_vectors)
+        nwritten = len(digests)
+        if full_segments_only:
+            nwritten -= nwritten % self.segment_rows
+        os.makedirs(self.namespace_dir, exist_ok=True)
+        written = []
+        for start in range(0, nwritten, self.segment_rows):
+            segment_digests = digests[start : start + self.segment_rows]
+            # sorted by digest, so that lookups search the digests of the file as they are
+            order = np.argsort(segment_digests, kind="stable")
+            segment_digests = segment_digests[order]
+            name = f"seg_{time.time_ns()}_{os.getpid()}"
+            vecs_path = os.path.join(self.namespace_dir, f"{name}.vecs.npy")
+            keys_path = os.path.join(self.namespace_dir, f"{name}.keys.npy")
+            # the digest file marks a segment as complete, so it is written last
+            for path, array in [
+                (vecs_path, vectors[start : start + self.segment_rows][order]),
+                (keys_path, segment_digests),
+            ]:
+                with open(f"{path}.tmp", "wb") as fout:
+                    np.save(fout, array)
+                os.replace(f"{path}.tmp", path)
+            written.append(vecs_path)
+            self.__add_segment(vecs_path, segment_digests)
+        # what does not fill a segment stays buffered
+        self.pending_keys = []
+        self.pending_vectors = []
+        self.pending_index = {}
+        self.pending_rows = 0
+        if nwritten < len(digests):
+            self.put(digests[nwritten:], vectors[nwritten:])
+        if len(written) > 0:
+            evicted = set(self.evict(keep=written))
+            self.segments = [segment for segment in self.segments if segment[0] not in evicted]
+
+    def evict(self, keep=()) -> list[str]:
+        """
+        Remove the least recently used segments (but `keep`) until the cache fits `max_bytes`,
+        returns the vector files of the removed segments.
+        """
+        entries = []
+        evicted = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".vecs.npy"):
+                    vecs_path = os.path.join(dirpath, filename)
+                    keys_path = f"{vecs_path[: -len('.vecs.npy')]}.keys.npy"
+                    stat = os.stat(vecs_path)
+                    size = stat.st_size
+                    if os.path.isfile(keys_path):
+                        size += os.path.getsize(keys_path)
+                    entries.append((stat.st_mtime, size, vecs_path, keys_path))
+        total_bytes = sum(size for _, size, _, _ in entries)
+        for _, size, vecs_path, keys_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if vecs_path in keep:
+                continue
+            # the digest file goes first, a segment without one is never read
+            for path in [keys_path, vecs_path]:
+                if os.path.isfile(path):
+                    os.remove(path)
+            total_bytes -= size
+            evicted.append(vecs_path)
+            cprint.iprintf(f"*** Embedding cache evicted {vecs_path}")
+        return evicted
+
+    def embed(self, chunks, embed_fn) -> np.ndarray:
+        """
+        Embeddings of `chunks` (float32 matrix). Cached chunks are read from the cache, and
+        `embed_fn(indices)` is called once with the indices in `chunks` of the distinct missing
+        ones, which it must embed (e.g. `encoder.embedding` of those chunks). The new vectors are
+        stored and, like hits, returned as read back in the storage dtype, so a run gives the
+        same vectors whether they were cached or not.
+        """
+        digests = EmbeddingCache.digest(chunks)
+        vectors, hit = self.lookup(digests)
+        miss_idx = np.flatnonzero(~hit)
+        # a chunk repeated within `chunks` is embedded once
+        miss_digests, first_idx, inverse = np.unique(
+            digests[miss_idx], return_index=True, return_inverse=True
+        )
+        self.stats["hits"] += int(hit.sum())
+        self.stats["misses"] += len(miss_idx)
+        self.stats["embedded"] += len(miss_digests)
+        if len(miss_digests) > 0:
+            new_vectors = np.asarray(embed_fn(miss_idx[first_idx]), dtype=np.float32)
+            self.put(miss_digests, new_vectors)
+            if vectors.shape[1] == 0:
+                # nothing was cached, the dimension is only known now
+                vectors = np.zeros((len(digests), new_vectors.shape[1]), dtype=np.float32)
+            vectors[miss_idx] = new_vectors.astype(self.dtype).astype(np.float32)[inverse]
+        return vectors
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups > 0 else 0.0
+        cached_bytes = sum(
+            os.path.getsize(vecs_path) + os.path.getsize(keys_path)
+            for vecs_path, keys_path in self.__segment_paths()
+        )
+        cprint.iprintf(
+            f"*** Embedding cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"(hit rate: {hit_rate * 100:.2f}%), {self.stats['embedded']} chunks embedded, "
+            f"{self.num_vectors} cached vectors ({cached_bytes / 2**20:.3f} MiB)"
+        )
+        output_path = os.path.join(Logger().log_dirpath, "embedding_cache_stats.txt")
+        with open(output_path, "a") as fout:
+            fout.write(
+                f"{self.key['model']}\t"
+                f"{self.key['revision']}\t"
+                f"{self.key['dtype']}\t"
+                f"{self.stats['hits']}\t"
+                f"{self.stats['misses']}\t"
+                f"{self.stats['embedded']}\t"
+                f"{hit_rate:.6f}\t"
+                f"{self.num_vectors}\t"
+                f"{cached_bytes}\n"
+            )
@@ -1,7 +1,9 @@
 import time
 import numpy as np
+from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from encoder.BaseEncoder import BaseEncoder
+from datasetPreprocess.ChunkStore import ChunkStore
 import torch, gc
 
 
@@ -23,6 +25,9 @@ class SentenceTransformerEncoder(BaseEncoder):
         self.free_encoder()
 
     def load_encoder(self) -> None:
+        if self.encoder is not None:
+            print(f"***Encoder already loaded: {self.sentence_transformers_name}")
+            return
         self.encoder = SentenceTransformer(
             self.sentence_transformers_name,
             self.device,
@@ -50,15 +55,69 @@ class SentenceTransformerEncoder(BaseEncoder):
                 pass
         return
 
-    def embedding(self, texts) -> list[np.array]:
+    # chunks of a ChunkStore turned into Python strings per encode call
+    STORE_BLOCK_SIZE = 65536
+
+    def embedding(self, texts, show_progress_bar=True) -> list[np.array]:
+        if isinstance(texts, ChunkStore):
+            embeddings = []
+            for start in range(0, len(texts), SentenceTransformerEncoder.STORE_BLOCK_SIZE):
+                block = texts[start : start + SentenceTransformerEncoder.STORE_BLOCK_SIZE]
+                embeddings.extend(self.embedding(block.to_pylist(), show_progress_bar))
+            return embeddings
         embeddings = self.encoder.encode(
-            texts, batch_size=self.embedding_batch_size, show_progress_bar=True
+            texts, batch_size=self.embedding_batch_size, show_progress_bar=show_progress_bar
         )
 
         embeddings = np.vstack(embeddings)
         embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
         return embeddings.tolist()
 
+    def embedding_from_token_ids(self, token_ids, token_offsets) -> list[np.array]:
+        """
+        Embed chunks already tokenized by a TokenChunker of the same model: `token_ids` is the
+        flat array of their ids (special tokens included) and chunk i spans
+        token_ids[token_offsets[i]:token_offsets[i + 1]]. Same result as `embedding` on their
+        text, without tokenizing again, as long as no chunk exceeds the encoder's max sequence
+        length (which `embedding` would truncate): longer chunks are refused.
+        """
+        lengths = np.diff(token_offsets)
+        max_seq_length = self.encoder.get_max_seq_length()
+        if len(lengths) > 0 and max_seq_length is not None and lengths.max() > max_seq_length:
+            raise ValueError(
+                f"Chunks of up to {lengths.max()} tokens exceed the max sequence length "
+                f"{max_seq_length} of {self.sentence_transformers_name}, chunk them to fit it"
+            )
+        # like encode(), batch chunks of similar lengths to limit padding
+        order = np.argsort(-lengths, kind="stable")
+        tokenizer = self.encoder.tokenizer
+        pad_token_id = tokenizer.pad_token_id or 0
+        embeddings = np.empty((len(lengths), self.dim), dtype=np.float32)
+        with torch.inference_mode():
+            for start in tqdm(
+                range(0, len(order), self.embedding_batch_size), desc="Embedding token ids"
+            ):
+                batch = order[start : start + self.embedding_batch_size]
+                input_ids = np.full(
+                    (len(batch), lengths[batch].max()), pad_token_id, dtype=np.int64
+                )
+                attention_mask = np.zeros_like(input_ids)
+                for row, chunk_idx in enumerate(batch):
+                    chunk_ids = token_ids[token_offsets[chunk_idx] : token_offsets[chunk_idx + 1]]
+                    input_ids[row, : len(chunk_ids)] = chunk_ids
+                    attention_mask[row, : len(chunk_ids)] = 1
+                features = {
+                    "input_ids": torch.from_numpy(input_ids).to(self.encoder.device),
+                    "attention_mask": torch.from_numpy(attention_mask).to(self.encoder.device),
+                }
+                if "token_type_ids" in tokenizer.model_input_names:
+                    features["token_type_ids"] = torch.zeros_like(features["input_ids"])
+                output = self.encoder(features)["sentence_embedding"]
+                embeddings[batch] = output.float().cpu().numpy()
+
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
     def multi_gpus_embedding(self, texts) -> list[np.array]:
         embeddings_start_time = time.time()
         print(f"***All dataset Embeddings start")
@@ -18,36 +18,33 @@ def main():
     from monitoring_sys import MSys
     from monitoring_sys.config_parser.msys_config_parser import MSysConfig
 
-    import torch
     import argparse
     import pickle
     import _pickle as cPickle
 
-    from vectordb.milvus_api import milvus_client
-    from vectordb.lancedb_api import lance_client
-    from vectordb.qdrant_api import qdrant_client
-    from vectordb.chroma_api import chroma_client
-    from vectordb.elastic_api import elastic_client
-
-    from datasetLoader.TextDatasetLoader import TextDatasetLoader
-    from datasetPreprocess.TextDatasetPreprocess import TextDatasetPreprocess
-    from datasetLoader.PDFDatasetLoader import PDFDatasetLoader
-
-    # from datasetPreprocess.PDFDatasetPreprocess import PDFDatasetPreprocess
+    # vector DB clients, models and evaluators are imported lazily, only those the config selects
+    from components import resolve_components
+    from utils.component_registry import report_import_times
 
     from RAGRequest.TextsRAGRequest import WikipediaRequests
-    from RAGPipeline.TextsRAGPipline import TextsRAGPipeline
-    from RAGPipeline.ImageRAGPipline import ImagesRAGPipeline
+    from RAGRequest.SyntheticRequests import SyntheticRequests
+    from RAGRequest.RequestStream import build_request_stream
+    from RAGRequest.LoadGenerator import OpenLoopLoadGenerator, get_arrivals
+    from RAGRequest.ClosedLoopLoadGenerator import ConcurrencySweep
+    from RAGRequest.MixedWorkload import MixedWorkloadSweep, level_writes
+    from RAGPipeline.RequestServer import RequestServer
+    from RAGPipeline.MicroBatchScheduler import MicroBatchScheduler
+    from RAGPipeline.DocumentIngester import DocumentIngester
+    from RAGPipeline.CheckpointedIngester import CheckpointedIngester
+    from RAGPipeline.ShardedIngestDriver import ShardedIngestDriver
+    from RAGPipeline.StreamingIngester import StreamingIngester
     from RAGPipeline.retriever.BaseRetriever import BaseRetriever
-    from RAGPipeline.reranker.CrossEncoderReranker import CrossEncoderReranker
-    from RAGPipeline.responser.TextsResponser import VLLMResponser
-    from RAGPipeline.responser.ImagesResponser import ImageResponser
-
-    from encoder.sentenceTransformerEncoder import SentenceTransformerEncoder
-    from encoder.ColPaliEncoder import ColPaliEncoder
-    from evaluator.RagasEvaluator import RagasEvaluator
-    from evaluator.RagasOpenAI import RagasOpenAI
-    from evaluator.Ragasvllm import Ragasvllm
+    from datasetPreprocess.ChunkDeduplicator import ChunkDeduplicator
+    from datasetPreprocess.ChunkCache import ChunkCache
+    from datasetPreprocess.ChunkStore import ChunkStore
+    from encoder.EmbeddingCache import EmbeddingCache
+    from datasetPreprocess.TokenChunker import TokenChunker, encoder_max_seq_length
+    from RAGPipeline.VectorSearchBenchmark import VectorSearchBenchmark
 
     # avoid warning about TOKENIZERS_PARALLELISM
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -72,14 +69,28 @@ def main():
             "Please provide a monitoring system configuration file using --msys-config"
         )
     with open(args.msys_config, "r") as fin:
-        translated_config = (
-            MacroTranslator(StaticEnv.get_static_env("global")).translate(fin).read()
-        )
+        msys_config_text = fin.read()
+    translated_config = MacroTranslator(StaticEnv.get_static_env("global")).translate(
+        msys_config_text
+    )
     with open(os.path.join(output_path, "translated_msys_config.yaml"), "w") as fout:
         fout.write(translated_config)
     monitor = MSys(MSysConfig.from_yaml_string(translated_config))
     monitor.report_status(verbose=False, detail=True)
 
+    def make_level_monitor(subdir):
+        """Fresh MSys recording to `subdir` of the output path, one per sweep level"""
+        global_env = StaticEnv.get_static_env("global")
+        level_path = Logger().set_output_subdir(subdir)
+        try:
+            # translate the monitoring config again so that its output goes to the level directory
+            global_env.add_env({"pylogger.log_dirpath": level_path})
+            return MSys(
+                MSysConfig.from_yaml_string(MacroTranslator(global_env).translate(msys_config_text))
+            )
+        finally:
+            global_env.add_env({"pylogger.log_dirpath": Logger().set_output_subdir(None)})
+
     # set collection name
     if not config['sys']['vector_db']['collection_name'] == '':
         collection_name = get_db_collection_name(config['sys']['vector_db']['collection_name'])
@@ -87,65 +98,41 @@ def main():
         collection_name = get_db_collection_name(f"{config['run_name']}")
     cprint.iprintf(f"*** Start the run with collection {collection_name}")
 
+    # import the selected components
+    components = resolve_components(config)
+    report_import_times()
+
     # set db
+    db_kwargs = {
+        "db_path": config["sys"]["vector_db"]["db_path"],
+        "collection_name": collection_name,
+        # "dim": config["sys"]["vector_db"]["dim"],
+        "index_type": config["rag"]["build_index"]["index_type"],
+        "metric_type": config["rag"]["build_index"]["metric_type"],
+        "drop_previous_collection": config["sys"]["vector_db"]["drop_previous_collection"],
+    }
     if config["sys"]["vector_db"]["type"] == "milvus":
-        db_client = milvus_client(
-            db_path=config["sys"]["vector_db"]["db_path"],
-            db_token=config["sys"]["vector_db"]["db_token"],
-            collection_name=collection_name,
-            drop_previous_collection=config["sys"]["vector_db"]["drop_previous_collection"],
-            # dim=config["sys"]["vector_db"]["dim"],
-            index_type=config["rag"]["build_index"]["index_type"],
-            metric_type=config["rag"]["build_index"]["metric_type"],
-        )
-    elif config["sys"]["vector_db"]["type"] == "lancedb":
-        db_client = lance_client(
-            db_path=config["sys"]["vector_db"]["db_path"],
-            collection_name=collection_name,
-            # dim=config["sys"]["vector_db"]["dim"],
-            index_type=config["rag"]["build_index"]["index_type"],
-            metric_type=config["rag"]["build_index"]["metric_type"],
-            drop_previous_collection=config["sys"]["vector_db"]["drop_previous_collection"],
-        )
-    elif config["sys"]["vector_db"]["type"] == "qdrant":
-        db_client = qdrant_client(
-            db_path=config["sys"]["vector_db"]["db_path"],
-            collection_name=collection_name,
-            # dim=config["sys"]["vector_db"]["dim"],
-            index_type=config["rag"]["build_index"]["index_type"],
-            metric_type=config["rag"]["build_index"]["metric_type"],
-            drop_previous_collection=config["sys"]["vector_db"]["drop_previous_collection"],
-        )
-    elif config["sys"]["vector_db"]["type"] == "chroma":
-        db_client = chroma_client(
-            db_path=config["sys"]["vector_db"]["db_path"],
-            collection_name=collection_name,
-            # dim=config["sys"]["vector_db"]["dim"],
-            index_type=config["rag"]["build_index"]["index_type"],
-            metric_type=config["rag"]["build_index"]["metric_type"],
-            drop_previous_collection=config["sys"]["vector_db"]["drop_previous_collection"],
-        )
-    elif config["sys"]["vector_db"]["type"] == "elasticsearch":
-        db_client = elastic_client(
-            db_path=config["sys"]["vector_db"]["db_path"],
-            collection_name=collection_name,
-            # dim=config["sys"]["vector_db"]["dim"],
-            index_type=config["rag"]["build_index"]["index_type"],
-            metric_type=config["rag"]["build_index"]["metric_type"],
-            drop_previous_collection=config["sys"]["vector_db"]["drop_previous_collection"],
-        )
-    else:
-        raise ValueError(f"Unsupported vector database type: {config['sys']['vector_db']['type']}")
+        db_kwargs["db_token"] = config["sys"]["vector_db"]["db_token"]
+    db_client = components["vector_db"](**db_kwargs)
 
     db_client.setup()
     cprint.iprintf(f"*** Vector DB setup done")
 
     # prepare workload
     dataset_name = config["bench"]["dataset"]
+    # the synthetic corpus is described by its generator parameters, shared by corpus and queries
+    loader_kwargs = config["bench"].get("synthetic", {}) if dataset_name == "synthetic" else {}
+    pre_embedded = loader_kwargs.get("pre_embedded", False)
     save_config_to_log_dir(args.config)
     # for image RAG
     if config["bench"]["type"] == "image":
-        pass
+        render_config = config["bench"]["preprocessing"].get("page_render")
+        # pages are only streamed when rendered and embedded in the same run
+        streamed_pages = (
+            bool(render_config)
+            and config["rag"]["action"]["preprocess"]
+            and config["rag"]["action"]["embedding"]
+        )
         # preprocess dataset
         with monitor:
             if config["rag"]["action"]["preprocess"]:
@@ -155,28 +142,39 @@ def main():
                         f"*** Start loading dataset: {dataset_name}, time : {time.monotonic_ns()} "
                     )
                     dataset_ratio = config["bench"]["preprocessing"]["dataset_ratio"]
-                    loader = PDFDatasetLoader(dataset_name=dataset_name)
+                    loader = components["dataset_loader"](dataset_name=dataset_name)
                     samples_length = int(loader.total_length * dataset_ratio)
-                    loader.download_pdf(load_num=samples_length)
+                    loader.download_pdf(
+                        load_num=samples_length, **config["bench"].get("download", {})
+                    )
                     df = loader.get_dataset_slice(length=samples_length, offset=0)
                     cprint.iprintf(
                         f"*** Done Loaded dataset: {dataset_name}, total samples: {len(df)}, done"
                     )
                 log_time_breakdown("chunking")
-                chunker = PDFDatasetPreprocess()
-                pages = chunker.chunking_PDF_to_image(df)
+                chunker = components["dataset_preprocess"]()
+                if streamed_pages:
+                    # rendered in the background while the encoder below loads and consumes them
+                    pages = chunker.stream_PDF_to_image(
+                        df, **(render_config if isinstance(render_config, dict) else {})
+                    )
+                else:
+                    pages = chunker.chunking_PDF_to_image(df)
 
             # embedding
             if config["rag"]["action"]["embedding"]:
                 cprint.iprintf(f"*** Start embedding images, time : {time.monotonic_ns()}")
                 log_time_breakdown("embed")
-                embedder = ColPaliEncoder(
+                embedder = components["encoder"](
                     device="cuda:0",
                     model_name=config["rag"]["embedding"]["sentence_transformers_name"],
                     embedding_batch_size=config["rag"]["embedding"]["batch_size"],
                 )
                 embedder.load_encoder()
-                dict_list = embedder.embedding(pages)
+                if streamed_pages:
+                    dict_list = embedder.embedding_from_images(pages)
+                else:
+                    dict_list = embedder.embedding(pages)
                 embedder.free_encoder()
                 print(
                     f"***Embedding done, total {len(dict_list)} embeddings, time : {time.monotonic_ns()}"
@@ -210,7 +208,10 @@ def main():
                 collection_name=collection_name,
                 req_type="query",
                 req_count=config["rag"]["retrieval"]["question_num"],
+                question_cache_dir=config["rag"]["retrieval"].get("question_cache_dir"),
             )
+            # open (or build on first use) the question bank before any measured region
+            RAGRequest.init_requests()
             print(f"***End request preparation")
 
             # prepare pipeline
@@ -220,16 +221,16 @@ def main():
                 retrieval_batch_size=config["rag"]["retrieval"]["retrieval_batch_size"],
                 client=db_client,
             )
-            responser = ImageResponser(
+            responser = components["responser"](
                 model=config["rag"]["generation"]["model"],
                 device=config["rag"]["generation"]["device"],
             )
-            embedder = ColPaliEncoder(
+            embedder = components["encoder"](
                 device="cuda:0",
                 model_name=config["rag"]["embedding"]["sentence_transformers_name"],
                 embedding_batch_size=config["rag"]["embedding"]["batch_size"],
             )
-            RAGPipline = ImagesRAGPipeline(
+            RAGPipline = components["pipeline"](
                 retriever=retriever,
                 responser=responser,
                 embedder=embedder,
@@ -246,63 +247,433 @@ def main():
 
         return
     elif config["bench"]["type"] == "text":
+        ingest_config = config["rag"].get("ingest", {})
+        # with chunktype: token, chunk sizes are in tokens of the embedding model
+        chunker_kwargs = {
+            "chunk_size": config["bench"]["preprocessing"]["chunk_size"],
+            "chunk_overlap": config["bench"]["preprocessing"]["chunk_overlap"],
+        }
+        if config["bench"]["preprocessing"].get("chunktype", "length") == "token":
+            chunker_kwargs |= {
+                "chunktype": "token",
+                "tokenizer_name": config["rag"]["embedding"]["sentence_transformers_name"],
+                # chunks must fit the encoder's limit, which may be below the tokenizer's
+                "max_seq_length": encoder_max_seq_length(
+                    config["rag"]["embedding"]["sentence_transformers_name"]
+                ),
+            }
+        # embeddings of unchanged chunks are reused across runs (plain and streaming ingest)
+        embedding_cache = None
+        embedding_cache_config = config["rag"]["embedding"].get("cache")
+        if embedding_cache_config:
+            embedding_cache_config = (
+                embedding_cache_config if isinstance(embedding_cache_config, dict) else {}
+            )
+            embedding_cache = EmbeddingCache(
+                config["rag"]["embedding"]["sentence_transformers_name"],
+                revision=embedding_cache_config.get("revision"),
+                dtype=embedding_cache_config.get("dtype", "float16"),
+                cache_dir=embedding_cache_config.get("dir"),
+                max_bytes=int(embedding_cache_config.get("max_gb", 100) * 2**30),
+                segment_rows=embedding_cache_config.get("segment_rows", 1 << 20),
+            )
         # preprocess dataset
-        if config["rag"]["action"]["preprocess"]:
+        if config["rag"]["action"]["preprocess"] and ingest_config.get("sharded"):
+            # chunk -> embed -> insert of every shard in worker processes
+            if dataset_name not in ["wikimedia/wikipedia", "synthetic"] or pre_embedded:
+                raise ValueError(f"Sharded ingest does not support {dataset_name}")
+            if not (config["rag"]["action"]["embedding"] and config["rag"]["action"]["insert"]):
+                raise ValueError("Sharded ingest needs both embedding and insert actions")
+            if ingest_config.get("checkpoint_dir"):
+                raise ValueError("Sharded ingest cannot be combined with the checkpointed ingest")
+            if ingest_config.get("streaming"):
+                raise ValueError("Sharded ingest cannot be combined with the streaming ingest")
+            sharded_config = ingest_config["sharded"]
+            log_time_breakdown("start")
+            with monitor:
+                loader = components["dataset_loader"](dataset_name=dataset_name, **loader_kwargs)
+                samples_length = int(
+                    loader.total_length * config["bench"]["preprocessing"]["dataset_ratio"]
+                )
+                del loader
+                db_type = config["sys"]["vector_db"]["type"]
+                id_base = 0
+                if hasattr(db_client, "sync_id_num") and db_client.has_collection(collection_name):
+                    db_client.sync_id_num(collection_name)
+                    id_base = db_client.id_num
+                log_time_breakdown("sharded_ingest")
+                ShardedIngestDriver(
+                    dataset_name,
+                    samples_length=samples_length,
+                    loader_kwargs=loader_kwargs,
+                    shard_size=ingest_config.get("shard_size", 100000),
+                    collection_name=collection_name,
+                    db_type=db_type,
+                    db_kwargs=db_kwargs,
+                    chunker_kwargs=chunker_kwargs,
+                    encoder_kwargs={
+                        "sentence_transformers_name": config["rag"]["embedding"][
+                            "sentence_transformers_name"
+                        ],
+                        "embedding_batch_size": config["rag"]["embedding"]["batch_size"],
+                    },
+                    embed_devices=sharded_config.get(
+                        "embed_devices", [config["rag"]["embedding"]["device"]]
+                    ),
+                    chunk_workers=sharded_config.get("chunk_workers", 4),
+                    insert_workers=sharded_config.get("insert_workers", 2),
+                    insert_batch_size=config["rag"]["insert"]["batch_size"],
+                    max_inflight_shards=sharded_config.get("max_inflight_shards"),
+                    prepare_collection=(
+                        (lambda dim: db_client.create_collection(collection_name, dim=dim))
+                        if db_type in ["lancedb", "milvus", "qdrant"]
+                        else None
+                    ),
+                    id_base=id_base,
+                ).run()
+
+                if config['rag']['action']['build_index']:
+                    log_time_breakdown("build")
+                    db_client.build_index(
+                        collection_name=collection_name,
+                        index_type=config["rag"]["build_index"]["index_type"],
+                        metric_type=config["rag"]["build_index"]["metric_type"],
+                    )
+                    print(f"***Indexing done for collection: {collection_name}")
+                log_time_breakdown("done")
+        elif config["rag"]["action"]["preprocess"] and ingest_config.get("checkpoint_dir"):
+            # resumable preprocess -> embed -> insert, checkpointed shard by shard
+            if dataset_name not in ["wikimedia/wikipedia", "synthetic"] or pre_embedded:
+                raise ValueError(f"Checkpointed ingest does not support {dataset_name}")
+            if not (config["rag"]["action"]["embedding"] and config["rag"]["action"]["insert"]):
+                raise ValueError("Checkpointed ingest needs both embedding and insert actions")
+            if ingest_config.get("streaming"):
+                raise ValueError("Checkpointed ingest cannot be combined with the streaming ingest")
+            # chroma recreates the collection on every insertion, only the last batch would remain
+            if config["sys"]["vector_db"]["type"] == "chroma":
+                raise ValueError("Checkpointed ingest does not support chroma")
+            log_time_breakdown("start")
+            with monitor:
+                loader = components["dataset_loader"](dataset_name=dataset_name, **loader_kwargs)
+                samples_length = int(
+                    loader.total_length * config["bench"]["preprocessing"]["dataset_ratio"]
+                )
+                embedder = components["encoder"](
+                    device="cuda:0",
+                    sentence_transformers_name=config["rag"]["embedding"][
+                        "sentence_transformers_name"
+                    ],
+                    embedding_batch_size=config["rag"]["embedding"]["batch_size"],
+                )
+                embedder.load_encoder()
+                CheckpointedIngester(
+                    loader,
+                    components["dataset_preprocess"](
+                        num_workers=config["bench"]["preprocessing"].get("chunk_workers", 1),
+                        **chunker_kwargs,
+                    ),
+                    embedder,
+                    db_client,
+                    collection_name,
+                    samples_length=samples_length,
+                    shard_size=ingest_config.get("shard_size", 100000),
+                    checkpoint_dir=ingest_config["checkpoint_dir"],
+                    insert_batch_size=config["rag"]["insert"]["batch_size"],
+                    params=chunker_kwargs
+                    | {"embedding_model": config["rag"]["embedding"]["sentence_transformers_name"]},
+                    prepare_collection=(
+                        (lambda dim: db_client.create_collection(collection_name, dim=dim))
+                        if config["sys"]["vector_db"]["type"] == "lancedb"
+                        else None
+                    ),
+                    keep_shard_files=ingest_config.get("keep_shard_files", False),
+                ).run()
+                embedder.free_encoder()
+
+                if config['rag']['action']['build_index']:
+                    log_time_breakdown("build")
+                    db_client.build_index(
+                        collection_name=collection_name,
+                        index_type=config["rag"]["build_index"]["index_type"],
+                        metric_type=config["rag"]["build_index"]["metric_type"],
+                    )
+                    print(f"***Indexing done for collection: {collection_name}")
+                log_time_breakdown("done")
+        elif config["rag"]["action"]["preprocess"] and ingest_config.get("streaming"):
+            # loader -> chunker -> encoder -> insert as a generator chain, a few batches in memory
+            if dataset_name not in ["wikimedia/wikipedia", "synthetic"] or pre_embedded:
+                raise ValueError(f"Streaming ingest does not support {dataset_name}")
+            if not (config["rag"]["action"]["embedding"] and config["rag"]["action"]["insert"]):
+                raise ValueError("Streaming ingest needs both embedding and insert actions")
+            if config["sys"]["vector_db"]["type"] == "chroma":
+                raise ValueError("Streaming ingest does not support chroma")
+            for option in ["dedup", "chunk_cache"]:
+                if config["bench"]["preprocessing"].get(option):
+                    cprint.wprintf(f"*** preprocessing.{option} is ignored by the streaming ingest")
+            streaming_config = ingest_config["streaming"]
+            streaming_config = streaming_config if isinstance(streaming_config, dict) else {}
+            log_time_breakdown("start")
+            with monitor:
+                loader = components["dataset_loader"](dataset_name=dataset_name, **loader_kwargs)
+                samples_length = int(
+                    loader.total_length * config["bench"]["preprocessing"]["dataset_ratio"]
+                )
+                embedder = components["encoder"](
+                    device="cuda:0",
+                    sentence_transformers_name=config["rag"]["embedding"][
+                        "sentence_transformers_name"
+                    ],
+                    embedding_batch_size=config["rag"]["embedding"]["batch_size"],
+                )
+                embedder.load_encoder()
+                log_time_breakdown("streaming_ingest")
+                StreamingIngester(
+                    loader,
+                    components["dataset_preprocess"](
+                        num_workers=config["bench"]["preprocessing"].get("chunk_workers", 1),
+                        **chunker_kwargs,
+                    ),
+                    embedder,
+                    db_client,
+                    collection_name,
+                    samples_length=samples_length,
+                    doc_batch_size=streaming_config.get(
+                        "doc_batch_size",
+                        config["bench"]["preprocessing"].get("stream_batch_size", 1024),
+                    ),
+                    chunk_batch_size=streaming_config.get("chunk_batch_size", 8192),
+                    max_inflight_inserts=streaming_config.get("max_inflight_inserts", 2),
+                    insert_batch_size=config["rag"]["insert"]["batch_size"],
+                    prepare_collection=(
+                        (lambda dim: db_client.create_collection(collection_name, dim=dim))
+                        if config["sys"]["vector_db"]["type"] == "lancedb"
+                        else None
+                    ),
+                    embedding_cache=embedding_cache,
+                ).run()
+                embedder.free_encoder()
+
+                if config['rag']['action']['build_index']:
+                    log_time_breakdown("build")
+                    db_client.build_index(
+                        collection_name=collection_name,
+                        index_type=config["rag"]["build_index"]["index_type"],
+                        metric_type=config["rag"]["build_index"]["metric_type"],
+                    )
+                    print(f"***Indexing done for collection: {collection_name}")
+                log_time_breakdown("done")
+        elif config["rag"]["action"]["preprocess"] and pre_embedded:
+            # synthetic vectors go straight to the vector DB, without chunking nor embedding
+            log_time_breakdown("start")
+            with monitor:
+                loader = components["dataset_loader"](dataset_name=dataset_name, **loader_kwargs)
+                samples_length = int(
+                    loader.total_length * config["bench"]["preprocessing"]["dataset_ratio"]
+                )
+                if config["rag"]["action"]["insert"]:
+                    log_time_breakdown("insert")
+                    print(f"***Start inserting {samples_length} synthetic vectors")
+                    if config["sys"]["vector_db"]["type"] == "lancedb":
+                        db_client.create_collection(collection_name=collection_name, dim=loader.dim)
+                    # chroma recreates the collection on every insertion, give it everything at once
+                    block_size = (
+                        samples_length
+                        if config["sys"]["vector_db"]["type"] == "chroma"
+                        else config["rag"]["insert"].get("synthetic_block_size", 100000)
+                    )
+                    for offset in range(0, samples_length, block_size):
+                        vectors, markers = loader.get_vector_slice(
+                            min(block_size, samples_length - offset), offset
+                        )
+                        # the clients take lists of floats, as produced by the encoders
+                        db_client.insert_data_vector(
+                            vector=vectors.tolist(),
+                            chunks=markers,
+                            collection_name=collection_name,
+                            insert_batch_size=config["rag"]["insert"]["batch_size"],
+                            create_collection=True,
+                        )
+                    print(f"***Insertion done, total {samples_length} vectors inserted")
+
+                if config['rag']['action']['build_index']:
+                    log_time_breakdown("build")
+                    db_client.build_index(
+                        collection_name=collection_name,
+                        index_type=config["rag"]["build_index"]["index_type"],
+                        metric_type=config["rag"]["build_index"]["metric_type"],
+                    )
+                    print(f"***Indexing done for collection: {collection_name}")
+                log_time_breakdown("done")
+        elif config["rag"]["action"]["preprocess"]:
             # if True:
             log_time_breakdown("start")
             with monitor:
                 # TODO: add length and offset into config
                 # download and load dataset
                 # if config["rag"]["action"]["preprocess"]:
-                if dataset_name == "wikimedia/wikipedia":
+                streaming = config["bench"]["preprocessing"].get("streaming", False)
+                # chunks kept in one Arrow buffer instead of a list of str
+                chunk_store = config["bench"]["preprocessing"].get("chunk_store", False)
+                chunk_cache_config = config["bench"]["preprocessing"].get("chunk_cache")
+                chunk_cache = chunk_cache_key = cached_chunks = None
+                if chunk_cache_config:
+                    chunk_cache_config = (
+                        chunk_cache_config if isinstance(chunk_cache_config, dict) else {}
+                    )
+                    chunk_cache = ChunkCache(
+                        cache_dir=chunk_cache_config.get("dir"),
+                        max_bytes=int(chunk_cache_config.get("max_gb", 50) * 2**30),
+                    )
+                if dataset_name in ["wikimedia/wikipedia", "synthetic"]:
                     dataset_ratio = config["bench"]["preprocessing"]["dataset_ratio"]
-                    loader = TextDatasetLoader(dataset_name=dataset_name)
-                    samples_length = int(loader.total_length * dataset_ratio)
-                    df = loader.get_dataset_slice(length=samples_length, offset=0)
-                    cprint.iprintf(
-                        f"*** Done Loaded dataset: {dataset_name}, total samples: {len(df)}, done"
+                    loader = components["dataset_loader"](
+                        dataset_name=dataset_name, **loader_kwargs
                     )
+                    samples_length = int(loader.total_length * dataset_ratio)
+                    # with the chunks of this slice cached, documents are neither loaded nor chunked
+                    if chunk_cache is not None and loader.revision is not None:
+                        chunk_cache_key = ChunkCache.key(
+                            dataset_name, loader.revision, 0, samples_length, chunker_kwargs
+                        )
+                        cached_chunks = chunk_cache.get(chunk_cache_key, as_store=chunk_store)
+                    if cached_chunks is not None:
+                        chunked_texts, doc_ids, token_ids, token_offsets = cached_chunks
+                    elif streaming:
+                        # documents are read batch by batch from the HF cache files while chunking
+                        record_batches = loader.iter_record_batches(
+                            length=samples_length,
+                            batch_size=config["bench"]["preprocessing"].get(
+                                "stream_batch_size", 1024
+                            ),
+                        )
+                    else:
+                        df = loader.get_dataset_slice(length=samples_length, offset=0)
+                        cprint.iprintf(
+                            f"*** Done Loaded dataset: {dataset_name}, total samples: {len(df)}, done"
+                        )
                 elif dataset_name == "common-pile/arxiv_papers":
                     dataset_ratio = config["bench"]["preprocessing"]["dataset_ratio"]
-                    loader = PDFDatasetLoader(dataset_name=dataset_name)
+                    loader = components["dataset_loader"](dataset_name=dataset_name)
                     samples_length = int(loader.total_length * dataset_ratio)
-                    loader.download_pdf(load_num=samples_length)
+                    loader.download_pdf(
+                        load_num=samples_length, **config["bench"].get("download", {})
+                    )
                     df = loader.get_dataset_slice(length=samples_length, offset=0)
                     cprint.iprintf(
                         f"*** Done Loaded dataset: {dataset_name}, total samples: {len(df)}, done"
                     )
                 # chunking datasets
-                if dataset_name == "wikimedia/wikipedia":
-                    chunker = TextDatasetPreprocess(
-                        chunk_size=config["bench"]["preprocessing"]["chunk_size"],
-                        chunk_overlap=config["bench"]["preprocessing"]["chunk_overlap"],
+                if cached_chunks is not None:
+                    cprint.iprintf(
+                        f"*** Chunking skipped, total {len(chunked_texts)} cached chunks"
+                    )
+                elif dataset_name in ["wikimedia/wikipedia", "synthetic"]:
+                    chunker = components["dataset_preprocess"](
+                        num_workers=config["bench"]["preprocessing"].get("chunk_workers", 1),
+                        **chunker_kwargs,
                     )
                     log_time_breakdown("chunking")
-                    chunked_texts = chunker.chunking_text_to_text(df)
+                    token_ids = token_offsets = doc_ids = None
+                    if streaming and chunk_store:
+                        chunked_texts = ChunkStore.concat(
+                            ChunkStore.from_texts(batch_chunks)
+                            for batch_chunks in chunker.iter_chunking_record_batches(record_batches)
+                        )
+                    elif streaming:
+                        chunked_texts = []
+                        for batch_chunks in chunker.iter_chunking_record_batches(record_batches):
+                            chunked_texts.extend(batch_chunks)
+                    elif chunker.chunktype == "token":
+                        # the token ids are handed to the encoder, which does not tokenize again
+                        chunked_texts, token_ids, token_offsets, doc_ids = (
+                            chunker.chunking_text_to_tokens(df)
+                        )
+                    elif chunk_store:
+                        chunked_texts = chunker.chunking_text_to_store(df)
+                        doc_ids = chunked_texts.doc_ids
+                    else:
+                        chunked_texts, doc_ids = chunker.chunking_text_to_text(
+                            df, return_doc_ids=True
+                        )
                     cprint.iprintf(f"*** Chunking done, total {len(chunked_texts)} chunks")
+                    if chunk_cache_key is not None:
+                        chunk_cache.put(
+                            chunk_cache_key, chunked_texts, doc_ids, token_ids, token_offsets
+                        )
                 elif dataset_name == "common-pile/arxiv_papers":
-                    chunker = PDFDatasetPreprocess()
+                    chunker = components["dataset_preprocess"](
+                        **config["bench"]["preprocessing"].get("pdf_convert", {})
+                    )
                     log_time_breakdown("convert")  # todo separate chunking and converting
                     docs = chunker.convert_PDF_to_text(df)
                     log_time_breakdown("chunking")
                     chunked_texts = chunker.chunking_PDF_to_text(docs)
+                    token_ids = token_offsets = doc_ids = None
                     cprint.iprintf(f"*** Chunking done, total {len(chunked_texts)} chunks")
 
+                if chunk_store and not isinstance(chunked_texts, ChunkStore):
+                    chunked_texts = ChunkStore.from_texts(chunked_texts, doc_ids)
+                if chunk_store:
+                    cprint.iprintf(
+                        f"*** Chunk store: {len(chunked_texts)} chunks, "
+                        f"{chunked_texts.nbytes / 2**20:.3f} MiB"
+                    )
+
+                # drop duplicate chunks before they are embedded
+                dedup_config = config["bench"]["preprocessing"].get("dedup")
+                if dedup_config:
+                    log_time_breakdown("dedup")
+                    deduplicator = ChunkDeduplicator(
+                        **(dedup_config if isinstance(dedup_config, dict) else {})
+                    )
+                    keep, chunk_map = deduplicator.deduplicate(chunked_texts)
+                    deduplicator.report(chunk_map, doc_ids)
+                    if isinstance(chunked_texts, ChunkStore):
+                        chunked_texts = chunked_texts.take(keep)
+                    else:
+                        chunked_texts = [chunked_texts[idx] for idx in keep]
+                    if token_ids is not None:
+                        token_ids, token_offsets = TokenChunker.select(
+                            token_ids, token_offsets, keep
+                        )
+
                 embeddings_dim = None
                 # embedding
                 if config["rag"]["action"]["embedding"]:
                     cprint.iprintf(f"*** Start embedding texts")
                     log_time_breakdown("embed")
-                    embedder = SentenceTransformerEncoder(
+                    embedder = components["encoder"](
                         device="cuda:0",
                         sentence_transformers_name=config["rag"]["embedding"][
                             "sentence_transformers_name"
                         ],
                         embedding_batch_size=config["rag"]["embedding"]["batch_size"],
                     )
-                    embedder.load_encoder()
-                    embeddings_dim = embedder.dim
-                    embeddings = embedder.embedding(chunked_texts)
+                    if embedding_cache is not None:
+
+                        def embed_misses(indices):
+                            # the model is only loaded if some chunk is not cached
+                            embedder.load_encoder()
+                            if token_ids is not None:
+                                return embedder.embedding_from_token_ids(
+                                    *TokenChunker.select(token_ids, token_offsets, indices)
+                                )
+                            if isinstance(chunked_texts, ChunkStore):
+                                return embedder.embedding(chunked_texts.take(indices))
+                            return embedder.embedding([chunked_texts[idx] for idx in indices])
+
+                        embeddings = embedding_cache.embed(chunked_texts, embed_misses)
+                        embeddings_dim = embeddings.shape[1]
+                        embeddings = embeddings.tolist()
+                        embedding_cache.flush()
+                        embedding_cache.report()
+                    else:
+                        embedder.load_encoder()
+                        embeddings_dim = embedder.dim
+                        if token_ids is not None:
+                            embeddings = embedder.embedding_from_token_ids(token_ids, token_offsets)
+                        else:
+                            embeddings = embedder.embedding(chunked_texts)
                     embedder.free_encoder()
                     print(f"***Embedding done, total {len(embeddings)} embeddings")
                     if config["rag"]["embedding"]["store"] == True:
@@ -359,12 +730,41 @@ def main():
                 log_time_breakdown("done")
         # query + retrieval + reranking + generation + evaluation
         if config["rag"]["action"]["generation"] == True:
-            RAGRequest = WikipediaRequests(
-                run_name=config["run_name"],
-                collection_name=collection_name,
-                req_type="query",
-                req_count=config["rag"]["retrieval"]["question_num"],
+            stream_config = config["rag"]["retrieval"].get("stream")
+            if stream_config and pre_embedded:
+                raise ValueError("Request streams are not supported with pre-embedded queries")
+
+            def make_requests(req_count):
+                if dataset_name == "synthetic":
+                    loader = components["dataset_loader"](
+                        dataset_name=dataset_name, **loader_kwargs
+                    )
+                    return SyntheticRequests(
+                        run_name=config["run_name"],
+                        collection_name=collection_name,
+                        req_type="query",
+                        req_count=req_count,
+                        loader=loader,
+                        # queries only target ingested documents
+                        corpus_length=int(
+                            loader.total_length * config["bench"]["preprocessing"]["dataset_ratio"]
+                        ),
+                        **config["rag"]["retrieval"].get("synthetic_queries", {}),
+                    )
+                return WikipediaRequests(
+                    run_name=config["run_name"],
+                    collection_name=collection_name,
+                    req_type="query",
+                    req_count=req_count,
+                    question_cache_dir=config["rag"]["retrieval"].get("question_cache_dir"),
+                )
+
+            # questions are drawn from a pool by the request stream, if any
+            RAGRequest = build_request_stream(
+                make_requests, config["rag"]["retrieval"]["question_num"], stream_config
             )
+            # open (or build on first use) the question bank before any measured region
+            RAGRequest.init_requests()
             print(f"***End request preparation")
 
             # prepare pipeline
@@ -374,8 +774,15 @@ def main():
                 retrieval_batch_size=config["rag"]["retrieval"]["retrieval_batch_size"],
                 client=db_client,
             )
+            if pre_embedded:
+                # no model to load, the query vectors are searched directly
+                with monitor:
+                    VectorSearchBenchmark(
+                        retriever, backend=config["sys"]["vector_db"]["type"]
+                    ).process(RAGRequest, batch_size=config["rag"]["pipeline"]["batch_size"])
+                return
             if config['rag']['action']['reranking']:
-                reranker = CrossEncoderReranker(
+                reranker = components["reranker"](
                     model_name=config["rag"]["reranking"]["rerank_model"],
                     top_n=config["rag"]["reranking"]["top_n"],
                     device=config["rag"]["reranking"]["device"],
@@ -383,36 +790,149 @@ def main():
             else:
                 reranker = None
             if config["rag"]["action"]["evaluate"]:
-                evaluator = Ragasvllm(
-                    llm_path=config["rag"]["evaluate"]["evaluator_model"],
-                )
+                evaluator_kwargs = {"llm_path": config["rag"]["evaluate"]["evaluator_model"]}
+                if config["rag"]["evaluate"].get("type", "ragas_vllm") == "ragas_openai":
+                    evaluator_kwargs["emb_path"] = config["rag"]["evaluate"].get("embedding_model")
+                evaluator = components["evaluator"](**evaluator_kwargs)
             else:
                 evaluator = None
-            responser = VLLMResponser(
+            pipeline_config = config["rag"]["pipeline"]
+            pipeline_mode = pipeline_config.get("mode", "batch")
+            # the async pipeline streams generation from vLLM's AsyncLLMEngine
+            responser = components["responser"](
                 model=config["rag"]["generation"]["model"],
                 device=config["rag"]["generation"]["device"],
                 parallelism=config["rag"]["generation"]["parallelism"],
             )
-            embedder = SentenceTransformerEncoder(
+            embedder = components["encoder"](
                 device=config["rag"]["embedding"]["device"],
                 sentence_transformers_name=config["rag"]["embedding"]["sentence_transformers_name"],
             )
-            RAGPipline = TextsRAGPipeline(
+            pipeline_kwargs = {}
+            if pipeline_mode == "async":
+                pipeline_kwargs["executor_workers"] = pipeline_config.get("executor_workers", 4)
+            RAGPipline = components["pipeline"](
                 retriever=retriever,
                 responser=responser,
                 embedder=embedder,
                 reranker=reranker,
                 evaluator=evaluator,
+                **pipeline_kwargs,
             )
 
             # pipeline.check()
             import utils.colored_print as cprint
 
-            with monitor:
-                RAGPipline.process(
-                    RAGRequest,
-                    batch_size=config["rag"]["pipeline"]["batch_size"],
+            def make_server():
+                # open- and closed-loop requests are grouped either by a single static batch size
+                # or by per-stage deadline-aware micro-batches
+                if pipeline_config.get("scheduler", "static") == "microbatch":
+                    return MicroBatchScheduler(
+                        RAGPipline,
+                        stage_limits=pipeline_config.get("microbatch"),
+                        default_batch_size=pipeline_config["batch_size"],
+                    )
+                return RequestServer(RAGPipline, pipeline_config["batch_size"])
+
+            if pipeline_mode in ["batch", "pipelined"]:
+                with monitor:
+                    RAGPipline.process(
+                        RAGRequest,
+                        batch_size=pipeline_config["batch_size"],
+                        pipelined=pipeline_mode == "pipelined",
+                        queue_depth=pipeline_config.get("queue_depth", 2),
+                    )
+            elif pipeline_mode == "open_loop":
+                load_config = config["rag"]["load"]
+                arrivals = get_arrivals(
+                    load_config["arrival"],
+                    rate=load_config.get("rate"),
+                    steps=load_config.get("steps"),
+                    seed=load_config.get("seed", 0),
                 )
+                with monitor:
+                    RAGPipline.load_models()
+                    with make_server() as server:
+                        OpenLoopLoadGenerator(RAGRequest, server, arrivals).run()
+                    RAGPipline.free_models()
+                if isinstance(server, MicroBatchScheduler):
+                    server.report_stats()
+                RAGPipline.tracer.dump("text_pipeline")
+            elif pipeline_mode == "closed_loop":
+                load_config = config["rag"]["load"]
+                max_concurrency = load_config.get("max_concurrency", 256)
+                levels = load_config.get(
+                    "concurrency", [2**i for i in range(max_concurrency.bit_length())]
+                )
+                RAGPipline.load_models()
+                with make_server() as server:
+                    ConcurrencySweep(
+                        RAGRequest,
+                        server,
+                        levels,
+                        monitor_factory=make_level_monitor,
+                        requests_per_user=load_config.get("requests_per_user", 4),
+                        throughput_gain_threshold=load_config.get("throughput_gain_threshold", 0.1),
+                        p99_growth_threshold=load_config.get("p99_growth_threshold", 1.0),
+                    ).run()
+                RAGPipline.free_models()
+                if isinstance(server, MicroBatchScheduler):
+                    server.report_stats()
+                RAGPipline.tracer.dump("text_pipeline")
+            elif pipeline_mode == "mixed":
+                # chroma recreates the collection on every insertion, wiping what is queried
+                if config["sys"]["vector_db"]["type"] == "chroma":
+                    raise ValueError("Mixed read/write workloads do not support chroma")
+                mixed_config = config["rag"]["mixed"]
+                write_fractions = mixed_config.get("write_fractions", [0, 0.1, 0.25, 0.5])
+                ops_per_level = mixed_config.get("ops_per_level", RAGRequest.req_count)
+                docs_per_insert = mixed_config.get("docs_per_insert", 1)
+                UpdateRequest = WikipediaRequests(
+                    run_name=config["run_name"],
+                    collection_name=collection_name,
+                    req_type="update",
+                    # the documents of every insert of every level
+                    req_count=sum(
+                        level_writes(ops_per_level, write_fraction)
+                        for write_fraction in set([0] + list(write_fractions))
+                    )
+                    * docs_per_insert,
+                    doc_offset=mixed_config.get("doc_offset"),
+                )
+                RAGPipline.load_models()
+                ingester = DocumentIngester(
+                    db_client,
+                    collection_name,
+                    embedder,
+                    components["dataset_preprocess"](**chunker_kwargs),
+                    insert_batch_size=config["rag"]["insert"]["batch_size"],
+                )
+                with make_server() as server:
+                    MixedWorkloadSweep(
+                        RAGRequest,
+                        UpdateRequest,
+                        server,
+                        ingester,
+                        write_fractions,
+                        rate=mixed_config["rate"],
+                        ops_per_level=ops_per_level,
+                        docs_per_insert=docs_per_insert,
+                        ingest_workers=mixed_config.get("ingest_workers", 1),
+                        monitor_factory=make_level_monitor,
+                        seed=mixed_config.get("seed", 0),
+                        backend=config["sys"]["vector_db"]["type"],
+                    ).run()
+                RAGPipline.free_models()
+                if isinstance(server, MicroBatchScheduler):
+                    server.report_stats()
+                RAGPipline.tracer.dump("text_pipeline")
+            elif pipeline_mode == "async":
+                with monitor:
+                    RAGPipline.process(
+                        RAGRequest, max_inflight=pipeline_config.get("max_inflight", 1024)
+                    )
+            else:
+                raise ValueError(f"Unsupported pipeline mode: {pipeline_mode}")
 
 
 if __name__ == "__main__":
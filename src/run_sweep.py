@@ -0,0 +1,61 @@
+def main():
+    import os, sys
+    import utils.python_utils as pyutils
+
+    if not any([p in arg for p in ["--log_dir", "--create_log_dir"] for arg in sys.argv]):
+        sys.argv.append(f"--log_dir={os.path.join(pyutils.get_script_dir(__file__), 'output')}")
+        sys.argv.append(f"--create_log_dir=True")
+
+    from utils.logger import Logger, save_config_to_log_dir
+
+    from config import load_config
+    import utils.colored_print as cprint
+
+    # put this before any other imports to prevent loading wrong libstdc++.so, it loads MSys
+    from sweep_runner import SweepRunner
+
+    import argparse
+    import yaml
+
+    # avoid warning about TOKENIZERS_PARALLELISM
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    output_path = Logger().log_dirpath
+    cprint.iprintf(f"Using output path: {output_path}")
+
+    # parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, help="Path to the base configuration file")
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        help="Path to the sweep file, mapping dotted config paths to lists of values",
+    )
+    parser.add_argument(
+        "--msys-config", type=str, help="Path to the monitoring system configuration file"
+    )
+    args = parser.parse_known_args()[0]
+    if not args.config:
+        raise ValueError("Please provide a configuration file using --config")
+    if not args.sweep:
+        raise ValueError("Please provide a sweep file using --sweep")
+    if not args.msys_config:
+        raise ValueError(
+            "Please provide a monitoring system configuration file using --msys-config"
+        )
+    config = load_config(args.config)
+    with open(args.sweep, "r") as fin:
+        grid = yaml.safe_load(fin)
+    for path, values in grid.items():
+        if not isinstance(values, list) or len(values) == 0:
+            raise ValueError(f"Sweep values of {path} must be a non-empty list, got {values}")
+    with open(args.msys_config, "r") as fin:
+        msys_config_text = fin.read()
+    save_config_to_log_dir(args.config)
+    save_config_to_log_dir(args.sweep)
+
+    SweepRunner(config, grid, msys_config_text).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import copy
+import itertools
+import os
+import time
+
+import yaml
+
+import utils.colored_print as cprint
+from utils.logger import Logger, log_time_breakdown
+from utils.python_utils import set_by_path
+from utils.component_registry import report_import_times
+from config import get_db_collection_name, output_config
+from components import resolve_components
+from monitoring_sys import MSys
+from monitoring_sys.config_parser.msys_config_parser import StaticEnv, MacroTranslator, MSysConfig
+from RAGRequest.TextsRAGRequest import WikipediaRequests
+from RAGRequest.RequestStream import build_request_stream
+from RAGPipeline.retriever.BaseRetriever import BaseRetriever
+
+
+def expand_grid(grid) -> list[dict]:
+    """
+    Expand a parameter grid, mapping dotted config paths to lists of values, into the list of its
+    points. Index build parameters vary slowest, so that consecutive points rebuild the index as
+    rarely as possible.
+    """
+    paths = sorted(grid, key=lambda path: not path.startswith("rag.build_index."))
+    return [dict(zip(paths, values)) for values in itertools.product(*[grid[p] for p in paths])]
+
+
+class SweepRunner:
+    """
+    Run every point of a parameter grid (e.g. top_k x retrieval_batch_size x index_type x
+    reranker top_n) over a base config inside one process. Vector DB clients and models are created
+    once per distinct set of parameters they depend on and stay resident across points, only the
+    cheap per-point objects (retriever, pipeline, requests) are rebuilt.
+
+    Every point runs the query path inside its own MSys recording, with all its outputs in its own
+    `point_<idx>` sub-directory of the log directory. `sweep_summary.txt` gets one row per point.
+    """
+
+    SUPPORTED_MODES = ["batch", "pipelined"]
+
+    def __init__(self, base_config, grid, msys_config_text):
+        self.base_config = base_config
+        self.points = expand_grid(grid)
+        self.msys_config_text = msys_config_text
+        self.__resident = {}
+        self.__built_index = {}
+
+    def __get_resident(self, kind, key, factory):
+        """Return the resident object of `kind` created with parameters `key`, create it if needed"""
+        if (kind, key) not in self.__resident:
+            cprint.iprintf(f"*** Creating {kind} for {key}")
+            self.__resident[(kind, key)] = factory()
+            self.__misses += 1
+        else:
+            self.__hits += 1
+        return self.__resident[(kind, key)]
+
+    def __make_monitor(self):
+        # translate the monitoring config again so that its output goes to the point directory
+        StaticEnv.get_static_env("global").add_env({"pylogger.log_dirpath": Logger().log_dirpath})
+        translated_config = MacroTranslator(StaticEnv.get_static_env("global")).translate(
+            self.msys_config_text
+        )
+        return MSys(MSysConfig.from_yaml_string(translated_config))
+
+    def point_config(self, overrides) -> dict:
+        config = copy.deepcopy(self.base_config)
+        for path, value in overrides.items():
+            set_by_path(config, path, value)
+        actions = config["rag"]["action"]
+        if actions["preprocess"] or actions["embedding"] or actions["insert"]:
+            raise ValueError("Sweep points only run the query path, run the ingest separately")
+        if not actions["generation"]:
+            raise ValueError("Sweep points need the generation action")
+        pipeline_mode = config["rag"].get("pipeline", {}).get("mode", "batch")
+        if pipeline_mode not in SweepRunner.SUPPORTED_MODES:
+            raise ValueError(f"Unsupported pipeline mode for sweeps: {pipeline_mode}")
+        if config["bench"]["type"] != "text":
+            raise ValueError("Sweeps only support text benchmarks")
+        return config
+
+    def run_point(self, point_idx, overrides) -> dict:
+        config = self.point_config(overrides)
+        output_path = Logger().set_output_subdir(f"point_{point_idx:03d}")
+        cprint.iprintf(f"*** Sweep point {point_idx}: {overrides}, output: {output_path}")
+        output_config(config, os.path.join(output_path, "config.yaml"))
+        with open(os.path.join(output_path, "point.yaml"), "w") as fout:
+            yaml.dump(overrides, fout, default_flow_style=False)
+        self.__hits = self.__misses = 0
+
+        components = resolve_components(config)
+        db_config = config["sys"]["vector_db"]
+        if db_config["collection_name"] != "":
+            collection_name = get_db_collection_name(db_config["collection_name"])
+        else:
+            collection_name = get_db_collection_name(f"{config['run_name']}")
+
+        def make_db_client():
+            db_kwargs = {
+                "db_path": db_config["db_path"],
+                "collection_name": collection_name,
+                "index_type": config["rag"]["build_index"]["index_type"],
+                "metric_type": config["rag"]["build_index"]["metric_type"],
+                "drop_previous_collection": db_config["drop_previous_collection"],
+            }
+            if db_config["type"] == "milvus":
+                db_kwargs["db_token"] = db_config["db_token"]
+            db_client = components["vector_db"](**db_kwargs)
+            db_client.setup()
+            return db_client
+
+        db_key = (db_config["type"], db_config["db_path"], collection_name)
+        db_client = self.__get_resident("vector_db", db_key, make_db_client)
+
+        # the question bank is shared by all points, only the first one opens it
+        request = build_request_stream(
+            lambda req_count: WikipediaRequests(
+                run_name=config["run_name"],
+                collection_name=collection_name,
+                req_type="query",
+                req_count=req_count,
+                question_cache_dir=config["rag"]["retrieval"].get("question_cache_dir"),
+            ),
+            config["rag"]["retrieval"]["question_num"],
+            config["rag"]["retrieval"].get("stream"),
+        )
+        request.init_requests()
+
+        monitor = self.__make_monitor()
+        with monitor:
+            log_time_breakdown("start")
+            index_params = (
+                config["rag"]["build_index"]["index_type"],
+                config["rag"]["build_index"]["metric_type"],
+            )
+            if (
+                config["rag"]["action"]["build_index"]
+                and self.__built_index.get(db_key) != index_params
+            ):
+                log_time_breakdown("build")
+                db_client.build_index(
+                    collection_name=collection_name,
+                    index_type=index_params[0],
+                    metric_type=index_params[1],
+                )
+                self.__built_index[db_key] = index_params
+
+            rag_config = config["rag"]
+            embedder = self.__get_resident(
+                "encoder",
+                (
+                    rag_config["embedding"]["sentence_transformers_name"],
+                    rag_config["embedding"]["device"],
+                ),
+                lambda: components["encoder"](
+                    device=rag_config["embedding"]["device"],
+                    sentence_transformers_name=rag_config["embedding"][
+                        "sentence_transformers_name"
+                    ],
+                ),
+            )
+            reranker = None
+            if rag_config["action"]["reranking"]:
+                reranker = self.__get_resident(
+                    "reranker",
+                    (
+                        rag_config["reranking"].get("type", "cross_encoder"),
+                        rag_config["reranking"]["rerank_model"],
+                        rag_config["reranking"]["device"],
+                    ),
+                    lambda: components["reranker"](
+                        model_name=rag_config["reranking"]["rerank_model"],
+                        top_n=rag_config["reranking"]["top_n"],
+                        device=rag_config["reranking"]["device"],
+                    ),
+                )
+                reranker.top_n = rag_config["reranking"]["top_n"]
+            evaluator = None
+            if rag_config["action"]["evaluate"]:
+                evaluator_type = rag_config["evaluate"].get("type", "ragas_vllm")
+                evaluator_kwargs = {"llm_path": rag_config["evaluate"]["evaluator_model"]}
+                if evaluator_type == "ragas_openai":
+                    evaluator_kwargs["emb_path"] = rag_config["evaluate"].get("embedding_model")
+                evaluator = self.__get_resident(
+                    "evaluator",
+                    (evaluator_type, rag_config["evaluate"]["evaluator_model"]),
+                    lambda: components["evaluator"](**evaluator_kwargs),
+                )
+            responser = self.__get_resident(
+                "responser",
+                (
+                    rag_config["generation"]["model"],
+                    rag_config["generation"]["device"],
+                    rag_config["generation"]["parallelism"],
+                ),
+                lambda: components["responser"](
+                    model=rag_config["generation"]["model"],
+                    device=rag_config["generation"]["device"],
+                    parallelism=rag_config["generation"]["parallelism"],
+                ),
+            )
+
+            retriever = BaseRetriever(
+                collection_name=collection_name,
+                top_k=rag_config["retrieval"]["top_k"],
+                retrieval_batch_size=rag_config["retrieval"]["retrieval_batch_size"],
+                client=db_client,
+            )
+            pipeline = components["pipeline"](
+                retriever=retriever,
+                responser=responser,
+                embedder=embedder,
+                reranker=reranker,
+                evaluator=evaluator,
+                keep_models_loaded=True,
+            )
+            pipeline_config = rag_config["pipeline"]
+            start_time = time.monotonic_ns()
+            pipeline.process(
+                request,
+                batch_size=pipeline_config["batch_size"],
+                pipelined=pipeline_config.get("mode", "batch") == "pipelined",
+                queue_depth=pipeline_config.get("queue_depth", 2),
+            )
+            wall_time = time.monotonic_ns() - start_time
+
+        Logger().set_output_subdir(None)
+        summary = {
+            "point": point_idx,
+            "overrides": overrides,
+            "wall_time": wall_time,
+            "resident_hits": self.__hits,
+            "resident_misses": self.__misses,
+        }
+        with open(os.path.join(Logger().log_dirpath, "sweep_summary.txt"), "a") as fout:
+            fout.write(
+                f"{point_idx}\t"
+                f"{wall_time}\t"
+                f"{self.__hits}\t"
+                f"{self.__misses}\t"
+                + "\t".join(f"{path}={value}" for path, value in overrides.items())
+                + "\n"
+            )
+        return summary
+
+    def free_resident(self):
+        for (kind, key), resident in self.__resident.items():
+            if kind == "encoder":
+                resident.free_encoder()
+            elif kind == "reranker" and resident.model is not None:
+                resident.free_reranker()
+            elif kind == "responser":
+                resident.free_llm()
+        self.__resident = {}
+        self.__built_index = {}
+
+    def run(self) -> list[dict]:
+        cprint.iprintf(f"*** Sweeping {len(self.points)} points")
+        summaries = []
+        try:
+            for point_idx, overrides in enumerate(self.points):
+                summaries.append(self.run_point(point_idx, overrides))
+        finally:
+            Logger().set_output_subdir(None)
+            self.free_resident()
+            report_import_times()
+
+        print("Sweep summary:")
+        for summary in summaries:
+            print(
+                f"  point {summary['point']:>3}: {summary['wall_time'] / 1e9:10.3f} s, "
+                f"{summary['resident_hits']} resident / {summary['resident_misses']} created, "
+                f"{summary['overrides']}"
+            )
+        return summaries
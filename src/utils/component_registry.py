@@ -0,0 +1,71 @@
+import importlib
+import os
+import sys
+import time
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+
+# (label, module name, import time in ns) of every module imported through timed_import
+__import_times = []
+
+
+def timed_import(module_name, label=None):
+    """
+    Import `module_name` and record how long it took. Modules already imported (directly or as a
+    dependency of an earlier import) are free, so the recorded times are incremental.
+    """
+    already_loaded = module_name in sys.modules
+    start_time = time.monotonic_ns()
+    module = importlib.import_module(module_name)
+    if not already_loaded:
+        __import_times.append((label or module_name, module_name, time.monotonic_ns() - start_time))
+    return module
+
+
+def get_import_times() -> list[tuple[str, str, int]]:
+    return list(__import_times)
+
+
+def report_import_times(filename="import_time_breakdown.txt"):
+    """Print the import time breakdown and write it to `filename` in the log directory"""
+    total_time = sum(import_time for _, _, import_time in __import_times)
+    print(f"Import time breakdown ({total_time / 1e9:.3f} s total):")
+    output_path = os.path.join(Logger().log_dirpath, filename)
+    with open(output_path, "w") as fout:
+        for label, module_name, import_time in __import_times:
+            print(f"  {label:<28} {import_time / 1e9:8.3f} s  ({module_name})")
+            fout.write(f"{label}\t{module_name}\t{import_time}\n")
+
+
+class ComponentRegistry:
+    """
+    Map config names of one kind of component (vector DB, encoder, evaluator, ...) to their
+    implementation, given as a "module.path:Attribute" string. The module of a component is only
+    imported the first time the component is looked up, and the import time is recorded.
+    """
+
+    def __init__(self, kind, entries=None):
+        self.kind = kind
+        self.__entries = dict(entries or {})
+        self.__loaded = {}
+
+    def register(self, name, target):
+        assert ":" in target, f"Expect 'module.path:Attribute', got {target}"
+        self.__entries[name] = target
+
+    def names(self) -> list[str]:
+        return list(self.__entries)
+
+    def __contains__(self, name):
+        return name in self.__entries
+
+    def get(self, name):
+        if name not in self.__loaded:
+            if name not in self.__entries:
+                raise ValueError(f"Unsupported {self.kind}: {name}, expect one of {self.names()}")
+            module_name, attr = self.__entries[name].split(":")
+            cprint.iprintf(f"*** Importing {self.kind} {name} from {module_name}")
+            module = timed_import(module_name, label=f"{self.kind}/{name}")
+            self.__loaded[name] = getattr(module, attr)
+        return self.__loaded[name]
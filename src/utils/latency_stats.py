@@ -0,0 +1,40 @@
+import math
+
+
+def percentile(sorted_values, pct):
+    """Linearly interpolated percentile of an already sorted list, `pct` is in [0, 100]"""
+    if len(sorted_values) == 0:
+        return float("nan")
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize_latency(values_ns, pcts=(50, 95, 99)) -> dict:
+    """
+    Summarize a list of latencies in ns.
+
+    Returns:
+        dict with `count`, `mean`, `min`, `max` and one `p{pct}` entry per requested percentile,
+        all latencies in ns.
+    """
+    sorted_values = sorted(values_ns)
+    summary = {
+        "count": len(sorted_values),
+        "mean": sum(sorted_values) / len(sorted_values) if sorted_values else float("nan"),
+        "min": sorted_values[0] if sorted_values else float("nan"),
+        "max": sorted_values[-1] if sorted_values else float("nan"),
+    }
+    for pct in pcts:
+        summary[f"p{pct}"] = percentile(sorted_values, pct)
+    return summary
+
+
+def format_latency_summary(summary, unit_scale=1e6, unit="ms") -> str:
+    return ", ".join(
+        f"{key}: {value}" if key == "count" else f"{key}: {value / unit_scale:.3f} {unit}"
+        for key, value in summary.items()
+    )
@@ -118,6 +118,9 @@ class Logger:
             self.__log_dirpath = ""
             self.__log_path = ""
 
+        # output files go to log_dirpath, which can be redirected to a sub-directory of it
+        self.__root_dirpath = self.__log_dirpath
+
         # register this component and a default logger
         module_name = self.__get_readable_name(__file__, 0)
         self.__default_logger: logging.Logger = logging.root.getChild(module_name)
@@ -144,6 +147,22 @@ class Logger:
     def log_path(self) -> str:
         return self.__log_path
 
+    def set_output_subdir(self, subdir: str | None) -> str:
+        """
+        Redirect output files (everything written under log_dirpath) to `subdir` inside the run's
+        log directory, creating it if needed. `None` restores the run's log directory. The log file
+        itself stays in the run's log directory.
+
+        Returns:
+            the new log_dirpath
+        """
+        if subdir is None or self.__root_dirpath == "":
+            self.__log_dirpath = self.__root_dirpath
+        else:
+            self.__log_dirpath = os.path.join(self.__root_dirpath, subdir)
+            os.makedirs(self.__log_dirpath, exist_ok=True)
+        return self.__log_dirpath
+
     @property
     def log_time_format(self) -> str:
         return self.__log_time_format
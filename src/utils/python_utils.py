@@ -79,20 +79,20 @@ def get_by_path(obj, path):
     return obj
 
 
-# def set_by_path(obj, path, value):
-#     keys = path.split('.')
-#     for key in keys[:-1]:
-#         try:
-#             key = int(key)
-#         except ValueError:
-#             pass
-#         obj = obj[key]
-#     last_key = keys[-1]
-#     try:
-#         last_key = int(last_key)
-#     except ValueError:
-#         pass
-#     obj[last_key] = value
+def set_by_path(obj, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        try:
+            key = int(key)
+        except ValueError:
+            pass
+        obj = obj[key]
+    last_key = keys[-1]
+    try:
+        last_key = int(last_key)
+    except ValueError:
+        pass
+    obj[last_key] = value
 
 
 def find_device_for_path(path: str, device_name_only: bool = True) -> str | None:
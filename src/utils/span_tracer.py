@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+import utils.colored_print as cprint
+from utils.logger import Logger
+from utils.latency_stats import summarize_latency, format_latency_summary
+
+
+class SpanTracer:
+    """
+    Collect one span per request and per stage (embed, retrieve, rerank, prompt, generate, ...).
+
+    A span covers the monotonic [start_ns, end_ns) interval of the batch the request was part of,
+    together with the batch id and the sizes involved. Size columns not relevant to a stage are
+    left null. Spans are kept in a columnar in-memory buffer and dumped as an Arrow IPC file.
+    """
+
+    SCHEMA = pa.schema(
+        [
+            pa.field("req_id", pa.int64()),
+            pa.field("batch_idx", pa.int64()),
+            pa.field("stage", pa.dictionary(pa.int8(), pa.string())),
+            pa.field("start_ns", pa.int64()),
+            pa.field("end_ns", pa.int64()),
+            pa.field("batch_size", pa.int32()),
+            pa.field("input_tokens", pa.int32()),
+            pa.field("output_tokens", pa.int32()),
+            pa.field("top_k", pa.int32()),
+            pa.field("n_candidates", pa.int32()),
+        ]
+    )
+    SIZE_FIELDS = ["input_tokens", "output_tokens", "top_k", "n_candidates"]
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__columns = {field.name: [] for field in SpanTracer.SCHEMA}
+
+    def __len__(self):
+        return len(self.__columns["req_id"])
+
+    def record(self, stage, batch_idx, req_ids, start_ns, end_ns, **sizes):
+        """
+        Record the span of `stage` for every request in `req_ids`. Each size in `sizes` (one of
+        SIZE_FIELDS) is either a scalar shared by the whole batch or a list with one value per
+        request.
+        """
+        unknown_sizes = set(sizes) - set(SpanTracer.SIZE_FIELDS)
+        assert len(unknown_sizes) == 0, f"Unknown span size fields: {unknown_sizes}"
+        nreqs = len(req_ids)
+        with self.__lock:
+            self.__columns["req_id"].extend(req_ids)
+            self.__columns["batch_idx"].extend([batch_idx] * nreqs)
+            self.__columns["stage"].extend([stage] * nreqs)
+            self.__columns["start_ns"].extend([start_ns] * nreqs)
+            self.__columns["end_ns"].extend([end_ns] * nreqs)
+            self.__columns["batch_size"].extend([nreqs] * nreqs)
+            for field in SpanTracer.SIZE_FIELDS:
+                value = sizes.get(field, None)
+                if isinstance(value, (list, tuple)):
+                    assert len(value) == nreqs, f"Expect {nreqs} values for {field}"
+                    self.__columns[field].extend(value)
+                else:
+                    self.__columns[field].extend([value] * nreqs)
+
+    @contextmanager
+    def span(self, stage, batch_idx, req_ids):
+        """
+        Time the enclosed block as a span of `stage`. Sizes can be filled into the yielded dict
+        from inside the block.
+        """
+        sizes = {}
+        start_ns = time.monotonic_ns()
+        yield sizes
+        end_ns = time.monotonic_ns()
+        self.record(stage, batch_idx, req_ids, start_ns, end_ns, **sizes)
+
+    def to_table(self) -> pa.Table:
+        with self.__lock:
+            return pa.Table.from_pydict(self.__columns, schema=SpanTracer.SCHEMA)
+
+    def stage_latencies(self) -> dict[str, list[int]]:
+        """Per-request latency of every stage, keyed by stage name in first-seen order"""
+        latencies = {}
+        with self.__lock:
+            for stage, start_ns, end_ns in zip(
+                self.__columns["stage"], self.__columns["start_ns"], self.__columns["end_ns"]
+            ):
+                latencies.setdefault(stage, []).append(end_ns - start_ns)
+        return latencies
+
+    def batch_latencies(self) -> dict[int, dict[str, int]]:
+        """
+        Total latency of every stage of every batch, keyed by batch id then by stage name. A stage
+        recorded as several spans within the same batch (e.g. one span per query) is summed.
+        """
+        latencies = {}
+        seen_spans = set()
+        with self.__lock:
+            for batch_idx, stage, start_ns, end_ns in zip(
+                self.__columns["batch_idx"],
+                self.__columns["stage"],
+                self.__columns["start_ns"],
+                self.__columns["end_ns"],
+            ):
+                if (batch_idx, stage, start_ns) in seen_spans:
+                    continue
+                seen_spans.add((batch_idx, stage, start_ns))
+                batch_latencies = latencies.setdefault(batch_idx, {})
+                batch_latencies[stage] = batch_latencies.get(stage, 0) + end_ns - start_ns
+        return latencies
+
+    def dump(self, name) -> str:
+        """
+        Write all spans to `{name}_spans.arrow` and the per-stage latency distributions to
+        `{name}_span_summary.txt` under the log directory. Returns the path of the span file.
+        """
+        output_dir = Logger().log_dirpath
+        span_path = os.path.join(output_dir, f"{name}_spans.arrow")
+        table = self.to_table()
+        with pa.OSFile(span_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        summary_path = os.path.join(output_dir, f"{name}_span_summary.txt")
+        print(f"Span summary ({len(table)} spans, per-request stage latency):")
+        with open(summary_path, "w") as fout:
+            for stage, latencies in self.stage_latencies().items():
+                summary = summarize_latency(latencies)
+                print(f"  {stage:<9} {format_latency_summary(summary)}")
+                fout.write(
+                    f"{stage}\t"
+                    + "\t".join(
+                        f"{value}" if key == "count" else f"{value:.0f}"
+                        for key, value in summary.items()
+                    )
+                    + "\n"
+                )
+        cprint.iprintf(f"*** Spans saved to {span_path}")
+        return span_path
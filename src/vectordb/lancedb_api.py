@@ -7,7 +7,6 @@ import concurrent.futures
 import lancedb
 import pyarrow as pa
 
-
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.reverse()
 from vectordb.DBInstance import DBInstance
@@ -20,6 +19,8 @@ class lance_client(DBInstance):
 
     def setup(self):
         self.client = lancedb.connect(self.db_path)
+        self.async_client = None
+        self.async_tables = {}
         print(f"***Connected to Lancedb client at {self.db_path}\n")
 
     def has_collection(self, collection_name):
@@ -200,6 +201,21 @@ class lance_client(DBInstance):
         print(f"***Query search completed.")
         return contexts_results
 
+    async def async_query_search(self, query_vector, topk, collection_name=None):
+        # search a single query vector through the lancedb async API
+        if self.async_client is None:
+            self.async_client = await lancedb.connect_async(self.db_path)
+        if collection_name not in self.async_tables:
+            self.async_tables[collection_name] = await self.async_client.open_table(collection_name)
+        tbl = self.async_tables[collection_name]
+        results = await tbl.query().nearest_to(query_vector).limit(topk).to_list()
+
+        context_format = """Source #{source_idx}\nDetail: {source_detail}\n"""
+        return [
+            context_format.format(source_idx=entry_idx, source_detail=result["text"])
+            for entry_idx, result in enumerate(results)
+        ]
+
     def query_search_image(
         self,
         query_vector,
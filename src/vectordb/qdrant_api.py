@@ -5,6 +5,7 @@ import random
 from tqdm import tqdm
 import re
 import concurrent.futures
+import threading
 import lancedb
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,7 +13,7 @@ sys.path.reverse()
 from vectordb.DBInstance import DBInstance
 
 # qdrant_api specific
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 
 # from qdrant_client.models import Distance, VectorParams
 
@@ -27,11 +28,24 @@ class qdrant_client(DBInstance):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.id_num = 0
+        self.id_lock = threading.Lock()
 
     def setup(self):
         self.client = QdrantClient(url=self.db_path, timeout=200)
+        self.async_client = None
         print(f"***Connected to Qdrant client at {self.db_path}\n")
 
+    def reserve_ids(self, count):
+        """First of `count` consecutive point ids, disjoint from those of concurrent insertions"""
+        with self.id_lock:
+            id_base = self.id_num
+            self.id_num += count
+        return id_base
+
+    def sync_id_num(self, collection_name):
+        # continue point ids after the ones already in the collection instead of overwriting them
+        self.id_num = self.client.count(collection_name=collection_name, exact=True).count
+
     def has_collection(self, collection_name):
         if self.client.collection_exists(collection_name=collection_name):
             print(f"***Collection: {collection_name} exists.")
@@ -79,13 +93,14 @@ class qdrant_client(DBInstance):
         count = 0
 
         total_count = min(len(vector), len(chunks))
+        # several threads may insert at once (e.g. mixed workloads), each one gets its own ids
+        id_base = self.reserve_ids(total_count)
         # pbar = tqdm(total=total_count, desc="Inserting batches")
         for i in tqdm(range(0, total_count, insert_batch_size), desc="Inserting batches"):
             point_list = []
             end_idx = min(i + insert_batch_size, total_count)
-            for v, c in zip(vector[i:end_idx], chunks[i:end_idx]):
-                record = models.PointStruct(id=self.id_num, vector=v, payload={"chunk": c})
-                self.id_num += 1
+            for offset, (v, c) in enumerate(zip(vector[i:end_idx], chunks[i:end_idx])):
+                record = models.PointStruct(id=id_base + i + offset, vector=v, payload={"chunk": c})
                 point_list.append(record)
 
             # print(f"***Start insert: {len(point_list)}")
@@ -105,13 +120,13 @@ class qdrant_client(DBInstance):
         print(f"***Start insert: {total_chunks_num}")
 
         point_list = []
-        for dict in dict_list:
+        id_base = self.reserve_ids(total_chunks_num)
+        for offset, dict in enumerate(dict_list):
             record = {
-                "id": self.id_num,
+                "id": id_base + offset,
                 "payload": {"chunk": dict["text"]},
                 "vector": dict["vector"],
             }
-            self.id_num += 1
             point_list.append(record)
 
         batch_size = 1000
@@ -221,6 +236,20 @@ class qdrant_client(DBInstance):
         print(f"***Query search completed.")
         return contexts_results
 
+    async def async_query_search(self, query_vector, topk, collection_name=None):
+        # search a single query vector through the qdrant async client
+        if self.async_client is None:
+            self.async_client = AsyncQdrantClient(url=self.db_path, timeout=200)
+        response = await self.async_client.query_points(
+            collection_name=collection_name, query=query_vector, limit=topk, with_payload=True
+        )
+
+        context_format = """Source #{source_idx}\nDetail: {source_detail}\n"""
+        return [
+            context_format.format(source_idx=entry_idx, source_detail=point.payload['chunk'])
+            for entry_idx, point in enumerate(response.points)
+        ]
+
     def build_index(
         self,
         collection_name,
@@ -111,5 +111,54 @@ def pdf_test():
     )
 
 
+def pdf_download_test():
+    # Download from a local HTTP stand-in, interrupt, then resume
+    import tempfile
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from datasetLoader.PDFDownloader import PDFDownloader
+
+    nfiles = 64
+    requested = []
+
+    class PDFHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            if self.path.endswith("13.pdf"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = b"%PDF-1.4 " + self.path.encode() * 1024
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PDFHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    items = [(f"{i}.pdf", f"{base_url}/papers/{i}.pdf") for i in range(nfiles)]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        downloader = PDFDownloader(output_dir, max_workers=8, per_host_rate=0, max_retries=0)
+        stats = downloader.download(items, load_num=16)
+        print(stats)
+        assert stats["downloaded"] == 16
+
+        # resuming only fetches what is missing, the failing file is replaced by the next one
+        requested.clear()
+        stats = downloader.download(items, load_num=32)
+        print(stats)
+        assert stats["skipped"] == 16 and stats["downloaded"] == 16 and stats["failed"] == 1
+        assert len(requested) == 17
+        pdfs = [f for f in os.listdir(output_dir) if f.endswith(".pdf")]
+        assert len(pdfs) == 32 and "13.pdf" not in pdfs
+    server.shutdown()
+
+
 if __name__ == "__main__":
     pdf_test()
+    pdf_download_test()